@@ -0,0 +1,7 @@
+const { getDefaultConfig } = require('expo/metro-config');
+
+const config = getDefaultConfig(__dirname);
+// the quantized model bundle (src/data/model_bundle.wqb) ships as an asset
+config.resolver.assetExts.push('wqb');
+
+module.exports = config;
@@ -0,0 +1,163 @@
+// Loader and evaluator for the quantized model bundle (backend/model_bundle.py).
+//
+// The bundle holds the LightGBM boosters of the backend as typed arrays; this
+// evaluates them on the device so predictions match the backend's ML models
+// instead of the simplified coefficients.
+
+const MAGIC = 'WQB1';
+const FORMAT = 'wq-quantized-trees';
+
+// flag bits of a tree node (backend/compact_models.py)
+const DEFAULT_LEFT = 1;
+const MISSING_NAN = 2;
+const MISSING_ZERO = 4;
+const ZERO_THRESHOLD = 1e-35;
+
+const float16ToNumber = (h) => {
+  const sign = h & 0x8000 ? -1 : 1;
+  const exponent = (h >> 10) & 0x1f;
+  const fraction = h & 0x3ff;
+  if (exponent === 0) return sign * fraction * 2 ** -24;
+  if (exponent === 0x1f) return fraction ? NaN : sign * Infinity;
+  return sign * (1 + fraction / 1024) * 2 ** (exponent - 15);
+};
+
+// numpy dtype string -> reader of `count` values at `offset`
+const readers = {
+  '<f8': (buf, offset, count) => new Float64Array(buf, offset, count),
+  '<f4': (buf, offset, count) => new Float32Array(buf, offset, count),
+  '<f2': (buf, offset, count) => Float64Array.from(new Uint16Array(buf, offset, count), float16ToNumber),
+  '|i1': (buf, offset, count) => new Int8Array(buf, offset, count),
+  '|u1': (buf, offset, count) => new Uint8Array(buf, offset, count),
+  '<i2': (buf, offset, count) => new Int16Array(buf, offset, count),
+  '<u2': (buf, offset, count) => new Uint16Array(buf, offset, count),
+  '<i4': (buf, offset, count) => new Int32Array(buf, offset, count),
+  '<i8': (buf, offset, count) => Float64Array.from(new BigInt64Array(buf, offset, count), Number),
+};
+
+const decodeAscii = (bytes) => {
+  let out = '';
+  for (let i = 0; i < bytes.length; i += 4096) {
+    out += String.fromCharCode.apply(null, bytes.subarray(i, i + 4096));
+  }
+  return out;
+};
+
+// { header, arrays } of a bundle; `buffer` is an ArrayBuffer holding the whole file
+export const parseModelBundle = (buffer) => {
+  const bytes = new Uint8Array(buffer);
+  if (decodeAscii(bytes.subarray(0, 4)) !== MAGIC) {
+    throw new Error('not a model bundle');
+  }
+  const headerLength = new DataView(buffer).getUint32(4, true);
+  // the header is JSON; non-ASCII labels are escaped by the writer
+  const header = JSON.parse(decodeAscii(bytes.subarray(8, 8 + headerLength)));
+  if (header.format !== FORMAT) {
+    throw new Error(`unexpected bundle format ${header.format}`);
+  }
+  const base = 8 + headerLength;
+  const arrays = {};
+  Object.entries(header.arrays).forEach(([name, spec]) => {
+    const read = readers[spec.dtype];
+    if (!read) throw new Error(`unsupported dtype ${spec.dtype} for ${name}`);
+    const count = spec.shape.reduce((a, b) => a * b, 1);
+    arrays[name] = read(buffer, base + spec.offset, count);
+  });
+  return { header, arrays };
+};
+
+class BundleTrees {
+  constructor(spec, arrays, thresholds, featureOffsets) {
+    const a = (field) => arrays[spec.prefix + field];
+    this.splitFeature = a('split_feature');
+    this.flags = a('flags');
+    this.children = a('children');
+    this.roots = a('roots');
+    // absolute thresholds and leaf values, as the backend evaluates them
+    const bins = a('threshold_bin');
+    this.threshold = Float64Array.from(this.splitFeature, (f, i) => thresholds[featureOffsets[f] + bins[i]]);
+    const counts = a('leaf_counts');
+    const bias = a('tree_bias');
+    const offsets = a('leaf_value');
+    this.leafValue = new Float64Array(offsets.length);
+    let j = 0;
+    for (let t = 0; t < counts.length; t++) {
+      for (let k = 0; k < counts[t]; k++, j++) {
+        this.leafValue[j] = bias[t] + offsets[j];
+      }
+    }
+  }
+
+  goesLeft(node, x) {
+    const flags = this.flags[node];
+    const nan = Number.isNaN(x);
+    const missing = (nan && (flags & MISSING_NAN) !== 0)
+      || ((flags & MISSING_ZERO) !== 0 && (nan || Math.abs(x) <= ZERO_THRESHOLD));
+    if (missing) return (flags & DEFAULT_LEFT) !== 0;
+    // with missing type None LightGBM maps NaN to 0
+    return (nan ? 0 : x) <= this.threshold[node];
+  }
+
+  predict(row) {
+    let sum = 0;
+    for (let t = 0; t < this.roots.length; t++) {
+      let node = this.roots[t];
+      while (node >= 0) {
+        node = this.goesLeft(node, row[this.splitFeature[node]])
+          ? this.children[2 * node]
+          : this.children[2 * node + 1];
+      }
+      sum += this.leafValue[~node];
+    }
+    return sum;
+  }
+}
+
+export class BundlePredictor {
+  constructor({ header, arrays }) {
+    this.features = header.features;
+    this.transforms = header.transforms || {};
+    const encoders = header.encoders || {};
+    this.riverCodes = Object.fromEntries((encoders.le_river || []).map((name, i) => [name, i]));
+    this.locationCodes = Object.fromEntries((encoders.le_loc || []).map((name, i) => [name, i]));
+    this.targets = {};
+    Object.entries(header.targets).forEach(([target, spec]) => {
+      this.targets[target] = new BundleTrees(spec, arrays, arrays.thresholds, arrays.feature_offsets);
+    });
+  }
+
+  featureRow(river, location, month, year) {
+    // unknown labels map to 0, as in the backend
+    const values = {
+      river_enc: this.riverCodes[river] || 0,
+      loc_enc: this.locationCodes[location] || 0,
+      month_sin: Math.sin((2 * Math.PI * month) / 12),
+      month_cos: Math.cos((2 * Math.PI * month) / 12),
+      year_off: year - 2020,
+    };
+    return this.features.map((f) => values[f]);
+  }
+
+  // { target: value } in output units, rounded like the backend
+  predict(river, location, month, year) {
+    const row = this.featureRow(river, location, month, year);
+    const predictions = {};
+    Object.entries(this.targets).forEach(([target, trees]) => {
+      let value = trees.predict(row);
+      if (this.transforms[target] === 'log1p') {
+        value = Math.max(Math.expm1(value), 0);
+      }
+      predictions[target] = Math.round(value * 100) / 100;
+    });
+    return predictions;
+  }
+}
+
+// BundlePredictor for the bundle shipped with the app (src/data/model_bundle.wqb)
+export const loadModelBundle = async () => {
+  const { Asset } = require('expo-asset');
+  const asset = Asset.fromModule(require('../data/model_bundle.wqb'));
+  await asset.downloadAsync();
+  const response = await fetch(asset.localUri || asset.uri);
+  return new BundlePredictor(parseModelBundle(await response.arrayBuffer()));
+};
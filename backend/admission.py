@@ -0,0 +1,232 @@
+"""Typed `/interpolate_predict` bodies and cost-based admission per tenant.
+
+`InterpolateRequest` bounds the body (sample points, polyline vertices, month,
+year) before any work starts. `estimate_cost` turns a valid body and the size of
+the served network into work units, roughly one point/segment or point/station
+pair each; on the 1-CPU reference container a unit costs ~100 ns, so 10 million
+units is about a second:
+
+  start/end requests    points x (river segments + stations)     every sample is projected
+                                                                 onto the network
+  `locations` polyline  points x (polyline vertices + stations)  + the same again for
+                                                                 `idw_metric: 'river'`
+
+Each tenant (the `X-Tenant` header; tenants without their own entry share the
+`default` budget) has:
+
+  max_cost     cap for one request. Larger requests are rejected with 413, or run
+               with fewer sample points when the body has `over_budget: 'downsample'`
+               (or the tenant's `over_budget` says so); the response then carries
+               an `admission` entry with the original and the served point count
+  rate, burst  a token bucket of units per second. A request the bucket cannot
+               cover waits (queues) until it can, up to `max_wait_s`; longer waits
+               are rejected with 429 and Retry-After
+
+Environment:
+  WQ_MAX_POINTS          most sample points per request (default 100000)
+  WQ_MAX_LOCATIONS       most polyline vertices per request (default 100000)
+  WQ_MAX_REQUEST_COST    default max_cost (default 5e7 units)
+  WQ_TENANT_RATE         default rate (default 2e7 units/s)
+  WQ_TENANT_BURST        default burst (default 1e8 units)
+  WQ_ADMISSION_WAIT_S    default max_wait_s (default 5)
+  WQ_TENANT_BUDGETS      JSON file {tenant: {max_cost, rate, burst, max_wait_s, over_budget}};
+                         missing keys take the defaults above
+"""
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Literal, Optional, Union
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+from backend.metrics import Counter
+from backend.polyline import vertex_count
+
+MAX_POINTS = int(os.environ.get('WQ_MAX_POINTS', 100_000))
+MAX_LOCATIONS = int(os.environ.get('WQ_MAX_LOCATIONS', 100_000))
+TENANT_HEADER = 'x-tenant'
+DEFAULT_TENANT = 'default'
+DEFAULT_BUDGET = {
+    'max_cost': float(os.environ.get('WQ_MAX_REQUEST_COST', 5e7)),
+    'rate': float(os.environ.get('WQ_TENANT_RATE', 2e7)),
+    'burst': float(os.environ.get('WQ_TENANT_BURST', 1e8)),
+    'max_wait_s': float(os.environ.get('WQ_ADMISSION_WAIT_S', 5.0)),
+    'over_budget': 'reject',
+}
+
+admissions = Counter('wq_admission_total', 'Admission decisions for /interpolate_predict by tenant budget.', labelnames=('tenant', 'decision'))
+
+
+class LatLon(BaseModel):
+    model_config = ConfigDict(extra='allow')
+
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+
+
+class PackedCoords(BaseModel):
+    """Base64 packed `locations` (see `backend/polyline.py`)."""
+    data: str = Field(max_length=4 * MAX_LOCATIONS * 16 // 3 + 4)
+    dtype: Literal['f8', 'f4', 'i4'] = 'f8'
+    scale: Optional[float] = Field(None, gt=0)
+    delta: bool = False
+
+
+class InterpolateRequest(BaseModel):
+    """Body of `/interpolate_predict` (see `backend.main.run_interpolation`); unknown keys pass through."""
+    model_config = ConfigDict(extra='allow')
+
+    start: Optional[LatLon] = None
+    end: Optional[LatLon] = None
+    point: Optional[LatLon] = None
+    # JSON points, a Google encoded polyline (5 or 6 decimals) or packed coordinates
+    locations: Optional[Union[List[LatLon], str, PackedCoords]] = None
+    polyline_precision: Literal[5, 6] = 5
+    points: int = Field(5, ge=2, le=MAX_POINTS)
+    month: int = Field(6, ge=1, le=12)
+    year: int = Field(2023, ge=1900, le=2100)
+    follow_river: bool = False
+    blend: Literal['auto', 'river', 'idw'] = 'auto'
+    pick_from_input: bool = False
+    start_station_name: Optional[str] = None
+    end_station_name: Optional[str] = None
+    standards: Optional[Union[str, List[str]]] = None
+    debug: bool = False
+    idw_power: float = Field(2.0, gt=0, le=16)
+    idw_k: Optional[int] = Field(None, ge=1)
+    idw_radius_m: Optional[float] = Field(None, gt=0)
+    idw_metric: Literal['haversine', 'river'] = 'haversine'
+    over_budget: Optional[Literal['reject', 'downsample']] = None
+    path_tolerance_m: Optional[float] = Field(None, ge=0)
+
+    @field_validator('locations')
+    @classmethod
+    def _vertex_limit(cls, v):
+        if v is not None and vertex_count(v if isinstance(v, (str, list)) else v.model_dump()) > MAX_LOCATIONS:
+            raise ValueError(f'locations may have at most {MAX_LOCATIONS} vertices')
+        return v
+
+    def body(self) -> Dict[str, Any]:
+        """The fields the client sent, as the dict `run_interpolation` takes."""
+        return self.model_dump(exclude_unset=True)
+
+
+def estimate_cost(body: Dict[str, Any], stations: int, segments: int) -> float:
+    """Work units of one interpolation (see the module docstring)."""
+    points = int(body.get('points', 5))
+    vertices = vertex_count(body.get('locations'))
+    if vertices >= 2:
+        if body.get('pick_from_input'):
+            points = min(points, vertices)
+        cost = vertices + points * (vertices + stations)
+        if body.get('blend') == 'idw' and body.get('idw_metric') == 'river':
+            cost += (points + stations) * segments
+        return float(cost)
+    return float(points * (segments + stations))
+
+
+def max_points_within(body: Dict[str, Any], stations: int, segments: int, budget: float) -> int:
+    """Largest `points` for which `estimate_cost` stays within `budget` (0 when none does)."""
+    lo, hi = 0, int(body.get('points', 5))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_cost(dict(body, points=mid), stations, segments) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class TokenBucket:
+    """Units refilled at `rate` per second up to `burst`; may go negative by reservations."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, cost: float, max_wait_s: float) -> float:
+        """Take `cost` units; returns the seconds to wait before running, or -1 (nothing taken)
+        when that would exceed `max_wait_s`."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            wait = max(0.0, (cost - self.tokens) / self.rate) if self.rate > 0 else (0.0 if cost <= self.tokens else math.inf)
+            if wait > max_wait_s:
+                return -1.0
+            self.tokens -= cost
+            return wait
+
+    def retry_after(self, cost: float) -> float:
+        with self._lock:
+            return max(0.0, (cost - self.tokens) / self.rate) if self.rate > 0 else math.inf
+
+
+def load_budgets(path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    budgets = {DEFAULT_TENANT: dict(DEFAULT_BUDGET)}
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            for tenant, spec in json.load(f).items():
+                budgets[tenant] = dict(budgets.get(tenant, DEFAULT_BUDGET), **spec)
+    return budgets
+
+
+class Decision:
+    """Outcome of `AdmissionControl.admit`: `body` to run (after `wait` seconds) or an `error` response."""
+
+    def __init__(self, body: Optional[Dict[str, Any]] = None, wait: float = 0.0, error: Optional[Dict[str, Any]] = None,
+                 status: int = 200, headers: Optional[Dict[str, str]] = None, note: Optional[Dict[str, Any]] = None):
+        self.body = body
+        self.wait = wait
+        self.error = error
+        self.status = status
+        self.headers = headers or {}
+        self.note = note
+
+
+class AdmissionControl:
+    def __init__(self, budgets: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.budgets = budgets or load_budgets(os.environ.get('WQ_TENANT_BUDGETS'))
+        self._buckets = {name: TokenBucket(b['rate'], b['burst']) for name, b in self.budgets.items()}
+
+    def tenant(self, header: Optional[str]) -> str:
+        return header if header in self.budgets else DEFAULT_TENANT
+
+    def decide(self, tenant: str, body: Dict[str, Any], stations: int, segments: int) -> Decision:
+        budget = self.budgets[tenant]
+        cost = estimate_cost(body, stations, segments)
+        note = None
+        if cost > budget['max_cost']:
+            fitting = max_points_within(body, stations, segments, budget['max_cost'])
+            detail = {'estimated_cost': cost, 'max_cost': budget['max_cost'], 'max_points': fitting, 'tenant': tenant}
+            if (body.get('over_budget') or budget['over_budget']) != 'downsample' or fitting < 2:
+                admissions.inc(tenant=tenant, decision='reject_cost')
+                return Decision(error=dict(detail, error=f'request too expensive: estimated cost {cost:.3g} exceeds the '
+                                           f'{budget["max_cost"]:.3g} allowed per request; use at most {fitting} points '
+                                           f"or send \"over_budget\": \"downsample\""), status=413)
+            note = {'downsampled_from': int(body.get('points', 5)), 'points': fitting, 'estimated_cost': cost, 'max_cost': budget['max_cost']}
+            body = dict(body, points=fitting)
+            cost = estimate_cost(body, stations, segments)
+        wait = self._buckets[tenant].reserve(cost, budget['max_wait_s'])
+        if wait < 0:
+            retry = self._buckets[tenant].retry_after(cost)
+            admissions.inc(tenant=tenant, decision='reject_rate')
+            return Decision(error={'error': f'tenant budget exhausted: estimated cost {cost:.3g} needs {retry:.1f}s of the '
+                                            f'{budget["rate"]:.3g} units/s budget; retry later',
+                                   'estimated_cost': cost, 'rate': budget['rate'], 'retry_after_s': retry, 'tenant': tenant},
+                            status=429, headers={'Retry-After': str(max(1, math.ceil(retry)))})
+        admissions.inc(tenant=tenant, decision='downsample' if note else ('queue' if wait > 0 else 'admit'))
+        return Decision(body=body, wait=wait, note=note)
+
+    async def admit(self, header: Optional[str], body: Dict[str, Any], stations: int, segments: int) -> Decision:
+        """`decide`, then sleep out any queueing delay."""
+        decision = self.decide(self.tenant(header), body, stations, segments)
+        if decision.wait > 0:
+            await asyncio.sleep(decision.wait)
+        return decision
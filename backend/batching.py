@@ -0,0 +1,83 @@
+"""Dynamic micro-batching for single-row predictions.
+
+Callers `await batcher.submit(row)`; rows arriving within a short window (or until
+`max_rows` are queued) are scored with one call of the vectorised batch function,
+and each caller receives its own result. When the batch call raises, the rows are
+scored one by one, so only the callers whose rows fail get the error. The batch runs
+on the event loop, which is fine for the sub-millisecond NumPy scoring it is used for.
+
+Environment:
+  WQ_BATCH_WINDOW_MS  maximum time the first queued row waits for company (default 2)
+  WQ_BATCH_MAX_ROWS   flush as soon as this many rows are queued (default 256)
+"""
+import asyncio
+import os
+import time
+from typing import Any, Callable, List, Sequence
+
+from backend.metrics import Histogram
+
+BATCH_WINDOW_MS = float(os.environ.get('WQ_BATCH_WINDOW_MS', 2))
+BATCH_MAX_ROWS = int(os.environ.get('WQ_BATCH_MAX_ROWS', 256))
+
+batch_size = Histogram('wq_batch_size', 'Rows scored per micro-batch.', labelnames=('batcher',),
+                       buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+queue_wait = Histogram('wq_batch_queue_wait_seconds', 'Time a row waited in the micro-batch queue.', labelnames=('batcher',),
+                       buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1))
+
+
+class MicroBatcher:
+    def __init__(self, fn: Callable[[Sequence[Any]], List[Any]], name: str,
+                 window_ms: float = BATCH_WINDOW_MS, max_rows: int = BATCH_MAX_ROWS):
+        self.fn = fn
+        self.name = name
+        self.window = window_ms / 1000.0
+        self.max_rows = max_rows
+        self._pending = []
+        self._timer = None
+
+    async def submit(self, row: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((row, fut, time.perf_counter()))
+        if len(self._pending) >= self.max_rows:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await fut
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_rows], self._pending[self.max_rows:]
+        if self._pending:
+            # more than one batch queued: flush the rest on the next loop iteration
+            self._timer = asyncio.get_running_loop().call_soon(self._flush)
+        if not batch:
+            return
+        now = time.perf_counter()
+        for _, _, queued in batch:
+            queue_wait.observe(now - queued, batcher=self.name)
+        batch_size.observe(len(batch), batcher=self.name)
+        try:
+            results = self.fn([row for row, _, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            # one bad row must not fail its neighbours: score them one by one
+            for row, fut, _ in batch:
+                try:
+                    res = self.fn([row])[0]
+                except Exception as row_error:
+                    if not fut.done():
+                        fut.set_exception(row_error)
+                    continue
+                if not fut.done():
+                    fut.set_result(res)
+            return
+        for (_, fut, _), res in zip(batch, results):
+            if not fut.done():
+                fut.set_result(res)
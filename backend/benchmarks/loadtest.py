@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Load generator replaying the web app's request mix against a local server.
+
+Usage (from repository root):
+  python -m backend.benchmarks.loadtest --concurrency 1 4 16 64 --duration 20
+  python -m backend.benchmarks.loadtest --launcher fork --workers 4 --out load.json
+  python -m backend.benchmarks.loadtest --url http://127.0.0.1:8000 --mix predict_all=1
+
+`web/src/App.js` calls `/predict_all?month&year` whenever the selected date changes
+and `/interpolate_predict` whenever a route is drawn. A route is the slice of
+`preSampledRiver` between the nearest samples of two stations on the same river,
+sent with `pick_from_input` and `sampleCount` points (default 5, 1-50). When the
+user forces index medians, the start/end station names are sent as well. Request
+kinds are drawn from `--mix`:
+
+  predict_all         /predict_all for a random month and a recent year
+  interpolate         /interpolate_predict for a random station-to-station route
+  interpolate_names   ... with start/end station names (the explicit blend)
+  predict             /predict for a random station
+
+Each concurrency level runs that many closed-loop clients for `--duration`
+seconds on one asyncio loop (httpx). Throughput, latency percentiles and error
+rate are reported per request kind and level; errors are transport failures,
+non-2xx responses and bodies carrying an `error` key.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from backend.benchmarks.rss import LAUNCHERS, ROOT, free_port, wait_ready
+
+WEB_LOCATIONS = ROOT / 'web' / 'src' / 'locations.js'
+DEFAULT_MIX = {'predict_all': 0.55, 'interpolate': 0.35, 'interpolate_names': 0.05, 'predict': 0.05}
+# the date picker defaults to today; most sessions look at recent years
+YEARS = list(range(2017, 2027))
+YEAR_WEIGHTS = [1, 1, 1, 1, 2, 2, 3, 4, 6, 8]
+
+
+def load_web_geodata(path=WEB_LOCATIONS):
+    """(stations, pre-sampled river) from the web app's locations.js."""
+    text = Path(path).read_text(encoding='utf-8')
+    stations = [{'name': n, 'river': r, 'latitude': float(a), 'longitude': float(b)} for n, r, a, b in re.findall(
+        r"name:\s*'([^']+)',\s*river:\s*'([^']+)',\s*coordinate:\s*\{\s*latitude:\s*([0-9.+-]+),\s*longitude:\s*([0-9.+-]+)", text)]
+    m = re.search(r'export\s+const\s+preSampledRiver\s*=\s*\[([\s\S]+?)\];', text)
+    river = [{'latitude': float(a), 'longitude': float(b)} for a, b in
+             re.findall(r'latitude:\s*([0-9.+-]+),\s*longitude:\s*([0-9.+-]+)', m.group(1))] if m else []
+    return stations, river
+
+
+class RequestMix:
+    """Draws requests with the web app's parameter distributions."""
+
+    def __init__(self, stations, river, mix, seed=0):
+        self.rng = random.Random(seed)
+        self.stations = stations
+        self.river = river
+        self.kinds = [k for k, w in mix.items() if w > 0]
+        self.weights = [mix[k] for k in self.kinds]
+        by_river = {}
+        for s in stations:
+            by_river.setdefault(s['river'], []).append(s)
+        self.pairs = [(a, b) for group in by_river.values() for a in group for b in group if a is not b]
+
+    def _date(self):
+        return self.rng.randint(1, 12), self.rng.choices(YEARS, YEAR_WEIGHTS)[0]
+
+    def _nearest(self, s):
+        return min(range(len(self.river)), key=lambda i: (self.river[i]['latitude'] - s['latitude']) ** 2 + (self.river[i]['longitude'] - s['longitude']) ** 2)
+
+    def _route(self, names):
+        start, end = self.rng.choice(self.pairs)
+        a, b = sorted((self._nearest(start), self._nearest(end)))
+        month, year = self._date()
+        # most users keep the default sample count
+        points = 5 if self.rng.random() < 0.6 else self.rng.randint(1, 50)
+        body = {'locations': self.river[a:b + 1], 'points': points, 'month': month, 'year': year,
+                'pick_from_input': True, 'blend': 'river'}
+        if names:
+            body['start_station_name'] = start['name']
+            body['end_station_name'] = end['name']
+        return body
+
+    def next(self):
+        """(kind, method, path, params, json_body)."""
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == 'predict_all':
+            month, year = self._date()
+            return kind, 'GET', '/predict_all', {'month': month, 'year': year}, None
+        if kind == 'predict':
+            s = self.rng.choice(self.stations)
+            month, year = self._date()
+            return kind, 'POST', '/predict', None, {'river': s['river'], 'location': s['name'], 'month': month, 'year': year}
+        return kind, 'POST', '/interpolate_predict', None, self._route(kind == 'interpolate_names')
+
+
+def _percentile(sorted_vals, q):
+    if not sorted_vals:
+        return None
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+def summarize(samples, elapsed):
+    """samples: list of (latency_s, ok). Latencies in ms, throughput in requests/s."""
+    lat = sorted(s for s, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': errors / len(samples) if samples else 0.0,
+        'throughput_rps': len(samples) / elapsed if elapsed else 0.0,
+        'p50_ms': _percentile(lat, 0.5) * 1e3 if lat else None,
+        'p90_ms': _percentile(lat, 0.9) * 1e3 if lat else None,
+        'p99_ms': _percentile(lat, 0.99) * 1e3 if lat else None,
+        'max_ms': lat[-1] * 1e3 if lat else None,
+    }
+
+
+async def run_level(client, mix, concurrency, duration, timeout):
+    samples = {}
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            kind, method, path, params, body = mix.next()
+            t0 = time.perf_counter()
+            ok = False
+            try:
+                r = await client.request(method, path, params=params, json=body, timeout=timeout)
+                ok = r.is_success and not (isinstance(r.json(), dict) and 'error' in r.json())
+            except Exception:
+                pass
+            samples.setdefault(kind, []).append((time.perf_counter() - t0, ok))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    out = {kind: summarize(s, elapsed) for kind, s in sorted(samples.items())}
+    out['all'] = summarize([x for s in samples.values() for x in s], elapsed)
+    return out
+
+
+async def run(base_url, mix, levels, duration, warmup, timeout):
+    import httpx
+    results = {}
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+        if warmup:
+            await run_level(client, mix, min(4, max(levels)), warmup, timeout)
+        for c in levels:
+            results[str(c)] = level = await run_level(client, mix, c, duration, timeout)
+            for kind, r in level.items():
+                p50 = f'{r["p50_ms"]:.1f}' if r['p50_ms'] is not None else '-'
+                p99 = f'{r["p99_ms"]:.1f}' if r['p99_ms'] is not None else '-'
+                print(f'{c:>5} {kind:<18} {r["requests"]:>7} {r["throughput_rps"]:>9.1f} {p50:>9} {p99:>9} {r["error_rate"] * 100:>7.2f}%', flush=True)
+    return results
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f'unknown request kind {name!r} (have {", ".join(DEFAULT_MIX)})')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--url', help='target a running server instead of launching one')
+    p.add_argument('--launcher', choices=sorted(LAUNCHERS), default='uvicorn')
+    p.add_argument('--workers', type=int, default=1)
+    p.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    p.add_argument('--duration', type=float, default=10.0, help='seconds per concurrency level')
+    p.add_argument('--warmup', type=float, default=2.0, help='seconds of traffic before the first level')
+    p.add_argument('--timeout', type=float, default=30.0, help='per-request timeout in seconds')
+    p.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help='e.g. predict_all=0.6,interpolate=0.4')
+    p.add_argument('--web-locations', default=str(WEB_LOCATIONS), help="locations.js with puneLocations and preSampledRiver")
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--out', help='write results as JSON to this file')
+    args = p.parse_args(argv)
+
+    try:
+        import httpx  # noqa: F401
+    except ImportError:
+        print('the load generator needs httpx (pip install httpx)')
+        return 1
+
+    stations, river = load_web_geodata(args.web_locations)
+    mix = RequestMix(stations, river, args.mix, args.seed)
+
+    proc = None
+    base_url = args.url
+    if base_url is None:
+        port = free_port()
+        proc = subprocess.Popen(LAUNCHERS[args.launcher](port, args.workers), cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base_url = f'http://127.0.0.1:{port}'
+        if not wait_ready(port):
+            proc.kill()
+            print(f'{args.launcher} server did not come up on port {port}')
+            return 1
+    print(f'target {base_url}; {len(stations)} stations, {len(river)} route samples')
+    print(f'{"conc":>5} {"kind":<18} {"requests":>7} {"req/s":>9} {"p50 ms":>9} {"p99 ms":>9} {"errors":>8}')
+    try:
+        results = asyncio.run(run(base_url, mix, args.concurrency, args.duration, args.warmup, args.timeout))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'target': args.url or f'{args.launcher} x{args.workers}', 'mix': args.mix, 'duration_s': args.duration,
+                       'levels': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
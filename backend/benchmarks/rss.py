@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Per-worker memory benchmark: preload-and-fork launcher vs `uvicorn --workers`.
+
+Usage (from repository root, Linux only):
+  python -m backend.benchmarks.rss --workers 4
+  python -m backend.benchmarks.rss --workers 1 2 4 8 --out rss.json
+
+For every launcher and worker count the server is started on a free port, warmed
+with a few `/predict_all` and `/interpolate_predict` calls, and then each worker's
+RSS, PSS (proportional share of shared pages) and USS (private pages) are read
+from `/proc/<pid>/smaps_rollup`. PSS/USS are what grow with the worker count;
+RSS counts shared pages once per worker and so overstates the total.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+
+LAUNCHERS = {
+    'fork': lambda port, n: [sys.executable, '-m', 'backend.serve', '--port', str(port), '--workers', str(n), '--log-level', 'warning'],
+    'uvicorn': lambda port, n: [sys.executable, '-m', 'uvicorn', 'backend.main:app', '--port', str(port), '--workers', str(n), '--log-level', 'warning'],
+}
+
+WARM_BODY = {
+    'start': {'latitude': 18.520976, 'longitude': 73.849634},
+    'end': {'latitude': 18.5145, 'longitude': 73.8723},
+    'points': 20, 'month': 6, 'year': 2023, 'follow_river': True,
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def memory_kb(pid):
+    """Return {'rss', 'pss', 'uss'} in kB for a process from smaps_rollup."""
+    vals = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':'):
+                vals[parts[0][:-1]] = int(parts[1])
+    return {
+        'rss': vals.get('Rss', 0),
+        'pss': vals.get('Pss', 0),
+        'uss': vals.get('Private_Clean', 0) + vals.get('Private_Dirty', 0),
+    }
+
+
+def descendants(pid):
+    """All descendant pids of `pid` (uvicorn's children include a resource tracker)."""
+    children = {}
+    for d in os.listdir('/proc'):
+        if not d.isdigit():
+            continue
+        try:
+            with open(f'/proc/{d}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(d))
+    out, todo = [], [pid]
+    while todo:
+        for c in children.get(todo.pop(), []):
+            out.append(c)
+            todo.append(c)
+    return out
+
+
+def cmdline(pid):
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            return f.read().replace(b'\0', b' ').decode(errors='replace')
+    except OSError:
+        return ''
+
+
+def wait_ready(port, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/encoders', timeout=1).read()
+            return True
+        except Exception:
+            time.sleep(0.2)
+    return False
+
+
+def warm(port, rounds):
+    for i in range(rounds):
+        urllib.request.urlopen(f'http://127.0.0.1:{port}/predict_all?month={1 + i % 12}&year=2023', timeout=30).read()
+        req = urllib.request.Request(f'http://127.0.0.1:{port}/interpolate_predict', data=json.dumps(WARM_BODY).encode(),
+                                     headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(req, timeout=30).read()
+
+
+def measure(launcher, workers, rounds):
+    port = free_port()
+    proc = subprocess.Popen(LAUNCHERS[launcher](port, workers), cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_ready(port):
+            raise RuntimeError(f'{launcher} server did not come up on port {port}')
+        warm(port, rounds)
+        time.sleep(0.5)
+        pids = [p for p in descendants(proc.pid) if 'resource_tracker' not in cmdline(p)]
+        per_worker = [memory_kb(p) for p in pids]
+        master = memory_kb(proc.pid)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    n = max(len(per_worker), 1)
+    total = {k: master[k] + sum(w[k] for w in per_worker) for k in ('rss', 'pss', 'uss')}
+    return {
+        'launcher': launcher,
+        'workers': len(per_worker),
+        'master_kb': master,
+        'per_worker_mean_kb': {k: round(sum(w[k] for w in per_worker) / n) for k in ('rss', 'pss', 'uss')},
+        'total_kb': total,
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--workers', type=int, nargs='+', default=[4])
+    p.add_argument('--launchers', nargs='+', choices=sorted(LAUNCHERS), default=['fork', 'uvicorn'])
+    p.add_argument('--warm-rounds', type=int, default=20)
+    p.add_argument('--out', help='write results as JSON to this file')
+    args = p.parse_args(argv)
+
+    if not Path('/proc/self/smaps_rollup').exists():
+        print('RSS benchmark needs Linux /proc/<pid>/smaps_rollup')
+        return 1
+
+    results = []
+    print(f'{"launcher":<8} {"workers":>7} {"RSS/worker":>11} {"PSS/worker":>11} {"USS/worker":>11} {"PSS total":>10}  (MiB)')
+    for n in args.workers:
+        for launcher in args.launchers:
+            r = measure(launcher, n, args.warm_rounds)
+            results.append(r)
+            w = r['per_worker_mean_kb']
+            print(f'{launcher:<8} {r["workers"]:>7} {w["rss"] / 1024:>11.1f} {w["pss"] / 1024:>11.1f} {w["uss"] / 1024:>11.1f} {r["total_kb"]["pss"] / 1024:>10.1f}')
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
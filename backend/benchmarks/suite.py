@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the serving hot paths.
+
+Usage (from repository root):
+  python -m backend.benchmarks.suite run --scales xs s --out new.json
+  python -m backend.benchmarks.suite run --save reference        # -> baselines/reference.json
+  python -m backend.benchmarks.suite compare baselines/reference.json new.json --threshold 0.2
+  python -m backend.benchmarks.suite list
+
+Cases call the functions behind the endpoints in-process (no HTTP):
+
+  predictor.predict            one simplified-model prediction
+  predictor.predict_many       one vectorised pass over every station
+  predict_all                  `/predict_all` for every station of the network
+  interpolate.polyline         `/interpolate_predict` with a `locations` polyline
+  interpolate.follow_river     ... with start/end snapped to the river network
+  interpolate.station_blend    ... with explicit start/end station names
+  interpolate.idw              ... polyline with `blend: 'idw'` over all stations
+  tiles.render                 one uncached `/tiles/do/12/{x}/{y}.png` tile around a station
+  history.station              one station's full `/history` columns from the served observation store
+  encode.predict_all           JSON encoding of a `/predict_all` body (`backend.responses`)
+  encode.interpolate           JSON encoding of an `/interpolate_predict` body with `points` rows
+  encode.*[stdlib]             the same through FastAPI's default jsonable_encoder + json.dumps
+  encode.*[arrow|msgpack]      the same body as columns (when pyarrow / msgpack are installed)
+
+For predictor.predict, predict_all and interpolate.station_blend, `run` also times
+the case with `backend.metrics` enabled and disabled in alternation and records the
+relative difference of the medians as `metrics_overhead` (target: under 1%).
+
+Every case runs against a synthetic network (`synthetic.make_network`) at each
+requested scale. A case is repeated until `--budget` seconds are spent (at least
+`--min-repeats` times); a single call exceeding `--timeout` is recorded as a
+timeout. `compare` flags cases whose median grew by more than `--threshold`
+(relative) plus the case's noise band and by more than `--min-delta` (absolute
+seconds), and exits 1 when any did. The noise band is `--noise` times the larger
+relative p95-median spread of the two runs, so a case that jitters by 15% on this
+machine needs to slow down by threshold + 15% before it is flagged.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import signal
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from backend.benchmarks import synthetic
+
+BASELINE_DIR = Path(__file__).resolve().parent / 'baselines'
+
+# name: (stations, path vertices, sample points)
+SCALES = {
+    'xs': (10, 10, 10),
+    's': (100, 1000, 100),
+    'm': (1000, 10000, 1000),
+    'l': (10000, 100000, 10000),
+    'xl': (10000, 100000, 100000),
+}
+DEFAULT_SCALES = ['xs', 's']
+# cases whose metrics overhead is measured (enabled vs disabled, interleaved so drift cancels)
+METRICS_PAIRED = ('predictor.predict', 'predict_all', 'interpolate.station_blend')
+
+
+class _Timeout(BaseException):
+    # not an Exception: the handlers catch those broadly and would swallow it
+    pass
+
+
+def _alarm(signum, frame):
+    raise _Timeout()
+
+
+def _call_with_timeout(fn, timeout):
+    if not hasattr(signal, 'setitimer') or not timeout:
+        return fn()
+    old = signal.signal(signal.SIGALRM, _alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn()
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old)
+
+
+def _bodies(network, points):
+    locations, paths = network
+    start, end = synthetic.endpoints(paths)
+    longest = max(paths, key=lambda n: len(paths[n]))
+    on_longest = [l for l in locations if l['river'] == longest] or locations
+    return {
+        'interpolate.polyline': {'locations': synthetic.polyline(paths, 1000), 'points': points, 'month': 6, 'year': 2023},
+        'interpolate.follow_river': {'start': start, 'end': end, 'points': points, 'month': 6, 'year': 2023, 'follow_river': True},
+        'interpolate.station_blend': {'start': start, 'end': end, 'points': points, 'month': 6, 'year': 2023,
+                                      'start_station_name': on_longest[0]['name'], 'end_station_name': on_longest[-1]['name']},
+        'interpolate.idw': {'locations': synthetic.polyline(paths, 1000), 'points': points, 'month': 6, 'year': 2023, 'blend': 'idw'},
+    }
+
+
+def interpolation_payload(locations, points, seed=0):
+    """A `/interpolate_predict` response body with `points` rows (shape only; values are random)."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(points):
+        left, right = rng.choice(locations), rng.choice(locations)
+        t = rng.random()
+        rows.append({'latitude': left['latitude'] + t * (right['latitude'] - left['latitude']),
+                     'longitude': left['longitude'] + t * (right['longitude'] - left['longitude']),
+                     'nearest_location': left['name'] if t <= 0.5 else right['name'], 'nearest_river': left['river'],
+                     'pH': round(rng.uniform(6.5, 8.8), 4), 'DO (mg/L)': round(rng.uniform(0.5, 9), 4),
+                     'BOD (mg/L)': round(rng.uniform(1, 30), 4), 'FC MPN/100ml': round(rng.uniform(2, 1800), 4),
+                     'TC MPN/100ml': round(rng.uniform(4, 1800), 4), 'Water Quality': 'Non Complying', 't_frac': t})
+    return {'month': 6, 'year': 2023, 'points': points, 'predictions': rows}
+
+
+def _stdlib_dumps(content):
+    from fastapi.encoders import jsonable_encoder
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+
+
+def cases(main, network, points):
+    """(name, zero-argument callable) pairs for one network."""
+    from backend.responses import available_formats, columnar_response, columns_from_rows, dumps
+    locations, _ = network
+    rows = [(l['river'], l['name'], 6, 2023) for l in locations]
+    out = [
+        ('predictor.predict', lambda: main.predictor.predict('Mula', 'Aundh Bridge', 6, 2023)),
+        ('predictor.predict_many', lambda: main.predictor.predict_many(rows)),
+        ('predict_all', lambda: main.predict_all(6, 2023)),
+    ]
+    for name, body in _bodies(network, points).items():
+        out.append((name, lambda body=body: main.run_interpolation(dict(body))))
+    from backend.observations import history_columns
+    from backend.tiles import tile_for
+    x, y = tile_for(locations[0]['latitude'], locations[0]['longitude'], 12)
+    out.append(('tiles.render', lambda: main.render_tile('do', 6, 2023, 12, x, y, 'png')))
+    store = main.observation_store
+    if store.stations:
+        out.append(('history.station', lambda: dumps(history_columns(store, store.history(0), store.params))))
+    payloads = {'encode.predict_all': main.predict_all(6, 2023), 'encode.interpolate': interpolation_payload(locations, points)}
+    for name, payload in payloads.items():
+        out.append((name, lambda payload=payload: dumps(payload)))
+        out.append((f'{name}[stdlib]', lambda payload=payload: _stdlib_dumps(payload)))
+    # predict_all is built as columns; interpolation rows are transposed as part of the encoding
+    columns = main.predict_all_columns(6, 2023)
+    predictions = payloads['encode.interpolate']['predictions']
+    for fmt in available_formats()[1:]:
+        out.append((f'encode.predict_all[{fmt}]', lambda fmt=fmt: columnar_response(columns, {}, fmt)))
+        out.append((f'encode.interpolate[{fmt}]', lambda fmt=fmt: columnar_response(columns_from_rows(predictions), {}, fmt)))
+    return out
+
+
+def metrics_overhead(fn, budget, min_repeats):
+    """(median with metrics, median without): calls alternate between the two."""
+    from backend import metrics
+    enabled = metrics.ENABLED
+    samples = {True: [], False: []}
+    deadline = time.perf_counter() + budget
+    try:
+        while len(samples[False]) < min_repeats or time.perf_counter() < deadline:
+            for on in (True, False):
+                metrics.ENABLED = on
+                t0 = time.perf_counter()
+                fn()
+                samples[on].append(time.perf_counter() - t0)
+    finally:
+        metrics.ENABLED = enabled
+    return statistics.median(samples[True]), statistics.median(samples[False])
+
+
+def time_case(fn, budget, min_repeats, timeout):
+    t0 = time.perf_counter()
+    try:
+        _call_with_timeout(fn, timeout)
+    except _Timeout:
+        return {'status': 'timeout', 'timeout_s': timeout}
+    except Exception as e:
+        return {'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+    first = time.perf_counter() - t0
+    # a call slower than the whole budget is its own (single) sample
+    samples = [first] if first > budget else []
+    deadline = time.perf_counter() + budget
+    while first <= budget and (len(samples) < min_repeats or time.perf_counter() < deadline):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return {
+        'status': 'ok',
+        'repeats': len(samples),
+        'min_s': samples[0],
+        'median_s': statistics.median(samples),
+        'p95_s': samples[min(len(samples) - 1, int(0.95 * len(samples)))],
+        'first_s': first,
+    }
+
+
+def environment():
+    import numpy
+    return {
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def run(scales, only=None, budget=1.0, min_repeats=3, timeout=60.0, seed=0, log=print):
+    from backend import main
+    results = {}
+    for scale in scales:
+        stations, vertices, points = SCALES[scale]
+        network = synthetic.make_network(stations=stations, vertices=vertices, seed=seed)
+        with synthetic.use_network(main, network):
+            for name, fn in cases(main, network, points):
+                if only and not any(name.startswith(o) for o in only):
+                    continue
+                r = time_case(fn, budget, min_repeats, timeout)
+                if name in METRICS_PAIRED and r['status'] == 'ok':
+                    with_metrics, without = metrics_overhead(fn, budget, min_repeats)
+                    r['metrics_overhead'] = with_metrics / without - 1
+                r.update(stations=stations, vertices=vertices, points=points)
+                key = f'{name}@{scale}'
+                results[key] = r
+                if r['status'] == 'ok':
+                    log(f'{key:<34} {r["median_s"] * 1e3:>12.3f} ms  (min {r["min_s"] * 1e3:.3f}, p95 {r["p95_s"] * 1e3:.3f}, n={r["repeats"]})'
+                        + (f'  metrics {r["metrics_overhead"] * 100:+.2f}%' if 'metrics_overhead' in r else ''))
+                else:
+                    log(f'{key:<34} {r["status"]:>12}  {r.get("error", "")}')
+    return {'environment': environment(), 'scales': {s: SCALES[s] for s in scales}, 'results': results}
+
+
+def noise_band(rb, rn, noise=1.0) -> float:
+    """Relative slowdown explained by run-to-run jitter: `noise` x the wider p95/median spread."""
+    spread = max((r['p95_s'] - r['median_s']) / r['median_s'] if r['median_s'] else 0.0 for r in (rb, rn))
+    return noise * max(spread, 0.0)
+
+
+def compare(base, new, threshold=0.2, min_delta=0.0005, noise=1.0, log=print):
+    """Return the list of regressed case keys, logging a table of all shared cases."""
+    regressions = []
+    b, n = base['results'], new['results']
+    log(f'{"case":<34} {"base ms":>10} {"new ms":>10} {"ratio":>7} {"limit":>7}')
+    for key in sorted(set(b) & set(n)):
+        rb, rn = b[key], n[key]
+        if rb['status'] != 'ok' or rn['status'] != 'ok':
+            flag = ''
+            if rb['status'] == 'ok' and rn['status'] != 'ok':
+                regressions.append(key)
+                flag = '  REGRESSION'
+            log(f'{key:<34} {rb["status"]:>10} {rn["status"]:>10} {"":>7} {"":>7}{flag}')
+            continue
+        ratio = rn['median_s'] / rb['median_s'] if rb['median_s'] else float('inf')
+        limit = 1 + threshold + noise_band(rb, rn, noise)
+        regressed = ratio > limit and rn['median_s'] - rb['median_s'] > min_delta
+        if regressed:
+            regressions.append(key)
+        log(f'{key:<34} {rb["median_s"] * 1e3:>10.3f} {rn["median_s"] * 1e3:>10.3f} {ratio:>7.2f} {limit:>7.2f}{"  REGRESSION" if regressed else ""}')
+    for key in sorted(set(b) - set(n)):
+        log(f'{key:<34} missing from new results')
+    if base.get('environment', {}).get('platform') != new.get('environment', {}).get('platform'):
+        log('note: results come from different platforms')
+    return regressions
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = p.add_subparsers(dest='command', required=True)
+
+    r = sub.add_parser('run', help='run the suite')
+    r.add_argument('--scales', nargs='+', choices=list(SCALES), default=DEFAULT_SCALES)
+    r.add_argument('--cases', nargs='+', help='only run cases whose name starts with one of these')
+    r.add_argument('--budget', type=float, default=1.0, help='seconds spent repeating each case')
+    r.add_argument('--min-repeats', type=int, default=3)
+    r.add_argument('--timeout', type=float, default=60.0, help='seconds after which a single call is abandoned')
+    r.add_argument('--seed', type=int, default=0)
+    r.add_argument('--out', help='write results as JSON to this file')
+    r.add_argument('--save', metavar='NAME', help=f'write results to {BASELINE_DIR.name}/NAME.json')
+    r.add_argument('--compare', metavar='BASELINE', help='compare against this baseline file after running')
+    r.add_argument('--threshold', type=float, default=0.2)
+    r.add_argument('--noise', type=float, default=1.0)
+
+    c = sub.add_parser('compare', help='compare two result files')
+    c.add_argument('base')
+    c.add_argument('new')
+    c.add_argument('--threshold', type=float, default=0.2, help='relative slowdown flagged as a regression')
+    c.add_argument('--min-delta', type=float, default=0.0005, help='ignore slowdowns smaller than this many seconds')
+    c.add_argument('--noise', type=float, default=1.0, help='multiple of the p95/median spread added to the threshold (0 disables)')
+
+    sub.add_parser('list', help='list scales and cases')
+    args = p.parse_args(argv)
+
+    if args.command == 'list':
+        for name, (s, v, n) in SCALES.items():
+            print(f'{name:<3} stations={s:<6} vertices={v:<7} points={n}')
+        print('cases: predictor.predict predictor.predict_many predict_all '
+              + ' '.join(_bodies(synthetic.make_network(), 2))
+              + ' encode.predict_all encode.interpolate (and [stdlib] variants)')
+        return 0
+
+    if args.command == 'compare':
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold, args.min_delta, args.noise)
+        print(f'{len(regressions)} regression(s)')
+        return 1 if regressions else 0
+
+    result = run(args.scales, args.cases, args.budget, args.min_repeats, args.timeout, args.seed)
+    targets = [args.out] if args.out else []
+    if args.save:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        targets.append(BASELINE_DIR / f'{args.save}.json')
+    for t in targets:
+        with open(t, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), result, args.threshold, noise=args.noise)
+        print(f'{len(regressions)} regression(s)')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Synthetic river networks, station sets and observation tables.
+
+`make_network()` returns data shaped like what `backend.main` parses out of
+`locations.js`: a list of station dicts (name, river, latitude, longitude) and a
+dict of river name -> list of {latitude, longitude} vertices. Rivers are smooth
+random walks around Pune, and every station sits a few meters off a vertex of its
+river, so the geometry behaves like the real network at any size.
+
+`use_network()` temporarily swaps a network into the serving module:
+
+    with use_network(main, make_network(stations=1000, vertices=10000)):
+        main.run_interpolation(body)
+
+`make_observations()` produces a table with the columns of `river.csv` for a
+network's stations: per-station levels, seasonal and yearly effects and noise are
+fitted from the real file, and values carry the same markers ('NIL', 'BDL', '-',
+'1800+', '<1.8') and 'Lockdown' gaps at about the same rates. Against the
+bundled river.csv (TC '1800+' 17.5%, FC '1800+' 2.1%, 'Complying' 10.8% of the rows)
+a generated table has about 20%, 2.6% and 8.5-10%: the per-station offsets and the
+re-drawn years spread values across the MPN cap and the compliance limits. As a
+script it writes both files:
+
+  python -m backend.benchmarks.synthetic --stations 1000 --vertices 20000 \
+      --years 2010 2023 --out-dir /tmp/synthetic
+  python ml/train_lgb.py --train /tmp/synthetic/river.csv --test /tmp/synthetic/river.csv
+  WQ_LOCATIONS_JS=/tmp/synthetic/locations.js python -m uvicorn backend.main:app
+"""
+import argparse
+import contextlib
+import re
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+REFERENCE_CSV = Path(__file__).resolve().parents[1] / 'river.csv'
+
+CENTER = (18.52, 73.85)
+# ~50-150 m between consecutive vertices
+STEP_DEG = 0.001
+
+
+def _walk(rng, n, start):
+    heading = rng.uniform(0, 2 * np.pi)
+    turns = np.cumsum(rng.normal(0.0, 0.15, n))
+    steps = STEP_DEG * rng.uniform(0.5, 1.5, n)
+    lat = start[0] + np.cumsum(steps * np.sin(heading + turns))
+    lon = start[1] + np.cumsum(steps * np.cos(heading + turns))
+    return np.column_stack([lat, lon])
+
+
+def make_network(stations: int = 10, vertices: int = 100, rivers: int = None, seed: int = 0) -> Tuple[List[Dict[str, Any]], Dict[str, List[Dict[str, float]]]]:
+    """Return (locations, river_paths) with `stations` stations spread over `vertices` path vertices."""
+    rng = np.random.default_rng(seed)
+    if rivers is None:
+        rivers = int(np.clip(round(np.sqrt(stations) / 2), 1, 50))
+    rivers = max(1, min(rivers, vertices // 2))
+    sizes = np.full(rivers, vertices // rivers)
+    sizes[:vertices % rivers] += 1
+
+    paths = {}
+    arrays = []
+    for r, n in enumerate(sizes):
+        start = (CENTER[0] + rng.normal(0, 0.05), CENTER[1] + rng.normal(0, 0.05))
+        xy = _walk(rng, int(n), start)
+        arrays.append(xy)
+        paths[f'river_{r:03d}'] = [{'latitude': float(a), 'longitude': float(b)} for a, b in xy]
+
+    names = list(paths)
+    locations = []
+    per_river = np.full(rivers, stations // rivers)
+    per_river[:stations % rivers] += 1
+    k = 0
+    for r, count in enumerate(per_river):
+        xy = arrays[r]
+        idx = np.sort(rng.choice(len(xy), size=int(count), replace=count > len(xy)))
+        jitter = rng.normal(0, 0.0001, (int(count), 2))
+        for (lat, lon), (dlat, dlon) in zip(xy[idx], jitter):
+            locations.append({'name': f'Station {k:05d}', 'river': names[r],
+                              'latitude': round(float(lat + dlat), 6), 'longitude': round(float(lon + dlon), 6)})
+            k += 1
+    return locations, paths
+
+
+def polyline(paths: Dict[str, List[Dict[str, float]]], vertices: int) -> List[Dict[str, float]]:
+    """A `locations` polyline of up to `vertices` points taken along the longest river."""
+    longest = max(paths.values(), key=len)
+    if len(longest) <= vertices:
+        return [dict(p) for p in longest]
+    idx = np.linspace(0, len(longest) - 1, vertices).round().astype(int)
+    return [dict(longest[i]) for i in idx]
+
+
+def endpoints(paths: Dict[str, List[Dict[str, float]]]):
+    """(start, end) near the two ends of the longest river, for follow_river bodies."""
+    longest = max(paths.values(), key=len)
+    return dict(longest[0]), dict(longest[-1])
+
+
+@contextlib.contextmanager
+def use_network(main, network):
+    """Swap a (locations, river_paths) network into `backend.main` for the duration of the block."""
+    from backend.geodata import PackedGeo
+    locations, paths = network
+    saved = (main._js_locations, main._river_paths, main._geo)
+    main._js_locations = locations
+    main._river_paths = paths
+    main._geo = PackedGeo.from_parsed(locations, paths)
+    try:
+        yield
+    finally:
+        main._js_locations, main._river_paths, main._geo = saved
+
+
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+          'September', 'October', 'November', 'December']
+COLUMNS = ['River', 'Location', 'Month', 'Year', 'pH', 'DO (mg/L)', 'BOD (mg/L)', 'FC MPN/100ml', 'TC MPN/100ml', 'Water Quality']
+TARGETS = ['pH', 'DO (mg/L)', 'BOD (mg/L)', 'FC MPN/100ml', 'TC MPN/100ml']
+# bacterial counts are skewed; they are modelled in log space
+LOG_TARGETS = ('FC MPN/100ml', 'TC MPN/100ml')
+# MPN tables top out at 1800; larger counts are reported as '1800+'
+MPN_CAP = 1800.0
+LOCKDOWN = ((2020, 5),)
+
+
+def _number(x):
+    # same cleaning as ml/train_lgb.py: markers become NaN, '+'/'<' are stripped
+    s = str(x).strip()
+    if s == '' or s.lower() in ('nan', 'nil', 'bdl', 'na', 'n/a'):
+        return np.nan
+    try:
+        return float(re.sub(r'[^0-9.\-]', '', s))
+    except ValueError:
+        return np.nan
+
+
+def fit_profile(path=REFERENCE_CSV) -> Dict[str, Dict[str, Any]]:
+    """Per-target station levels, month offsets, year trend and residuals of a river.csv file."""
+    df = pd.read_csv(path).dropna(how='all')
+    lockdown = (df['Water Quality'] == 'Lockdown').to_numpy()
+    month = df['Month'].map({m: i for i, m in enumerate(MONTHS)})
+    year = pd.to_numeric(df['Year'], errors='coerce')
+    profile = {}
+    for col in TARGETS:
+        y = df[col].map(_number).astype(float)
+        text = df[col].fillna('').astype(str).str.strip()
+        # share of readings at the MPN cap written as '1800+' rather than '1800'
+        at_cap = y >= MPN_CAP
+        cap_share = float((text[at_cap] == '1800+').mean()) if at_cap.any() else 1.0
+        if col in LOG_TARGETS:
+            y = np.log1p(y)
+        ok = y.notna() & month.notna() & year.notna()
+        station = y[ok].groupby(df.loc[ok, 'Location']).mean()
+        resid = y[ok] - df.loc[ok, 'Location'].map(station)
+        month_off = resid.groupby(month[ok]).mean().reindex(range(12), fill_value=0.0)
+        resid = resid - month[ok].map(month_off)
+        yr = year[ok] - year[ok].mean()
+        slope = float((resid * yr).sum() / (yr * yr).sum()) if (yr * yr).sum() > 0 else 0.0
+        resid = resid - slope * yr
+        profile[col] = {
+            # per row of the file: its station (index into station_levels, -1 for lockdown
+            # rows), month, residual (NaN where the value is missing), whether it is a
+            # reading at the MPN cap and its text when that is a blank or marker
+            # ('BDL', '<1.8', ...), else None
+            'row_station': np.where(lockdown, -1, pd.Categorical(df['Location'], categories=station.index).codes).astype(np.int64),
+            'row_month': month.fillna(-1).to_numpy(dtype=np.int64),
+            'residuals': resid.reindex(df.index).to_numpy(dtype=np.float64),
+            'at_cap': at_cap.to_numpy(),
+            'row_marker': np.where(y.isna() | text.str.startswith('<'), text, None).astype(object),
+            'station_levels': station.to_numpy(),
+            'station_std': resid.groupby(df.loc[ok, 'Location']).std().reindex(station.index).fillna(resid.std()).to_numpy(),
+            'month_offset': month_off.to_numpy(),
+            'year_slope': slope,
+            'year_center': float(year[ok].mean()),
+            'year_range': (float(year[ok].min()), float(year[ok].max())),
+            'cap_share': cap_share,
+            'resid_std': float(resid.std()),
+            'min': float(y[ok].min()),
+            'max': float(y[ok].max()),
+        }
+    return profile
+
+
+def _format(values, decimals):
+    if decimals == 0:
+        return pd.Series(np.round(values).astype(np.int64)).astype(str).to_numpy(dtype=object)
+    return pd.Series(np.round(values, decimals)).astype(str).to_numpy(dtype=object)
+
+
+def make_observations(locations: List[Dict[str, Any]], years=(2017, 2023), per_month: int = 1,
+                      lockdown=LOCKDOWN, profile=None, seed: int = 0) -> pd.DataFrame:
+    """river.csv-shaped rows for every station, month and year in `years` (inclusive range).
+
+    `per_month` repeats each station-month with fresh noise, for denser sampling.
+    Stations borrow the level pattern of a real station (keeping e.g. the DO/BOD
+    correlation) plus a small offset of their own, scaled to that station's spread, and each row's noise is the residual
+    of a random reference row of that station and month, for all targets at once.
+    Drawing real residuals instead of Gaussian noise keeps their skew and cross-target
+    correlation (which decides how often a row complies). Censored readings stay
+    censored: a row drawn from a reading at the MPN cap stays at the cap, and one drawn
+    from a blank or marker gets that blank or marker, so markers turn up as often, and
+    at the same kind of station, as in the reference. The year trend is held flat
+    outside the reference years.
+    """
+    rng = np.random.default_rng(seed)
+    profile = profile or fit_profile()
+    y0, y1 = years
+    n_st = len(locations)
+    yrs = np.arange(y0, y1 + 1)
+    st_idx, yr, mo, _ = (a.ravel() for a in np.meshgrid(np.arange(n_st), yrs, np.arange(12), np.arange(per_month), indexing='ij'))
+    n = len(st_idx)
+
+    first = next(iter(profile.values()))
+    # templates are dealt out evenly, so every reference station is imitated equally often
+    template = rng.permutation(np.arange(n_st) % len(first['station_levels']))
+    # one reference row per synthetic row, from the template station's rows of the same
+    # month (any month of the station when there are none)
+    buckets = {}
+    for i, (ref_st, ref_mo) in enumerate(zip(first['row_station'].tolist(), first['row_month'].tolist())):
+        if ref_st >= 0:
+            buckets.setdefault((ref_st, ref_mo), []).append(i)
+            buckets.setdefault((ref_st, None), []).append(i)
+    keys, inverse = np.unique(template[st_idx] * 12 + mo, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    noise_rows = np.empty(n, dtype=np.int64)
+    for k, sel in zip(keys.tolist(), np.split(order, np.cumsum(np.bincount(inverse))[:-1])):
+        pool = buckets.get((k // 12, k % 12)) or buckets[(k // 12, None)]
+        noise_rows[sel] = rng.choice(pool, len(sel))
+    out = {
+        'River': np.array([l.get('river') or '' for l in locations], dtype=object)[st_idx],
+        'Location': np.array([l['name'] for l in locations], dtype=object)[st_idx],
+        'Month': np.array(MONTHS, dtype=object)[mo],
+        'Year': yr,
+    }
+    values = {}
+    for col in TARGETS:
+        p = profile[col]
+        level = p['station_levels'][template] + rng.normal(0, 0.25 * p['station_std'][template])
+        # no residual where the reference has a blank or marker: the row gets that below
+        noise = np.nan_to_num(p['residuals'][noise_rows])
+        trend = p['year_slope'] * (np.clip(yr, *p['year_range']) - p['year_center'])
+        v = level[st_idx] + p['month_offset'][mo] + trend + noise
+        v = np.clip(v, p['min'], p['max'] if col not in LOG_TARGETS else np.inf)
+        if col in LOG_TARGETS:
+            v[p['at_cap'][noise_rows]] = np.maximum(v[p['at_cap'][noise_rows]], np.log1p(MPN_CAP))
+        if col in LOG_TARGETS:
+            v = np.expm1(v)
+        values[col] = v
+        decimals = {'pH': 2, 'FC MPN/100ml': 0, 'TC MPN/100ml': 0}.get(col, 1)
+        text = _format(v, decimals)
+        if col == 'pH':
+            # most pH readings have one decimal
+            one = rng.random(n) < 0.94
+            text[one] = _format(v[one], 1)
+        if col in LOG_TARGETS:
+            capped = v >= MPN_CAP
+            text[capped] = np.where(rng.random(int(capped.sum())) < p['cap_share'], '1800+', '1800')
+            values[col] = np.minimum(v, MPN_CAP)
+        marker = p['row_marker'][noise_rows]
+        hit = pd.notna(marker)
+        text[hit] = marker[hit]
+        values[col][hit] = [_number(m) for m in marker[hit]]
+        out[col] = text
+
+    # same rule as the serving code; missing readings count as not complying
+    ph, do, bod = values['pH'], values['DO (mg/L)'], values['BOD (mg/L)']
+    with np.errstate(invalid='ignore'):
+        ok = (ph >= 6.5) & (ph <= 8.5) & (do >= 5.0) & (bod <= 3.0)
+    out['Water Quality'] = np.where(ok, 'Complying', 'Non Complying').astype(object)
+
+    locked = np.zeros(n, dtype=bool)
+    for ly, lm in lockdown or ():
+        locked |= (yr == ly) & (mo == lm - 1)
+    for col in TARGETS:
+        out[col][locked] = ''
+    out['Water Quality'][locked] = 'Lockdown'
+    return pd.DataFrame(out, columns=COLUMNS)
+
+
+def write_locations_js(path, locations: List[Dict[str, Any]], paths: Dict[str, List[Dict[str, float]]]):
+    """Write stations and river paths in the layout of WaterQualityApp/src/data/locations.js."""
+    lines = ['// Synthetic monitoring network generated by backend/benchmarks/synthetic.py', 'export const puneLocations = [']
+    for i, l in enumerate(locations, 1):
+        lines.append(f"  {{ id: {i}, name: '{l['name']}', river: '{l['river']}', "
+                     f"coordinate: {{ latitude: {l['latitude']:.6f}, longitude: {l['longitude']:.6f} }} }},")
+    lines += ['];', '', 'export const riverPaths = {']
+    for name, pts in paths.items():
+        lines.append(f'  {name}: [')
+        lines += [f"    {{ latitude: {p['latitude']:.6f}, longitude: {p['longitude']:.6f} }}," for p in pts]
+        lines.append('  ],')
+    lines += ['};', '']
+    Path(path).write_text('\n'.join(lines), encoding='utf-8')
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--stations', type=int, default=100)
+    p.add_argument('--vertices', type=int, default=2000, help='river path vertices over all rivers')
+    p.add_argument('--rivers', type=int, help='number of rivers (default grows with the station count)')
+    p.add_argument('--years', type=int, nargs=2, default=[2017, 2023], metavar=('FIRST', 'LAST'))
+    p.add_argument('--per-month', type=int, default=1, help='samples per station and month')
+    p.add_argument('--lockdown', nargs='*', default=['2020-05'], metavar='YYYY-MM', help='months reported as Lockdown')
+    p.add_argument('--reference', default=str(REFERENCE_CSV), help='river.csv whose statistics are imitated')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--out-dir', default='synthetic')
+    args = p.parse_args(argv)
+
+    out = Path(args.out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    locations, paths = make_network(args.stations, args.vertices, args.rivers, args.seed)
+    lockdown = [tuple(int(x) for x in m.split('-')) for m in args.lockdown]
+    df = make_observations(locations, tuple(args.years), args.per_month, lockdown, fit_profile(args.reference), args.seed)
+    df.to_csv(out / 'river.csv', index=False)
+    write_locations_js(out / 'locations.js', locations, paths)
+    print(f'{len(df)} rows for {len(locations)} stations -> {out / "river.csv"}')
+    print(f'{len(paths)} rivers, {sum(len(v) for v in paths.values())} vertices -> {out / "locations.js"}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
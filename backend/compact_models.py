@@ -0,0 +1,117 @@
+"""Memory-mapped loader and evaluator for the compact tree export.
+
+`ml/train_lgb.py` writes every booster as flat typed arrays plus a `manifest.json`
+(targets, feature order, transforms, encoder classes) under `backend/models/compact/`.
+This module maps those arrays read-only and evaluates them with NumPy, so serving
+does not import LightGBM or sklearn and the OS page cache is shared by all workers.
+"""
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable
+
+import numpy as np
+
+FIELDS = ('split_feature', 'threshold', 'children', 'flags', 'leaf_value', 'roots')
+
+# node flag bits written by the exporter
+DEFAULT_LEFT = 1
+MISSING_NAN = 2
+MISSING_ZERO = 4
+# LightGBM treats |x| <= kZeroThreshold as zero for missing_type=Zero
+ZERO_THRESHOLD = 1e-35
+
+# rows evaluated per block; bounds the (rows x trees) working set
+BLOCK_ROWS = 4096
+
+
+class CompactEncoder:
+    """Drop-in for a fitted LabelEncoder's `transform` (unknown labels raise ValueError)."""
+
+    def __init__(self, classes: Iterable[str]):
+        self.classes_ = np.asarray(list(classes), dtype=object)
+        self._codes = {c: i for i, c in enumerate(self.classes_.tolist())}
+
+    def transform(self, values):
+        try:
+            return np.fromiter((self._codes[str(v)] for v in values), dtype=np.int64)
+        except KeyError as e:
+            raise ValueError(f'y contains previously unseen labels: {e}')
+
+
+class CompactBooster:
+    """Sum-of-trees regressor over memory-mapped node arrays."""
+
+    def __init__(self, base: Path, stem: str, features, mmap_mode='r'):
+        self._set_arrays({field: np.load(base / f'{stem}.{field}.npy', mmap_mode=mmap_mode) for field in FIELDS}, features)
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], features) -> 'CompactBooster':
+        """A booster over in-memory arrays (one per name in FIELDS)."""
+        self = cls.__new__(cls)
+        self._set_arrays(arrays, features)
+        return self
+
+    def _set_arrays(self, arrays, features):
+        self.features = list(features)
+        for field in FIELDS:
+            setattr(self, field, arrays[field])
+        self.left = self.children[:, 0]
+        self.right = self.children[:, 1]
+        self._zero_missing = bool((self.flags & MISSING_ZERO).any())
+
+    def nbytes(self) -> int:
+        return int(sum(getattr(self, f).nbytes for f in FIELDS))
+
+    def _as_matrix(self, X) -> np.ndarray:
+        if hasattr(X, 'columns'):
+            X = X[self.features].to_numpy(dtype=np.float64)
+        X = np.asarray(X, dtype=np.float64)
+        return X.reshape(1, -1) if X.ndim == 1 else X
+
+    def predict(self, X) -> np.ndarray:
+        X = self._as_matrix(X)
+        out = np.empty(len(X), dtype=np.float64)
+        for lo in range(0, len(X), BLOCK_ROWS):
+            out[lo:lo + BLOCK_ROWS] = self._predict_block(X[lo:lo + BLOCK_ROWS])
+        return out
+
+    def _predict_block(self, X: np.ndarray) -> np.ndarray:
+        n_trees = len(self.roots)
+        # one cursor per (row, tree); every step advances all unfinished cursors one level
+        node = np.tile(self.roots, len(X))
+        active = np.flatnonzero(node >= 0)
+        check_missing = self._zero_missing or bool(np.isnan(X).any())
+        while active.size:
+            idx = node[active]
+            x = X[active // n_trees, self.split_feature[idx]]
+            if check_missing:
+                go_left = self._route_missing(x, idx)
+            else:
+                go_left = x <= self.threshold[idx]
+            nxt = np.where(go_left, self.left[idx], self.right[idx])
+            node[active] = nxt
+            active = active[nxt >= 0]
+        return self.leaf_value[~node].reshape(len(X), n_trees).sum(axis=1)
+
+    def _route_missing(self, x: np.ndarray, idx: np.ndarray) -> np.ndarray:
+        flags = self.flags[idx]
+        nan = np.isnan(x)
+        missing = nan & ((flags & MISSING_NAN) != 0)
+        missing |= ((flags & MISSING_ZERO) != 0) & (nan | (np.abs(x) <= ZERO_THRESHOLD))
+        # with missing_type None LightGBM maps NaN to 0.0
+        x = np.where(nan, 0.0, x)
+        return np.where(missing, (flags & DEFAULT_LEFT) != 0, x <= self.threshold[idx])
+
+
+def load_compact_models(base: Path, mmap_mode='r') -> Dict[str, Any]:
+    """Return {'models', 'encoders', 'transforms', 'manifest'} for a compact export directory."""
+    base = Path(base)
+    with open(base / 'manifest.json', 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != 'wq-compact-trees':
+        raise ValueError(f'unexpected compact model format in {base}')
+    features = manifest['features']
+    models = {target: CompactBooster(base, spec['stem'], features, mmap_mode=mmap_mode)
+              for target, spec in manifest['targets'].items()}
+    encoders = {name: CompactEncoder(classes) for name, classes in manifest.get('encoders', {}).items()}
+    return {'models': models, 'encoders': encoders, 'transforms': manifest.get('transforms', {}), 'manifest': manifest}
@@ -5,14 +5,29 @@ Create train/test splits from river.csv.
 Usage examples:
   python data_split.py --mode year --test-year 2023
   python data_split.py --mode random --test-size 0.2 --seed 42
-
-This script writes `train.csv` and `test.csv` next to `river.csv`.
+  python data_split.py --mode kfold --folds 5 --manifest splits/kfold5
+  python data_split.py --mode station --folds 4 --manifest splits/station4
+
+By default this script writes `train.csv` and `test.csv` next to `river.csv`.
+With `--manifest DIR` it writes row-index manifests instead: the source rows are
+partitioned into `part_<k>.npy` int32 arrays (load with `np.load(..., mmap_mode='r')`)
+and `manifest.json` lists, for each split, which parts form the test set; the train
+set is the union of the remaining parts. Row indices count data rows of the source
+file after skipping blank rows, exactly as `read_rows` does. `station` and `kfold`
+modes are only available as manifests. Manifests draw from numpy's `default_rng`,
+while the CSV `--mode random` split keeps its `random.Random(seed)` shuffle, so a
+`--seed` gives the same CSV files as before but a different test set than the
+`random` manifest.
 """
 import csv
+import json
+import os
 import argparse
 import random
 from pathlib import Path
 
+import numpy as np
+
 
 def read_rows(path):
     rows = []
@@ -27,6 +42,23 @@ def read_rows(path):
     return header, rows
 
 
+def read_columns(path, names):
+    """Stream the source and keep only the named columns (same row numbering as `read_rows`)."""
+    n = 0
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        idx = [_column_index(header, name) for name in names]
+        cols = [[] for _ in names]
+        for r in reader:
+            if not any(cell.strip() for cell in r):
+                continue
+            n += 1
+            for c, i in zip(cols, idx):
+                c.append(r[i] if i < len(r) else '')
+    return n, cols
+
+
 def write_rows(path, header, rows):
     with open(path, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
@@ -34,6 +66,14 @@ def write_rows(path, header, rows):
         writer.writerows(rows)
 
 
+def _column_index(header, name):
+    # case-insensitive lookup of a column by name
+    for i, h in enumerate(header):
+        if h.strip().lower() == name.strip().lower():
+            return i
+    raise RuntimeError(f'{name} column not found in header')
+
+
 def split_by_year(header, rows, test_year=2023):
     # Find index of Year column (case-insensitive)
     year_idx = None
@@ -66,21 +106,89 @@ def split_random(header, rows, test_size=0.2, seed=0):
     rnd = random.Random(seed)
     idx = list(range(n))
     rnd.shuffle(idx)
-    test_idx = set(idx[:k])
-    train = [rows[i] for i in range(n) if i not in test_idx]
-    test = [rows[i] for i in range(n) if i in test_idx]
+    is_test = [False] * n
+    for i in idx[:k]:
+        is_test[i] = True
+    train = [r for r, t in zip(rows, is_test) if not t]
+    test = [r for r, t in zip(rows, is_test) if t]
     return train, test
 
 
+def year_parts(years, test_year=2023):
+    vals = np.array([int(y) if y.strip().lstrip('-').isdigit() else -1 for y in years], dtype=np.int64)
+    # unparsable years go to train, as in split_by_year
+    test = vals == test_year
+    return [np.flatnonzero(~test), np.flatnonzero(test)], [{'name': f'year{test_year}', 'test': [1]}]
+
+
+def random_parts(n, test_size=0.2, seed=0):
+    perm = np.random.default_rng(seed).permutation(n)
+    k = int(n * test_size)
+    return [np.sort(perm[k:]), np.sort(perm[:k])], [{'name': f'random{seed}', 'test': [1]}]
+
+
+def kfold_parts(n, folds=5, seed=0):
+    perm = np.random.default_rng(seed).permutation(n)
+    parts = [np.sort(p) for p in np.array_split(perm, folds)]
+    return parts, [{'name': f'fold{k}', 'test': [k]} for k in range(folds)]
+
+
+def station_parts(groups, folds=5, seed=0):
+    """Grouped k-fold: every row of a station lands in the same fold.
+
+    Stations are shuffled with `seed`, then assigned largest-first to the fold with
+    the fewest rows so folds stay balanced by row count.
+    """
+    names, codes, counts = np.unique(np.asarray(groups, dtype=object).astype(str), return_inverse=True, return_counts=True)
+    if len(names) < folds:
+        raise RuntimeError(f'only {len(names)} groups for {folds} folds')
+    order = np.random.default_rng(seed).permutation(len(names))
+    order = order[np.argsort(-counts[order], kind='stable')]
+    load = np.zeros(folds, dtype=np.int64)
+    fold_of = np.empty(len(names), dtype=np.int64)
+    for g in order:
+        f = int(np.argmin(load))
+        fold_of[g] = f
+        load[f] += counts[g]
+    row_fold = fold_of[codes]
+    parts = [np.flatnonzero(row_fold == k) for k in range(folds)]
+    splits = [{'name': f'station_fold{k}', 'test': [k], 'groups': sorted(names[fold_of == k].tolist())} for k in range(folds)]
+    return parts, splits
+
+
+def write_manifest(out_dir, source, n_rows, mode, params, parts, splits):
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    files = []
+    for k, p in enumerate(parts):
+        fname = f'part_{k}.npy'
+        np.save(out / fname, np.ascontiguousarray(p, dtype=np.int32))
+        files.append(fname)
+    manifest = {
+        'source': os.path.relpath(Path(source).resolve(), out.resolve()),
+        'n_rows': int(n_rows),
+        'mode': mode,
+        'params': params,
+        'parts': files,
+        'splits': splits,
+    }
+    with open(out / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
 def main():
     p = argparse.ArgumentParser()
-    p.add_argument('--mode', choices=['year', 'random'], default='year')
+    p.add_argument('--mode', choices=['year', 'random', 'station', 'kfold'], default='year')
     p.add_argument('--test-year', type=int, default=2023)
     p.add_argument('--test-size', type=float, default=0.2)
     p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--folds', type=int, default=5)
+    p.add_argument('--group-col', default='Location', help='station column for --mode station')
     p.add_argument('--input', default='river.csv')
     p.add_argument('--out-train', default='train.csv')
     p.add_argument('--out-test', default='test.csv')
+    p.add_argument('--manifest', help='write row-index manifests to this directory instead of CSV copies')
     args = p.parse_args()
 
     base = Path(args.input)
@@ -88,6 +196,32 @@ def main():
         print('Input file not found:', base)
         return
 
+    if args.manifest:
+        if args.mode == 'year':
+            n, (years,) = read_columns(base, ['Year'])
+            parts, splits = year_parts(years, test_year=args.test_year)
+            params = {'test_year': args.test_year}
+        elif args.mode == 'station':
+            n, (groups,) = read_columns(base, [args.group_col])
+            parts, splits = station_parts(groups, folds=args.folds, seed=args.seed)
+            params = {'folds': args.folds, 'seed': args.seed, 'group_col': args.group_col}
+        else:
+            # random and kfold only need the row count
+            n, _ = read_columns(base, [])
+            if args.mode == 'random':
+                parts, splits = random_parts(n, test_size=args.test_size, seed=args.seed)
+                params = {'test_size': args.test_size, 'seed': args.seed}
+            else:
+                parts, splits = kfold_parts(n, folds=args.folds, seed=args.seed)
+                params = {'folds': args.folds, 'seed': args.seed}
+        write_manifest(args.manifest, base, n, args.mode, params, parts, splits)
+        print(f'Read {n} rows; wrote {len(splits)} split(s) over {len(parts)} part(s) to {args.manifest}')
+        return
+
+    if args.mode in ('station', 'kfold'):
+        print(f'--mode {args.mode} requires --manifest')
+        return
+
     header, rows = read_rows(base)
     if args.mode == 'year':
         train, test = split_by_year(header, rows, test_year=args.test_year)
@@ -0,0 +1,140 @@
+"""Process-pool offload for CPU-heavy request handlers.
+
+Large `/interpolate_predict` bodies spend seconds in pure-Python geometry while
+holding the GIL, which stalls every other request of the worker. Jobs above a size
+threshold are sent to a pool of worker processes instead; the event loop only
+awaits the future.
+
+The pool uses the `fork` start method where available and is started and warmed at
+application startup, so each pool process already holds the imported geometry,
+Predictor and memory-mapped models when the first job arrives. When a pool process
+dies, the call that noticed is served inline and the next offloaded call starts a
+new pool in the threadpool, so the event loop never waits for the warm-up.
+
+Every serving process has its own pool. Under the fork launcher (`backend.serve`)
+the default pool size is half the CPUs divided by the worker count it exports, so
+the pools together never oversubscribe the machine (0, offloading off, when there
+are more workers than that).
+
+Environment:
+  WQ_OFFLOAD_WORKERS     pool size per serving process (default: half the CPUs, divided
+                         by WQ_SERVE_WORKERS under backend.serve; 0 disables offloading)
+  WQ_SERVE_WORKERS       serving processes sharing the machine (set by backend.serve)
+  WQ_OFFLOAD_MIN_POINTS  sample points (or input vertices) at which a job is offloaded (default 500)
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict
+
+from starlette.concurrency import run_in_threadpool
+
+from backend import metrics, profiling
+from backend.metrics import Histogram
+from backend.polyline import vertex_count
+
+SERVE_WORKERS = max(1, int(os.environ.get('WQ_SERVE_WORKERS', 1)))
+
+
+def _default_workers() -> int:
+    half = (os.cpu_count() or 2) // 2
+    return max(1, half) if SERVE_WORKERS == 1 else half // SERVE_WORKERS
+
+
+OFFLOAD_WORKERS = int(os.environ.get('WQ_OFFLOAD_WORKERS', _default_workers()))
+OFFLOAD_MIN_POINTS = int(os.environ.get('WQ_OFFLOAD_MIN_POINTS', 500))
+
+job_latency = Histogram('wq_job_latency_seconds', 'Handler latency by execution mode (inline threadpool or offloaded process pool).',
+                        labelnames=('job', 'mode'))
+
+
+def _warm():
+    """Pool initializer: make sure the serving state is imported and its pages touched."""
+    from backend import main
+    main.predictor.predict('', '', 6, 2023)
+
+
+def _ping():
+    return os.getpid()
+
+
+def interpolation_size(body: Dict[str, Any]) -> int:
+    try:
+        points = int(body.get('points', 5))
+    except (TypeError, ValueError):
+        points = 0
+    locations = body.get('locations')
+    return max(points, vertex_count(locations))
+
+
+class Offloader:
+    def __init__(self, workers: int = OFFLOAD_WORKERS, min_points: int = OFFLOAD_MIN_POINTS):
+        self.workers = workers
+        self.min_points = min_points
+        self._pool = None
+        # serializes (re)starts from request handlers, which run `start` in the threadpool
+        self._starting = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def start(self):
+        if not self.enabled or self._pool is not None:
+            return
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx, initializer=_warm)
+        # one round trip per worker so all processes exist before the first request
+        for f in [self._pool.submit(_ping) for _ in range(self.workers)]:
+            f.result()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def _started(self) -> ProcessPoolExecutor:
+        """The pool, (re)started off the event loop if needed: `start` blocks until every worker answers."""
+        async with self._starting:
+            if self._pool is None:
+                await run_in_threadpool(self.start)
+            return self._pool
+
+    def should_offload(self, size: int) -> bool:
+        return self.enabled and size >= self.min_points
+
+    async def run(self, job: str, fn: Callable, *args, offload: bool = False):
+        """Run `fn(*args)` in the process pool when `offload`, else in the threadpool; record latency."""
+        t0 = time.perf_counter()
+        mode = 'inline'
+        slot = profiling.requested()
+        if slot is not None:
+            # profile where the work runs (pool process or thread); the report travels back with the result
+            fn, args = profiling.call, (fn,) + args
+        if offload:
+            pool = self._pool or await self._started()
+            try:
+                loop = asyncio.get_running_loop()
+                # the pool process' own metrics registry is never scraped: bring its observations back
+                result, recorded = await loop.run_in_executor(pool, metrics.call, fn, *args)
+                metrics.merge(recorded)
+                mode = 'offloaded'
+            except BrokenProcessPool:
+                # a pool process died (e.g. OOM); drop the pool (unless another call already replaced
+                # it), serve this call inline and let the next offloaded call start a new one
+                if self._pool is pool:
+                    self.shutdown()
+                result = await run_in_threadpool(fn, *args)
+        else:
+            result = await run_in_threadpool(fn, *args)
+        if slot is not None:
+            result, slot['report'] = result
+        job_latency.observe(time.perf_counter() - t0, job=job, mode=mode)
+        return result
+
+
+offloader = Offloader()
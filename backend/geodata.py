@@ -0,0 +1,308 @@
+"""Contiguous, read-only geodata for the serving process.
+
+Stations and river polylines parsed from `locations.js` are packed into a few NumPy
+arrays instead of lists of per-point dicts. Reading them never touches per-object
+refcounts, so pages loaded before a fork stay shared between worker processes.
+"""
+from collections.abc import Mapping
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+# meters per degree of latitude
+DEG_M = EARTH_RADIUS_M * np.pi / 180
+# derived arrays `PackedGeo` can be restored from instead of recomputing them
+SEGMENT_FIELDS = ('seg_a', 'seg_b', 'seg_path', 'seg_len_m', 'seg_cum_m')
+STATION_PATH_FIELDS = ('station_path_offsets', 'station_path_along', 'station_path_index')
+LEVEL_FIELDS = ('vertex_tolerance_m', 'level_tolerances_m')
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Vectorised great-circle distance in meters (broadcasts like NumPy ufuncs)."""
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    dlat = lat2 - lat1
+    dlon = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    hav = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(hav)))
+
+
+def simplification_tolerances(coords: np.ndarray, min_tolerance_m: float) -> np.ndarray:
+    """Per vertex of one path, the largest Douglas-Peucker tolerance (meters) that keeps it.
+
+    The path simplified at tolerance `t` is the vertices with a value above `t`: the
+    endpoints are `inf`, and vertices the recursion drops at `min_tolerance_m` are 0 (so
+    only tolerances from `min_tolerance_m` up are exact). Distances are point-segment
+    distances in a local equirectangular frame.
+    """
+    n = len(coords)
+    out = np.zeros(n)
+    if n == 0:
+        return out
+    out[0] = out[-1] = np.inf
+    y = coords[:, 0] * DEG_M
+    x = coords[:, 1] * DEG_M * np.cos(np.radians(coords[:, 0].mean()))
+    # a vertex survives `t` only when every split above it does, so it keeps the smaller value
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        i, j, cap = stack.pop()
+        if j - i < 2:
+            continue
+        dy, dx = y[j] - y[i], x[j] - x[i]
+        qy, qx = y[i + 1:j] - y[i], x[i + 1:j] - x[i]
+        seg2 = dy * dy + dx * dx
+        t = np.clip((qy * dy + qx * dx) / seg2, 0.0, 1.0) if seg2 > 0 else 0.0
+        d2 = (qy - t * dy) ** 2 + (qx - t * dx) ** 2
+        k = int(np.argmax(d2))
+        d = float(np.sqrt(d2[k]))
+        if d <= min_tolerance_m:
+            continue
+        v = i + 1 + k
+        out[v] = min(d, cap)
+        stack.append((i, v, out[v]))
+        stack.append((v, j, out[v]))
+    return out
+
+
+class PackedGeo:
+    """Stations and river paths as contiguous arrays.
+
+    `coords` is (n_stations, 2) [lat, lon]; stations without coordinates are NaN.
+    Path vertices of all rivers are concatenated in `path_coords` (n_vertices, 2) and
+    path `i` spans `path_offsets[i]:path_offsets[i + 1]`.
+
+    `index` restores the derived arrays (SEGMENT_FIELDS and optionally
+    STATION_PATH_FIELDS and LEVEL_FIELDS, e.g. from a warm-start snapshot) instead of
+    computing them.
+
+    `level(tolerance_m)` gives the paths simplified (Douglas-Peucker) to within a
+    tolerance, as a PackedGeo whose `seg_cum_m`/`seg_len_m` are full-resolution
+    chainage: along-path distances from its `project` compare directly with those of
+    the full geometry (and with `stations_on_path`).
+    """
+
+    def __init__(self, names: Sequence[str], rivers: Sequence[str], coords: np.ndarray,
+                 path_names: Sequence[str], path_coords: np.ndarray, path_offsets: np.ndarray,
+                 index: Optional[Dict[str, np.ndarray]] = None):
+        self.names = tuple(names)
+        self.rivers = tuple(rivers)
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64)
+        self.path_names = tuple(path_names)
+        self.path_coords = np.ascontiguousarray(path_coords, dtype=np.float64)
+        self.path_offsets = np.ascontiguousarray(path_offsets, dtype=np.int64)
+        for arr in (self.coords, self.path_coords, self.path_offsets):
+            arr.setflags(write=False)
+        self.station_path_offsets = None
+        self.vertex_tolerance_m = self.level_tolerances_m = None
+        # for simplified levels: their tolerance and the full-resolution index of each vertex
+        self.tolerance_m = 0.0
+        self.full_vertex = None
+        self._levels = {}
+        if index is None:
+            self._index_segments()
+        else:
+            for field in SEGMENT_FIELDS + STATION_PATH_FIELDS + LEVEL_FIELDS:
+                if field in index:
+                    setattr(self, field, index[field])
+
+    def _index_segments(self):
+        """Segment arrays over all paths: start/end vertices, owning path, length and meters before it."""
+        starts = self._segment_starts()
+        self.seg_a = self.path_coords[starts]
+        self.seg_b = self.path_coords[starts + 1]
+        self.seg_path = np.searchsorted(self.path_offsets, starts, side='right') - 1
+        self.seg_len_m = haversine_m(self.seg_a[:, 0], self.seg_a[:, 1], self.seg_b[:, 0], self.seg_b[:, 1])
+        # running length restarted per path, summed in order so it matches a per-path loop exactly
+        self.seg_cum_m = np.zeros(len(starts))
+        bounds = np.searchsorted(self.seg_path, np.arange(len(self.path_names) + 1))
+        for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            if hi - lo > 1:
+                self.seg_cum_m[lo + 1:hi] = np.cumsum(self.seg_len_m[lo:hi - 1])
+
+    def _segment_starts(self) -> np.ndarray:
+        ends = self.path_offsets[1:] - 1
+        return np.setdiff1d(np.arange(max(len(self.path_coords) - 1, 0)), ends)
+
+    def vertex_chain_m(self) -> np.ndarray:
+        """Meters along its path of every vertex (the running segment lengths)."""
+        chain = np.zeros(len(self.path_coords))
+        starts = self._segment_starts()
+        chain[starts + 1] = self.seg_cum_m + self.seg_len_m
+        chain[starts] = self.seg_cum_m
+        return chain
+
+    def index_levels(self, tolerances_m: Sequence[float]):
+        """Douglas-Peucker tolerances of every vertex, for the simplification `level`s at `tolerances_m`."""
+        tolerances = np.unique(np.asarray([t for t in tolerances_m if t > 0], dtype=np.float64))
+        out = np.zeros(len(self.path_coords))
+        if len(tolerances):
+            for i in range(len(self.path_names)):
+                lo, hi = self.path_offsets[i], self.path_offsets[i + 1]
+                out[lo:hi] = simplification_tolerances(self.path_coords[lo:hi], float(tolerances[0]))
+        self.vertex_tolerance_m = out
+        self.level_tolerances_m = tolerances
+        self._levels = {}
+
+    def level(self, tolerance_m: Optional[float]) -> 'PackedGeo':
+        """The coarsest indexed level whose tolerance is within `tolerance_m`; self when none is
+        (or for None, or before `index_levels`)."""
+        if tolerance_m is None or self.level_tolerances_m is None:
+            return self
+        fits = self.level_tolerances_m[self.level_tolerances_m <= tolerance_m]
+        if len(fits) == 0:
+            return self
+        t = float(fits[-1])
+        lvl = self._levels.get(t)
+        if lvl is None:
+            lvl = self._levels[t] = self._simplified(t)
+        return lvl
+
+    def _simplified(self, t: float) -> 'PackedGeo':
+        keep = np.flatnonzero(self.vertex_tolerance_m > t)
+        offsets = np.searchsorted(keep, self.path_offsets)
+        coords = self.path_coords[keep]
+        ends = offsets[1:] - 1
+        starts = np.setdiff1d(np.arange(max(len(coords) - 1, 0)), ends)
+        chain = self.vertex_chain_m()[keep]
+        index = {
+            'seg_a': coords[starts], 'seg_b': coords[starts + 1],
+            'seg_path': np.searchsorted(offsets, starts, side='right') - 1,
+            'seg_cum_m': chain[starts], 'seg_len_m': chain[starts + 1] - chain[starts],
+        }
+        if self.station_path_offsets is not None:
+            index.update({f: getattr(self, f) for f in STATION_PATH_FIELDS})
+        lvl = PackedGeo(self.names, self.rivers, self.coords, self.path_names, coords, offsets, index=index)
+        lvl.tolerance_m = t
+        lvl.full_vertex = keep
+        return lvl
+
+    def index_station_paths(self):
+        """Project every station with coordinates onto every path (see `stations_on_path`)."""
+        ok = np.flatnonzero(np.isfinite(self.coords).all(axis=1))
+        offsets = np.zeros(len(self.path_names) + 1, dtype=np.int64)
+        along, index = [], []
+        for j in range(len(self.path_names)):
+            segs = np.flatnonzero(self.seg_path == j)
+            if len(segs) and len(ok):
+                _, s_along, _ = self.project(self.coords[ok, 0], self.coords[ok, 1], segments=segs)
+                order = np.argsort(s_along, kind='stable')
+                along.append(s_along[order])
+                index.append(ok[order])
+            offsets[j + 1] = offsets[j] + (len(ok) if len(segs) else 0)
+        self.station_path_offsets = offsets
+        self.station_path_along = np.concatenate(along) if along else np.empty(0)
+        self.station_path_index = np.concatenate(index) if index else np.empty(0, dtype=np.int64)
+
+    def stations_on_path(self, j: int):
+        """(along_m, station_index) of the stations projected onto path `j`, ordered along it;
+        None until `index_station_paths` ran."""
+        if self.station_path_offsets is None:
+            return None
+        lo, hi = self.station_path_offsets[j], self.station_path_offsets[j + 1]
+        return self.station_path_along[lo:hi], self.station_path_index[lo:hi]
+
+    def derived(self) -> Dict[str, np.ndarray]:
+        """The arrays `index` takes, for persisting."""
+        fields = (SEGMENT_FIELDS + (STATION_PATH_FIELDS if self.station_path_offsets is not None else ())
+                  + (LEVEL_FIELDS if self.vertex_tolerance_m is not None else ()))
+        return {f: getattr(self, f) for f in fields}
+
+    @classmethod
+    def from_parsed(cls, locations: List[Dict[str, Any]], paths: Dict[str, List[Dict[str, float]]]) -> 'PackedGeo':
+        coords = np.full((len(locations), 2), np.nan)
+        for i, loc in enumerate(locations):
+            if loc.get('latitude') is not None and loc.get('longitude') is not None:
+                coords[i] = (loc['latitude'], loc['longitude'])
+        names = list(paths.keys())
+        verts = [np.array([[p['latitude'], p['longitude']] for p in paths[n]], dtype=np.float64).reshape(-1, 2) for n in names]
+        offsets = np.zeros(len(verts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(v) for v in verts])
+        path_coords = np.concatenate(verts) if verts else np.empty((0, 2))
+        return cls([l['name'] for l in locations], [l.get('river') or '' for l in locations], coords, names, path_coords, offsets)
+
+    def path(self, i: int) -> np.ndarray:
+        """Zero-copy (n, 2) view of path `i`."""
+        return self.path_coords[self.path_offsets[i]:self.path_offsets[i + 1]]
+
+    def path_index(self, name: str) -> int:
+        return self.path_names.index(name)
+
+    def nearest_vertex(self, lat: float, lon: float):
+        """Return (path_index, vertex_index_within_path) of the vertex closest in degree space."""
+        d2 = (self.path_coords[:, 0] - lat) ** 2 + (self.path_coords[:, 1] - lon) ** 2
+        g = int(np.argmin(d2))
+        pi = int(np.searchsorted(self.path_offsets, g, side='right') - 1)
+        return pi, g - int(self.path_offsets[pi])
+
+    def segments_near(self, lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> np.ndarray:
+        """Indices of segments whose bounding box intersects the given box (degrees)."""
+        a, b = self.seg_a, self.seg_b
+        hit = ((np.minimum(a[:, 0], b[:, 0]) <= lat_max) & (np.maximum(a[:, 0], b[:, 0]) >= lat_min)
+               & (np.minimum(a[:, 1], b[:, 1]) <= lon_max) & (np.maximum(a[:, 1], b[:, 1]) >= lon_min))
+        return np.flatnonzero(hit)
+
+    def station_distances_m(self, lat: float, lon: float) -> np.ndarray:
+        return haversine_m(lat, lon, self.coords[:, 0], self.coords[:, 1])
+
+    def project(self, lat, lon, chunk_elems: int = 2_000_000, segments=None):
+        """Project points onto the nearest river segment.
+
+        Returns (path_index, along_m, offset_m) arrays: the path of the closest
+        segment, meters along that path to the projection and the distance from the
+        point to it. The projection parameter is computed in degree space and the
+        closest segment chosen by great-circle distance, as the per-point code does.
+        Points are processed in chunks of about `chunk_elems` point-segment pairs.
+        `segments` restricts the candidates to those segment indices.
+        """
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        n = len(lat)
+        path_idx = np.full(n, -1, dtype=np.int64)
+        along = np.full(n, np.nan)
+        offset = np.full(n, np.inf)
+        seg = np.arange(len(self.seg_a)) if segments is None else np.asarray(segments, dtype=np.int64)
+        n_seg = len(seg)
+        if n_seg == 0:
+            return path_idx, along, offset
+        a, b = self.seg_a[seg], self.seg_b[seg]
+        d = b - a
+        seg2 = (d * d).sum(axis=1)
+        step = max(1, chunk_elems // n_seg)
+        for s in range(0, n, step):
+            plat, plon = lat[s:s + step, None], lon[s:s + step, None]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                t = ((plat - a[:, 0]) * d[:, 0] + (plon - a[:, 1]) * d[:, 1]) / seg2
+            t = np.where(seg2 > 0, np.clip(t, 0.0, 1.0), 0.0)
+            qlat = a[:, 0] + t * d[:, 0]
+            qlon = a[:, 1] + t * d[:, 1]
+            dist = haversine_m(plat, plon, qlat, qlon)
+            best = np.argmin(dist, axis=1)
+            rows = np.arange(len(best))
+            g = seg[best]
+            path_idx[s:s + step] = self.seg_path[g]
+            along[s:s + step] = self.seg_cum_m[g] + t[rows, best] * self.seg_len_m[g]
+            offset[s:s + step] = dist[rows, best]
+        return path_idx, along, offset
+
+
+class PathDicts(Mapping):
+    """Read-only {path name: [{'latitude', 'longitude'}, ...]} view of a PackedGeo's paths,
+    building each list on first access (the shape `locations.js` parsing produces)."""
+
+    def __init__(self, geo: PackedGeo):
+        self._geo = geo
+        self._index = {name: i for i, name in enumerate(geo.path_names)}
+        self._lists: Dict[str, List[Dict[str, float]]] = {}
+
+    def __getitem__(self, name):
+        pts = self._lists.get(name)
+        if pts is None:
+            pts = self._lists[name] = [{'latitude': lat, 'longitude': lon} for lat, lon in self._geo.path(self._index[name]).tolist()]
+        return pts
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
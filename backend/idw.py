@@ -0,0 +1,97 @@
+"""Inverse-distance-weighted blending of station predictions.
+
+All sample points are blended against all stations with array operations: a
+(points x stations) distance matrix is turned into weights `1 / d**power`, cut to
+the `k` nearest stations and/or those within `radius_m`, normalised per row and
+multiplied with the (stations x parameters) prediction table. Points are processed
+in chunks so the matrices stay bounded for very large requests.
+
+Distances are great-circle meters by default. With `metric='river'` they are
+measured along the river network: both the point and the station are projected
+onto their nearest river path, and the distance is the along-path gap plus both
+offsets from the path. Stations on another path are unreachable; a point with no
+reachable station falls back to great-circle distances.
+"""
+from typing import Optional
+
+import numpy as np
+
+from backend.geodata import PackedGeo, haversine_m
+
+# points x stations elements per chunk
+CHUNK_ELEMS = 2_000_000
+# closer than this a point takes the station's values exactly
+EXACT_M = 1e-6
+
+
+def idw_blend(dist: np.ndarray, values: np.ndarray, power: float = 2.0, k: Optional[int] = None,
+              radius_m: Optional[float] = None):
+    """Blend `values` (stations x params) for distance rows `dist` (points x stations, meters).
+
+    Returns (blended, weights): (points x params) and the normalised (points x stations)
+    weights. A point with no station left after the k/radius cutoffs takes its nearest
+    station; points on top of a station take that station's values.
+    """
+    d = np.array(dist, dtype=np.float64)
+    n_st = d.shape[1]
+    if k is not None and 0 < k < n_st:
+        kth = np.partition(d, k - 1, axis=1)[:, k - 1:k]
+        d[d > kth] = np.inf
+    if radius_m is not None:
+        d[d > radius_m] = np.inf
+    finite = np.isfinite(d)
+    empty = ~finite.any(axis=1)
+    if empty.any():
+        rows = np.flatnonzero(empty)
+        nearest = np.argmin(dist[rows], axis=1)
+        d[rows, nearest] = dist[rows, nearest]
+        finite[rows, nearest] = np.isfinite(d[rows, nearest])
+    exact = finite & (d <= EXACT_M)
+    with np.errstate(divide='ignore'):
+        w = np.where(finite, 1.0 / np.maximum(d, EXACT_M) ** power, 0.0)
+    on_station = exact.any(axis=1)
+    w[on_station] = exact[on_station]
+    total = w.sum(axis=1, keepdims=True)
+    w = np.divide(w, total, out=np.zeros_like(w), where=total > 0)
+    blended = w @ values
+    blended[total[:, 0] == 0] = np.nan
+    return blended, w
+
+
+def river_distances(geo: PackedGeo, p_lat, p_lon, s_proj):
+    """Along-river distances (points x stations); `s_proj` is `geo.project()` of the stations."""
+    p_path, p_along, p_off = geo.project(p_lat, p_lon)
+    s_path, s_along, s_off = s_proj
+    d = np.abs(p_along[:, None] - s_along[None, :]) + p_off[:, None] + s_off[None, :]
+    d[p_path[:, None] != s_path[None, :]] = np.inf
+    return d
+
+
+def idw_predict(p_lat, p_lon, s_lat, s_lon, values, power: float = 2.0, k: Optional[int] = None,
+                radius_m: Optional[float] = None, metric: str = 'haversine', geo: Optional[PackedGeo] = None):
+    """IDW `values` (stations x params) at points. Returns (blended, nearest_station, n_contributing)."""
+    p_lat = np.asarray(p_lat, dtype=np.float64)
+    p_lon = np.asarray(p_lon, dtype=np.float64)
+    s_lat = np.asarray(s_lat, dtype=np.float64)
+    s_lon = np.asarray(s_lon, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    n, n_st = len(p_lat), len(s_lat)
+    blended = np.full((n, values.shape[1]), np.nan)
+    nearest = np.zeros(n, dtype=np.int64)
+    used = np.zeros(n, dtype=np.int64)
+    if n == 0 or n_st == 0:
+        return blended, nearest, used
+    river = metric == 'river' and geo is not None and len(geo.seg_a) > 0
+    s_proj = geo.project(s_lat, s_lon) if river else None
+    step = max(1, CHUNK_ELEMS // n_st)
+    for s in range(0, n, step):
+        sl = slice(s, s + step)
+        dist = haversine_m(p_lat[sl, None], p_lon[sl, None], s_lat[None, :], s_lon[None, :])
+        if river:
+            along = river_distances(geo, p_lat[sl], p_lon[sl], s_proj)
+            reachable = np.isfinite(along).any(axis=1)
+            dist = np.where(reachable[:, None], along, dist)
+        blended[sl], w = idw_blend(dist, values, power, k, radius_m)
+        nearest[sl] = np.argmin(dist, axis=1)
+        used[sl] = (w > 0).sum(axis=1)
+    return blended, nearest, used
@@ -1,14 +1,27 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
+from fastapi import FastAPI, Query, Request, Response, WebSocket
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
 import json
-from typing import Dict, Any
+import os
+from typing import Dict, Any, List, Optional
 from pathlib import Path
 import joblib
 import numpy as np
 import pandas as pd
 import re
 
+from backend import metrics, observations, profiling, rules, scrub, snapshot, tiles
+from backend.admission import TENANT_HEADER, AdmissionControl, InterpolateRequest
+from backend.batching import MicroBatcher
+from backend.compact_models import load_compact_models
+from backend.model_bundle import load_bundle
+from backend.registry import BASINS_DIR, ModelRegistry
+from backend.executor import interpolation_size, offloader
+from backend.geodata import PackedGeo, PathDicts, haversine_m
+from backend.idw import idw_predict
+from backend.polyline import decode_locations
+from backend.responses import FastJSONResponse, columnar_response, columns_from_rows, negotiate, not_acceptable, round_array
+
 
 def _round2(v):
     try:
@@ -18,7 +31,7 @@ def _round2(v):
     except Exception:
         return v
 
-app = FastAPI(title="Water Quality Predictor API")
+app = FastAPI(title="Water Quality Predictor API", default_response_class=FastJSONResponse)
 
 # Allow requests from static frontend (Netlify) during development
 app.add_middleware(
@@ -28,6 +41,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+if profiling.ENABLED:
+    # only installed when asked for; see backend/profiling.py
+    app.add_middleware(profiling.ProfileMiddleware)
 
 
 MODEL_PATH = Path(__file__).resolve().parents[1] / "WaterQualityApp" / "src" / "data" / "model_export.json"
@@ -36,8 +53,8 @@ MODEL_PATH = Path(__file__).resolve().parents[1] / "WaterQualityApp" / "src" / "
 class PredictRequest(BaseModel):
     river: str
     location: str
-    month: int
-    year: int
+    month: int = Field(ge=1, le=12)
+    year: int = Field(ge=1900, le=2100)
 
 
 def load_model_data() -> Dict[str, Any]:
@@ -56,12 +73,53 @@ def get_season_name(month: int) -> str:
 
 
 class Predictor:
+    # bounds from the original JS implementation
+    BOUNDS = {"pH": (6.0, 9.0), "DO (mg/L)": (0.0, 15.0), "BOD (mg/L)": (0.0, 30.0)}
+
     def __init__(self, model_data: Dict[str, Any]):
         self.model_data = model_data
         self.river_enc = model_data.get("encoders", {}).get("rivers", {})
         self.location_enc = model_data.get("encoders", {}).get("locations", {})
         self.season_enc = model_data.get("encoders", {}).get("seasons", {})
         self.coeffs = model_data.get("simplified_coefficients", {})
+        self._pack()
+
+    TABLES = ("base", "river_effect", "location_effect", "seasonal_effect", "month_coef", "year_coef", "lower", "upper")
+
+    @classmethod
+    def from_tables(cls, model_data: Dict[str, Any], tables: Dict[str, np.ndarray]) -> "Predictor":
+        """A Predictor over already packed `TABLES` (e.g. from the warm-start snapshot)."""
+        self = cls.__new__(cls)
+        self.model_data = model_data
+        self.river_enc = model_data.get("encoders", {}).get("rivers", {})
+        self.location_enc = model_data.get("encoders", {}).get("locations", {})
+        self.season_enc = model_data.get("encoders", {}).get("seasons", {})
+        self.coeffs = model_data.get("simplified_coefficients", {})
+        self.params = list(self.coeffs.keys())
+        for name in cls.TABLES:
+            setattr(self, name, tables[name])
+        return self
+
+    def _pack(self):
+        """Pack the coefficient dicts into contiguous (param x code) arrays."""
+        self.params = list(self.coeffs.keys())
+
+        def table(key, enc):
+            width = max([len(enc)] + [len(c.get(key) or []) for c in self.coeffs.values()] + [1])
+            out = np.zeros((len(self.params), width))
+            for i, c in enumerate(self.coeffs.values()):
+                eff = c.get(key) or []
+                out[i, :len(eff)] = eff
+            return out
+
+        self.base = np.array([c.get("base", 0) for c in self.coeffs.values()], dtype=np.float64)
+        self.river_effect = table("river_effect", self.river_enc)
+        self.location_effect = table("location_effect", self.location_enc)
+        self.seasonal_effect = table("seasonal_effect", self.season_enc)
+        self.month_coef = np.array([c.get("month_coefficient", 0) for c in self.coeffs.values()], dtype=np.float64)
+        self.year_coef = np.array([c.get("year_coefficient", 0) for c in self.coeffs.values()], dtype=np.float64)
+        self.lower = np.array([self.BOUNDS.get(p, (0.0 if "MPN" in p else -np.inf, None))[0] for p in self.params])
+        self.upper = np.array([self.BOUNDS.get(p, (None, np.inf))[1] for p in self.params])
 
     def predict(self, river: str, location: str, month: int, year: int) -> Dict[str, Any]:
         river_encoded = self.river_enc.get(river, 0)
@@ -69,91 +127,121 @@ class Predictor:
         season_name = get_season_name(month)
         season_encoded = self.season_enc.get(season_name, 0)
 
-        predictions: Dict[str, Any] = {}
-
-        for param, coef in self.coeffs.items():
-            value = coef.get("base", 0)
-            # add effects if present (names differ slightly in JSON)
-            value += coef.get("river_effect", [0])[river_encoded] if coef.get("river_effect") else 0
-            value += coef.get("location_effect", [0])[location_encoded] if coef.get("location_effect") else 0
-            value += coef.get("seasonal_effect", [0])[season_encoded] if coef.get("seasonal_effect") else 0
-            value += coef.get("month_coefficient", 0) * (month - 6)
-            value += coef.get("year_coefficient", 0) * (year - 2020)
-
-            # bounds from the original JS implementation
-            if param == "pH":
-                value = max(6.0, min(9.0, value))
-            elif param == "DO (mg/L)":
-                value = max(0, min(15, value))
-            elif param == "BOD (mg/L)":
-                value = max(0, min(30, value))
-            elif "MPN" in param:
-                value = max(0, value)
-
-            predictions[param] = round(value, 2)
-
-        # classification
-        ph = predictions.get("pH", 0)
-        do_level = predictions.get("DO (mg/L)", 0)
-        bod = predictions.get("BOD (mg/L)", 0)
-        water_quality = "Non Complying"
-        if 6.5 <= ph <= 8.5 and do_level >= 5.0 and bod <= 3.0:
-            water_quality = "Complying"
-        predictions["Water Quality"] = water_quality
+        # add effects if present (names differ slightly in JSON)
+        values = self.base + self.river_effect[:, river_encoded]
+        values = values + self.location_effect[:, location_encoded]
+        values = values + self.seasonal_effect[:, season_encoded]
+        values = values + self.month_coef * (month - 6)
+        values = values + self.year_coef * (year - 2020)
+        values = np.clip(values, self.lower, self.upper)
 
+        predictions: Dict[str, Any] = {p: round(float(v), 2) for p, v in zip(self.params, values)}
+        predictions["Water Quality"] = rules.COMPLIANCE.label(predictions)
         return predictions
 
+    def predict_batch(self, rivers, locations, months, years) -> np.ndarray:
+        """Vectorised `predict` values: (n_rows, n_params) array, clipped but not rounded."""
+        months = np.asarray(months, dtype=np.int64)
+        years = np.asarray(years, dtype=np.int64)
+        r = np.fromiter((self.river_enc.get(v, 0) for v in rivers), dtype=np.int64, count=len(months))
+        l = np.fromiter((self.location_enc.get(v, 0) for v in locations), dtype=np.int64, count=len(months))
+        s = np.fromiter((self.season_enc.get(get_season_name(int(m)), 0) for m in months), dtype=np.int64, count=len(months))
+        values = self.base + self.river_effect[:, r].T
+        values = values + self.location_effect[:, l].T
+        values = values + self.seasonal_effect[:, s].T
+        values = values + self.month_coef * (months - 6)[:, np.newaxis]
+        values = values + self.year_coef * (years - 2020)[:, np.newaxis]
+        return np.clip(values, self.lower, self.upper)
+
+    def predict_many(self, rows) -> list:
+        """`predict` for a list of (river, location, month, year) tuples in one vectorised pass."""
+        if not rows:
+            return []
+        rivers, locations, months, years = zip(*rows)
+        values = self.predict_batch(rivers, locations, months, years)
+        labels = rules.COMPLIANCE.classify(dict(zip(self.params, np.round(values, 2).T))).tolist()
+        out = []
+        for vals, label in zip(values.tolist(), labels):
+            predictions: Dict[str, Any] = {p: round(v, 2) for p, v in zip(self.params, vals)}
+            predictions["Water Quality"] = label
+            out.append(predictions)
+        return out
 
-_model_data = load_model_data()
-predictor = Predictor(_model_data)
 
 # try to load ML models and encoders if available
 MODELS_DIR = Path(__file__).resolve().parents[1] / 'backend' / 'models'
-ml_models = {}
-ml_encoders = None
-transforms = {}
-if MODELS_DIR.exists():
+# compact memory-mapped export written by ml/train_lgb.py (preferred: no LightGBM/sklearn import)
+COMPACT_DIR = MODELS_DIR / 'compact'
+# WQ_MODEL_BUNDLE serves the quantized app bundle (backend/model_bundle.py) instead, e.g. to check it end to end
+MODEL_BUNDLE = os.environ.get('WQ_MODEL_BUNDLE')
+ML_TARGETS = ['pH', 'DO (mg/L)', 'BOD (mg/L)', 'FC MPN/100ml', 'TC MPN/100ml']
+DEFAULT_BASIN = os.environ.get('WQ_DEFAULT_BASIN', 'pune')
+
+
+def _model_file_stem(target: str) -> str:
+    # must match the file naming in ml/train_lgb.py
+    return target.replace(' ', '_').replace('/', '_')
+
+
+def load_joblib_models():
+    """Load pickled boosters, encoders and transforms from MODELS_DIR (legacy format)."""
+    models = {}
+    encoders = None
+    tfs = {}
+    # encoders.joblib expected (dict with 'le_river' and 'le_loc')
+    enc_path = MODELS_DIR / 'encoders.joblib'
+    if enc_path.exists():
+        encoders = joblib.load(str(enc_path))
+
+    # map model files to canonical target names by their exact file name
+    for target in ML_TARGETS:
+        p = MODELS_DIR / f'{_model_file_stem(target)}.joblib'
+        if not p.exists():
+            continue
+        try:
+            models[target] = joblib.load(str(p))
+        except Exception:
+            continue
+
+    # load transforms.json if exists
+    tpath = MODELS_DIR / 'transforms.json'
+    if tpath.exists():
+        try:
+            with open(tpath, 'r') as f:
+                tfs = json.load(f)
+        except:
+            tfs = {}
+    return models, encoders, tfs
+
+
+def load_default_models() -> Dict[str, Any]:
+    """The default basin's shard: WQ_MODEL_BUNDLE, else the compact export, else the joblib files."""
+    if MODEL_BUNDLE:
+        return load_bundle(MODEL_BUNDLE)
+    if not MODELS_DIR.exists():
+        return {'models': {}, 'encoders': None, 'transforms': {}}
     try:
-        # encoders.joblib expected (dict with 'le_river' and 'le_loc')
-        enc_path = MODELS_DIR / 'encoders.joblib'
-        if enc_path.exists():
-            ml_encoders = joblib.load(str(enc_path))
-
-        # load all joblib models and map to canonical target names
-        for p in MODELS_DIR.glob('*.joblib'):
-            stem = p.stem.lower()
-            try:
-                mdl = joblib.load(str(p))
-            except Exception:
-                continue
-            if 'ph' in stem:
-                ml_models['pH'] = mdl
-            elif 'do' in stem:
-                ml_models['DO (mg/L)'] = mdl
-            elif 'bod' in stem:
-                ml_models['BOD (mg/L)'] = mdl
-            elif 'fc' in stem or 'f c' in stem:
-                ml_models['FC MPN/100ml'] = mdl
-            elif 'tc' in stem:
-                ml_models['TC MPN/100ml'] = mdl
-
-        # load transforms.json if exists
-        tpath = MODELS_DIR / 'transforms.json'
-        if tpath.exists():
-            try:
-                with open(tpath, 'r') as f:
-                    transforms = json.load(f)
-            except:
-                transforms = {}
+        if (COMPACT_DIR / 'manifest.json').exists():
+            return load_compact_models(COMPACT_DIR)
     except Exception:
-        ml_models = {}
-        ml_encoders = None
-        transforms = {}
+        pass
+    models, encoders, tfs = load_joblib_models()
+    return {'models': models, 'encoders': encoders, 'transforms': tfs,
+            'nbytes': sum(p.stat().st_size for p in MODELS_DIR.glob('*.joblib'))}
+
+
+# boosters per basin, loaded on first request (backend/registry.py); stations on rivers
+# no basin shard knows use the default basin
+model_registry = ModelRegistry.from_directory(DEFAULT_BASIN, load_default_models)
+
+
+# stations and river paths; WQ_LOCATIONS_JS points the backend at another file (e.g. a synthetic network)
+LOCATIONS_JS = Path(os.environ.get('WQ_LOCATIONS_JS') or Path(__file__).resolve().parents[1] / 'WaterQualityApp' / 'src' / 'data' / 'locations.js')
 
 
 def load_locations_js():
     """Parse `WaterQualityApp/src/data/locations.js` to extract list of locations with river mapping."""
-    js_path = Path(__file__).resolve().parents[1] / 'WaterQualityApp' / 'src' / 'data' / 'locations.js'
+    js_path = LOCATIONS_JS
     locations = []
     try:
         text = js_path.read_text(encoding='utf-8')
@@ -179,7 +267,7 @@ def load_locations_js():
 
 def load_river_paths_js():
     """Parse riverPaths object from `locations.js` and return dict of name->list of points."""
-    js_path = Path(__file__).resolve().parents[1] / 'WaterQualityApp' / 'src' / 'data' / 'locations.js'
+    js_path = LOCATIONS_JS
     paths = {}
     try:
         text = js_path.read_text(encoding='utf-8')
@@ -204,10 +292,99 @@ def load_river_paths_js():
     return paths
 
 
-# load river paths once
-_river_paths = load_river_paths_js()
+# station projections are precomputed for the snapshot up to this many station x segment pairs
+SNAPSHOT_PROJECTION_PAIRS = float(os.environ.get('WQ_SNAPSHOT_PROJECTION_PAIRS', 2e8))
+# Douglas-Peucker tolerances (meters) of the simplified river path levels (`PackedGeo.level`)
+PATH_TOLERANCES_M = tuple(float(t) for t in os.environ.get('WQ_PATH_TOLERANCES_M', '2,10,50,250,1000').split(',') if t.strip())
+
+
+def derive_serving_state():
+    """Parse the inputs and derive the read-only serving state: (header, arrays) for `backend.snapshot`."""
+    model_data = load_model_data()
+    packed = Predictor(model_data)
+    locations = load_locations_js()
+    geo = PackedGeo.from_parsed(locations, load_river_paths_js())
+    if len(geo.coords) * len(geo.seg_a) <= SNAPSHOT_PROJECTION_PAIRS:
+        geo.index_station_paths()
+    geo.index_levels(PATH_TOLERANCES_M)
+    header = {'model_data': model_data, 'locations': [[l['name'], l.get('river')] for l in locations], 'path_names': list(geo.path_names)}
+    arrays = {'station_coords': geo.coords, 'path_coords': geo.path_coords, 'path_offsets': geo.path_offsets, **geo.derived()}
+    arrays.update({f'predictor.{name}': getattr(packed, name) for name in Predictor.TABLES})
+    return header, arrays
+
+
+def restore_serving_state(header, arrays):
+    """(model_data, predictor, locations, river_paths, geo) from `derive_serving_state` output."""
+    model_data = header['model_data']
+    tables = {name: arrays[f'predictor.{name}'] for name in Predictor.TABLES}
+    coords = arrays['station_coords']
+    locations = []
+    for (name, river), (lat, lon) in zip(header['locations'], coords.tolist()):
+        loc = {'name': name, 'river': river}
+        if lat == lat and lon == lon:
+            loc['latitude'], loc['longitude'] = lat, lon
+        locations.append(loc)
+    geo = PackedGeo([l['name'] for l in locations], [l.get('river') or '' for l in locations], coords,
+                    header['path_names'], arrays['path_coords'], arrays['path_offsets'], index=arrays)
+    return model_data, Predictor.from_tables(model_data, tables), locations, PathDicts(geo), geo
+
+
+# geodata, Predictor tables and station projections are derived once per set of inputs and
+# memory-mapped from the warm-start snapshot afterwards (backend/snapshot.py)
+SNAPSHOT_KEY = snapshot.input_key([MODEL_PATH, LOCATIONS_JS], {'projection_pairs': SNAPSHOT_PROJECTION_PAIRS,
+                                                              'path_tolerances_m': PATH_TOLERANCES_M})
+_snapshot_header, _snapshot_arrays, SNAPSHOT_STATUS = snapshot.load_or_build(SNAPSHOT_KEY, derive_serving_state)
+# _geo holds contiguous copies of the geodata, read by the geometry code without touching per-point dicts
+_model_data, predictor, _js_locations, _river_paths, _geo = restore_serving_state(_snapshot_header, _snapshot_arrays)
+_level_paths = {}
+
+
+def _network(tolerance_m=None):
+    """(geo, river_paths) of the coarsest path level within `tolerance_m` meters; full resolution for None."""
+    geo = _geo.level(float(tolerance_m) if tolerance_m is not None else None)
+    if geo is _geo:
+        return _geo, _river_paths
+    paths = _level_paths.get(geo.tolerance_m)
+    if paths is None:
+        paths = _level_paths[geo.tolerance_m] = PathDicts(geo)
+    return geo, paths
+
+
+ML_FEATURES = ['river_enc', 'loc_enc', 'month_sin', 'month_cos', 'year_off']
+_station_codes = {}
+
+
+def _encode_station(river: str, name: str, basin: str = DEFAULT_BASIN, encoders=None):
+    """Return (river_enc, loc_enc) for the basin's ML models; unknown labels map to 0. Cached per station."""
+    key = (basin, river or '', name or '')
+    codes = _station_codes.get(key)
+    metrics.cache_lookup('station_codes', codes is not None)
+    if codes is None:
+        le_r = encoders.get('le_river') if encoders else None
+        le_l = encoders.get('le_loc') if encoders else None
+        # safe transform (unknown categories will raise) -> use try/except
+        try:
+            r_enc = int(le_r.transform([key[1]])[0]) if le_r is not None and key[1] else 0
+        except Exception:
+            r_enc = 0
+        try:
+            l_enc = int(le_l.transform([key[2]])[0]) if le_l is not None and key[2] else 0
+        except Exception:
+            l_enc = 0
+        codes = _station_codes[key] = (r_enc, l_enc)
+    return codes
 
-_js_locations = load_locations_js()
+
+def _ml_predict(target: str, mdl, Xdf: pd.DataFrame):
+    """Run one ML model over a feature frame, counting the call in metrics."""
+    metrics.record_inference(target, len(Xdf))
+    try:
+        return mdl.predict(Xdf)
+    except Exception:
+        # try passing column names as during training
+        Xdf_named = Xdf.copy()
+        Xdf_named.columns = ML_FEATURES
+        return mdl.predict(Xdf_named)
 
 
 @app.get("/encoders")
@@ -219,113 +396,195 @@ def encoders():
     }
 
 
+# concurrent /predict calls are scored together in one vectorised Predictor call
+predict_batcher = MicroBatcher(predictor.predict_many, name='predict')
+
+
 @app.post("/predict")
-def predict(req: PredictRequest):
-    preds = predictor.predict(req.river, req.location, req.month, req.year)
+async def predict(req: PredictRequest):
+    preds = await predict_batcher.submit((req.river, req.location, req.month, req.year))
     return {"input": req.dict(), "predictions": preds}
 
 
 @app.get('/predict_all')
-def predict_all(month: int, year: int):
-    """Return pH and DO predictions for all known locations for given month/year.
+def predict_all_endpoint(request: Request, month: int = Query(..., ge=1, le=12), year: int = Query(..., ge=1900, le=2100),
+                         standards: Optional[str] = None):
+    """JSON rows by default; Arrow IPC or msgpack columns when the Accept header asks for them.
+
+    `standards=cpcb,...` adds a class column per extra standard (see `/standards`).
+    """
+    fmt = negotiate(request.headers.get('accept'))
+    if fmt is None:
+        return not_acceptable()
+    try:
+        stds = rules.resolve(standards)
+    except KeyError as e:
+        return FastJSONResponse({'error': f'unknown standard {e.args[0]!r}', 'available': list(rules.STANDARDS)}, status_code=400)
+    if fmt != 'json':
+        return columnar_response(predict_all_columns(month, year, stds), {'month': month, 'year': year}, fmt)
+    # encoded directly (orjson) instead of through jsonable_encoder + json.dumps
+    return FastJSONResponse(predict_all(month, year, stds))
+
+
+# month/year slider: one WebSocket per client, answered with changed values only (backend/scrub.py)
+scrub_cache = scrub.ColumnCache()
+
+
+async def _scrub_step(month: int, year: int, standards):
+    try:
+        stds = rules.resolve(standards)
+    except KeyError as e:
+        raise ValueError(f'unknown standard {e.args[0]!r}')
+    key = (month, year, tuple(std.field for std in stds))
+    columns = scrub_cache.get(key)
+    metrics.cache_lookup('scrub_steps', columns is not None)
+    if columns is None:
+        columns = await offloader.run('predict_all', predict_all_columns, month, year, stds, offload=False)
+        scrub_cache.put(key, columns)
+    return columns, PREDICT_ALL_PARAMS
+
+
+@app.websocket('/ws/predict_all')
+async def predict_all_ws(ws: WebSocket):
+    """Send {"month", "year"[, "standards", "seq", "full"]} cursors; receive full state once, then diffs."""
+    await scrub.serve(ws, _scrub_step)
+
+
+@app.get('/standards')
+def standards():
+    """Classification standards: output field, classes with their bounds, default label."""
+    return {name: std.spec for name, std in rules.STANDARDS.items()}
+
+
+# observed history (backend/observations.py); empty until `python -m backend.observations build` has run
+observation_store = observations.ObservationStore(observations.DEFAULT_DIR)
+
+
+@app.get('/history')
+def history(location: str, request: Request, river: Optional[str] = None, start: Optional[str] = None,
+            end: Optional[str] = None, params: Optional[str] = None):
+    """Observed values of one station between `start` and `end` (YYYY-MM, inclusive), as columns.
+
+    JSON by default; Arrow IPC or msgpack when the Accept header asks for them.
+    """
+    fmt = negotiate(request.headers.get('accept'))
+    if fmt is None:
+        return not_acceptable()
+    observation_store.refresh()
+    station = observation_store.find_station(location, river)
+    if station is None:
+        return FastJSONResponse({'error': f'unknown station {location!r}'}, status_code=404)
+    try:
+        lo = observations.parse_month(start) if start else 0
+        hi = observations.parse_month(end) if end else 2 ** 31 - 1
+    except ValueError as e:
+        return FastJSONResponse({'error': str(e)}, status_code=400)
+    names = [p.strip() for p in params.split(',') if p.strip()] if params else observation_store.params
+    unknown = [p for p in names if p not in observation_store.params]
+    if unknown:
+        return FastJSONResponse({'error': f'unknown parameter {unknown[0]!r}', 'available': observation_store.params}, status_code=400)
+    cols = observations.history_columns(observation_store, observation_store.history(station, lo, hi, names), names)
+    river_name, location_name = observation_store.stations[station]
+    meta = {'river': river_name, 'location': location_name, 'start': start, 'end': end, 'count': len(cols['year'])}
+    if fmt != 'json':
+        return columnar_response(cols, meta, fmt)
+    return FastJSONResponse(dict(meta, history=cols))
+
+
+PREDICT_ALL_PARAMS = ['pH', 'DO (mg/L)', 'BOD (mg/L)', 'FC MPN/100ml', 'TC MPN/100ml']
+
+
+def predict_all_columns(month: int, year: int, standards=(rules.COMPLIANCE,)) -> Dict[str, Any]:
+    """`predict_all` as columns: name -> list/array with one entry per known location.
+
+    Each of `standards` (`backend.rules`) adds its label column.
+
     Tries to use ML models (pH, DO) if present under backend/models/, otherwise falls back to simplified predictor.
     """
     # derive list of locations from model data encoders
     # use JS locations if available (keeps river mapping accurate)
+    timer = metrics.stage_timer('predict_all')
     loc_list = _js_locations if _js_locations else [{'name': n, 'river': None} for n in list(_model_data.get('encoders', {}).get('locations', {}).keys())]
-
-    # Prepare simplified predictions (fall back)
-    simplified_map = {}
-    for item in loc_list:
-        simplified_map[item['name']] = predictor.predict(item.get('river') or '', item['name'], month, year)
-
-    # If ML models & encoders available, predict in batch for available targets
+    names = [item['name'] for item in loc_list]
+    rivers = [item.get('river') for item in loc_list]
+    n = len(loc_list)
+
+    # simplified predictions (fall back), one vectorised pass over all locations
+    simplified = predictor.predict_batch([r or '' for r in rivers], names, np.full(n, month), np.full(n, year))
+    simplified = {p: np.round(simplified[:, i], 2) for i, p in enumerate(predictor.params)}
+    timer.lap('simplified')
+
+    # If ML models & encoders available, predict in batch for available targets, one
+    # batch per basin; rows of a basin without models (or whose shard fails to load) keep
+    # the simplified values
     ml_results = {}
-    if ml_encoders and ml_models:
+    for basin, idx in (model_registry.group(rivers).items() if n else ()):
         try:
-            le_r = ml_encoders.get('le_river')
-            le_l = ml_encoders.get('le_loc')
-            rows = []
-            names = []
-            for item in loc_list:
-                names.append(item['name'])
-                river = item.get('river') or ''
-                # safe transform (unknown categories will raise) -> use try/except
-                try:
-                    r_enc = int(le_r.transform([river])[0]) if le_r is not None else 0
-                except Exception:
-                    r_enc = 0
-                try:
-                    l_enc = int(le_l.transform([item['name']])[0]) if le_l is not None else 0
-                except Exception:
-                    l_enc = 0
-                monthnum = month
-                rows.append({
-                    'river_enc': r_enc,
-                    'loc_enc': l_enc,
-                    'month_sin': np.sin(2 * np.pi * monthnum / 12),
-                    'month_cos': np.cos(2 * np.pi * monthnum / 12),
-                    'year_off': year - 2020
-                })
-            Xdf = pd.DataFrame(rows)
+            shard = model_registry.get(basin)
+        except Exception:
+            continue
+        if not (shard['encoders'] and shard['models']):
+            continue
+        try:
+            codes = np.array([_encode_station(rivers[i] or '', names[i], basin, shard['encoders']) for i in idx.tolist()],
+                             dtype=np.int64).reshape(len(idx), 2)
+            Xdf = pd.DataFrame({
+                'river_enc': codes[:, 0],
+                'loc_enc': codes[:, 1],
+                'month_sin': np.full(len(idx), np.sin(2 * np.pi * month / 12)),
+                'month_cos': np.full(len(idx), np.cos(2 * np.pi * month / 12)),
+                'year_off': np.full(len(idx), year - 2020),
+            })
+            timer.lap('ml_features')
 
             # predict per available ML model
-            for target, mdl in ml_models.items():
-                try:
-                    preds = mdl.predict(Xdf)
-                except Exception:
-                    # try passing column names as during training
-                    Xdf_named = Xdf.copy()
-                    Xdf_named.columns = ['river_enc', 'loc_enc', 'month_sin', 'month_cos', 'year_off']
-                    preds = mdl.predict(Xdf_named)
+            outputs = {}
+            for target, mdl in shard['models'].items():
+                preds = _ml_predict(target, mdl, Xdf)
 
                 # inverse transform if needed
-                transform = transforms.get(target)
+                transform = shard['transforms'].get(target)
                 if transform == 'log1p':
                     inv = np.expm1(preds)
                     inv = np.clip(inv, 0, None)
                 else:
                     inv = preds
-
-                for i, name in enumerate(names):
-                    ml_results.setdefault(name, {})
-                    ml_results[name][target] = _round2(inv[i])
-        except Exception:
-            ml_results = {}
-
-    out = []
-    for item in loc_list:
-        name = item['name']
-        simplified = simplified_map.get(name, {})
-        mlvals = ml_results.get(name, {})
-        pH = _round2(mlvals.get('pH', simplified.get('pH')))
-        do = _round2(mlvals.get('DO (mg/L)', simplified.get('DO (mg/L)')))
-        bod = _round2(simplified.get('BOD (mg/L)'))
-        fc = _round2(simplified.get('FC MPN/100ml'))
-        tc = _round2(simplified.get('TC MPN/100ml'))
-
-        # compute Water Quality using pH/DO/BOD
-        water_quality = 'Non Complying'
-        try:
-            if pH is not None and do is not None and bod is not None:
-                if 6.5 <= float(pH) <= 8.5 and float(do) >= 5.0 and float(bod) <= 3.0:
-                    water_quality = 'Complying'
+                outputs[target] = np.round(np.asarray(inv, dtype=np.float64), 2)
         except Exception:
-            water_quality = simplified.get('Water Quality')
-
-        out.append({
-            'location': name,
-            'river': item.get('river'),
-            'month': month,
-            'year': year,
-            'pH': pH,
-            'DO (mg/L)': do,
-            'BOD (mg/L)': bod,
-            'FC MPN/100ml': fc,
-            'TC MPN/100ml': tc,
-            'Water Quality': water_quality
-        })
-
+            outputs = {}
+        for target, values in outputs.items():
+            if target not in ml_results:
+                ml_results[target] = simplified[target].copy() if target in simplified else np.full(n, np.nan)
+            ml_results[target][idx] = values
+        timer.lap('ml_inference')
+
+    nan = np.full(n, np.nan)
+    columns = {
+        'location': names,
+        'river': rivers,
+        'latitude': _geo.coords[:, 0] if len(_geo.coords) == n else nan,
+        'longitude': _geo.coords[:, 1] if len(_geo.coords) == n else nan,
+        'month': np.full(n, month),
+        'year': np.full(n, year),
+        # ML outputs for pH and DO; the simplified model for the rest
+        'pH': ml_results.get('pH', simplified.get('pH', nan)),
+        'DO (mg/L)': ml_results.get('DO (mg/L)', simplified.get('DO (mg/L)', nan)),
+        'BOD (mg/L)': simplified.get('BOD (mg/L)', nan),
+        'FC MPN/100ml': simplified.get('FC MPN/100ml', nan),
+        'TC MPN/100ml': simplified.get('TC MPN/100ml', nan),
+    }
+    for std in standards:
+        columns[std.field] = std.classify(columns).tolist()
+    timer.finish('response_assembly')
+    return columns
+
+
+def predict_all(month: int, year: int, standards=(rules.COMPLIANCE,)):
+    """Return predictions for all known locations for given month/year (see `predict_all_columns`)."""
+    c = predict_all_columns(month, year, standards)
+    keys = ['location', 'river', 'month', 'year'] + PREDICT_ALL_PARAMS + [std.field for std in standards]
+    cols = [c[k] if isinstance(c[k], list) else (round_array(c[k], 2) if k in PREDICT_ALL_PARAMS else c[k].tolist()) for k in keys]
+    out = [dict(zip(keys, row)) for row in zip(*cols)]
     return {'month': month, 'year': year, 'predictions': out}
 
 
@@ -383,8 +642,310 @@ def _haversine_m(a, b):
     return 2 * R * math.asin(min(1, math.sqrt(hav)))
 
 
+def _sample_polyline(poly: np.ndarray, count: int) -> List[Dict[str, Any]]:
+    """`count` points evenly spaced by great-circle length along the (n, 2) polyline `poly`,
+    each with the index of the nearer end of its segment as `source_index`."""
+    dlen = haversine_m(poly[:-1, 0], poly[:-1, 1], poly[1:, 0], poly[1:, 1])
+    # running sums in order, as the per-segment walk added them
+    cum = np.cumsum(dlen)
+    total = float(cum[-1])
+    if total == 0:
+        return [{'latitude': float(poly[0, 0]), 'longitude': float(poly[0, 1])}] * count
+    target = (np.arange(count) / (count - 1) if count > 1 else np.zeros(1)) * total
+    # first segment whose end reaches the target; past the end (rounding) means the last vertex
+    si = np.searchsorted(cum, target, side='left')
+    inside = si < len(dlen)
+    si_c = np.minimum(si, len(dlen) - 1)
+    acc = np.concatenate([[0.0], cum[:-1]])[si_c]
+    seg_t = np.zeros(count)
+    pos = inside & (dlen[si_c] > 0)
+    seg_t[pos] = (target[pos] - acc[pos]) / dlen[si_c][pos]
+    a, b = poly[si_c], poly[si_c + 1]
+    lat = np.where(inside, a[:, 0] + (b[:, 0] - a[:, 0]) * seg_t, poly[-1, 0])
+    lon = np.where(inside, a[:, 1] + (b[:, 1] - a[:, 1]) * seg_t, poly[-1, 1])
+    idx = np.where(inside, np.where(seg_t < 0.5, si_c, si_c + 1), len(poly) - 1)
+    return [{'latitude': la, 'longitude': lo, 'source_index': i} for la, lo, i in zip(lat.tolist(), lon.tolist(), idx.tolist())]
+
+
+def _station_table(stations, month, year) -> np.ndarray:
+    """(stations x predictor.params) predictions, rounded like Predictor.predict."""
+    n = len(stations)
+    values = predictor.predict_batch([s.get('river') or '' for s in stations], [s.get('name') or '' for s in stations],
+                                     np.full(n, month), np.full(n, year))
+    return np.array([[round(v, 2) for v in row] for row in values.tolist()], dtype=np.float64).reshape(n, len(predictor.params))
+
+
+def _straddle_candidates(pts, known, input_poly: Optional[np.ndarray], timer, network: Optional[PackedGeo] = None):
+    """Per sample point, the indices into `known` of the stations to blend between.
+
+    Each point is projected onto its nearest search path (the input polyline, else every
+    river path of `network`, default the full-resolution `_geo`); the stations whose
+    projections onto that path straddle the point's are used. When the nearest path has
+    no straddling pair, the pair found on an earlier running-best path is kept; failing
+    that, the two nearest stations. Points are projected once per path and each path's
+    stations once per request.
+    """
+    n = len(pts)
+    p_lat = np.array([p['latitude'] for p in pts], dtype=np.float64)
+    p_lon = np.array([p['longitude'] for p in pts], dtype=np.float64)
+    k_idx = np.array([i for i, k in enumerate(known) if k.get('latitude') is not None and k.get('longitude') is not None], dtype=np.int64)
+    k_lat = np.array([known[i]['latitude'] for i in k_idx], dtype=np.float64)
+    k_lon = np.array([known[i]['longitude'] for i in k_idx], dtype=np.float64)
+    geo = PackedGeo([], [], np.empty((0, 2)), ['input'], input_poly, [0, len(input_poly)]) if input_poly is not None else (network or _geo)
+
+    # running nearest path per point; `history` keeps every (path, along_m) it passed through
+    best_d = np.full(n, np.inf)
+    history = [[] for _ in range(n)]
+    for j in range(len(geo.path_names)):
+        segs = np.flatnonzero(geo.seg_path == j)
+        if len(segs) == 0:
+            continue
+        _, along, off = geo.project(p_lat, p_lon, segments=segs)
+        better = off < best_d
+        best_d[better] = off[better]
+        for i in np.flatnonzero(better).tolist():
+            history[i].append((j, float(along[i])))
+    timer.lap('projection')
+
+    stations_on = {}
+
+    def straddle(j, along):
+        if j not in stations_on:
+            # precomputed for the served stations on the network paths (warm-start snapshot)
+            stations_on[j] = geo.stations_on_path(j) if known is _js_locations else None
+        if stations_on[j] is None:
+            _, s_along, _ = geo.project(k_lat, k_lon, segments=np.flatnonzero(geo.seg_path == j))
+            order = np.argsort(s_along, kind='stable')
+            stations_on[j] = (s_along[order], k_idx[order])
+        s_along, s_idx = stations_on[j]
+        pos = int(np.searchsorted(s_along, along, side='right'))
+        return [int(s_idx[pos - 1]), int(s_idx[pos])] if 0 < pos < len(s_along) else None
+
+    out = [None] * n
+    for i in range(n):
+        for j, along in reversed(history[i]):
+            out[i] = straddle(j, along)
+            if out[i] is not None:
+                break
+    # no straddling pair: the two nearest stations
+    rest = [i for i in range(n) if out[i] is None]
+    if rest and len(k_idx):
+        d = haversine_m(p_lat[rest, None], p_lon[rest, None], k_lat[None, :], k_lon[None, :])
+        nearest = np.argsort(d, axis=1, kind='stable')[:, :2]
+        for i, row in zip(rest, nearest.tolist()):
+            out[i] = [int(k_idx[c]) for c in row]
+    return [c or [] for c in out]
+
+
+def _blend_candidates(pts, known, candidates_per_point, month, year):
+    """Result rows (without class labels) and debug entries for `_straddle_candidates` output.
+
+    Every station is predicted once; points between two stations take the linear blend
+    at their projection onto the segment joining them, others their nearest station.
+    """
+    table = _station_table(known, month, year)
+    # like predictor.predict().get(key, 0): a parameter the model lacks blends as 0 ...
+    values = np.zeros((len(known), len(PREDICT_ALL_PARAMS)))
+    present = [p in predictor.params for p in PREDICT_ALL_PARAMS]
+    for c, p in enumerate(PREDICT_ALL_PARAMS):
+        if present[c]:
+            values[:, c] = table[:, predictor.params.index(p)]
+
+    def coords(i):
+        return known[i].get('latitude') is not None
+
+    two = [i for i, c in enumerate(candidates_per_point) if len(c) >= 2 and coords(c[0]) and coords(c[1])]
+    blended = {}
+    if two:
+        left = np.array([candidates_per_point[i][0] for i in two])
+        right = np.array([candidates_per_point[i][1] for i in two])
+        k_lat = np.array([k.get('latitude') if k.get('latitude') is not None else np.nan for k in known], dtype=np.float64)
+        k_lon = np.array([k.get('longitude') if k.get('longitude') is not None else np.nan for k in known], dtype=np.float64)
+        px = np.array([pts[i]['latitude'] for i in two], dtype=np.float64)
+        py = np.array([pts[i]['longitude'] for i in two], dtype=np.float64)
+        # fraction along the left -> right station segment, in degree space
+        dx, dy = k_lat[right] - k_lat[left], k_lon[right] - k_lon[left]
+        seg2 = dx * dx + dy * dy
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.where(seg2 > 0, ((px - k_lat[left]) * dx + (py - k_lon[left]) * dy) / seg2, 0.0)
+        t = np.clip(t, 0.0, 1.0) + 0.0  # + 0.0 turns -0.0 into 0.0
+        mix = (1.0 - t)[:, None] * values[left] + t[:, None] * values[right]
+        cols = [round_array(mix[:, c], 4) for c in range(len(PREDICT_ALL_PARAMS))]
+        for r, i in enumerate(two):
+            blended[i] = (float(t[r]), [col[r] for col in cols])
+
+    results = []
+    debug_info = []
+    for pi, pt in enumerate(pts):
+        cand = candidates_per_point[pi]
+        if pi in blended:
+            t_frac, vals = blended[pi]
+            near = known[cand[0] if t_frac <= 0.5 else cand[1]]
+            debug_info.append({'point_index': pi, 'point': pt, 't_frac': t_frac, 'left_name': known[cand[0]].get('name'), 'right_name': known[cand[1]].get('name')})
+            results.append({'latitude': pt['latitude'], 'longitude': pt['longitude'], 'nearest_location': near.get('name', ''), 'nearest_river': near.get('river', ''),
+                            **dict(zip(PREDICT_ALL_PARAMS, vals)), 'Water Quality': None, 't_frac': t_frac})
+            continue
+        # ... and is missing (None) when a point takes its nearest station
+        if cand:
+            near = known[cand[0]]
+            vals = [float(values[cand[0], c]) if present[c] else None for c in range(len(PREDICT_ALL_PARAMS))]
+            nearest_name, nearest_river = near.get('name', ''), near.get('river', '')
+        else:
+            vals = [None] * len(PREDICT_ALL_PARAMS)
+            nearest_name = nearest_river = ''
+        debug_info.append({'point_index': pi, 'point': pt, 'nearest_name': nearest_name})
+        results.append({'latitude': pt['latitude'], 'longitude': pt['longitude'], 'nearest_location': nearest_name, 'nearest_river': nearest_river,
+                        **dict(zip(PREDICT_ALL_PARAMS, vals)), 'Water Quality': None})
+    return results, debug_info
+
+
+def _idw_interpolation(pts, known, body, month, year, count, timer, standards, network: Optional[PackedGeo] = None):
+    """`blend: 'idw'`: inverse-distance-weighted station predictions at every sample point.
+
+    Body options: `idw_power` (default 2), `idw_k` (nearest stations used, default all),
+    `idw_radius_m` (ignore stations farther than this) and `idw_metric` ('haversine' or
+    'river' for along-river distances).
+    """
+    stations = [k for k in known if k.get('latitude') is not None and k.get('longitude') is not None]
+    try:
+        power = float(body.get('idw_power', 2.0))
+        k = int(body['idw_k']) if body.get('idw_k') is not None else None
+        radius = float(body['idw_radius_m']) if body.get('idw_radius_m') is not None else None
+    except (TypeError, ValueError):
+        return {'error': 'idw_power, idw_k and idw_radius_m must be numbers'}
+    metric = str(body.get('idw_metric', 'haversine')).lower()
+    timer.lap('idw_options')
+
+    n_st = len(stations)
+    table = _station_table(stations, month, year)
+    p_lat = np.array([p['latitude'] for p in pts], dtype=np.float64)
+    p_lon = np.array([p['longitude'] for p in pts], dtype=np.float64)
+    blended, nearest, used = idw_predict(p_lat, p_lon, [s['latitude'] for s in stations], [s['longitude'] for s in stations],
+                                         table, power=power, k=k, radius_m=radius, metric=metric, geo=network or _geo)
+    timer.lap('idw_blend')
+
+    cols = {p: round_array(blended[:, i], 4) for i, p in enumerate(predictor.params)}
+    none = [None] * len(pts)
+    names = [stations[i].get('name', '') for i in nearest] if n_st else [''] * len(pts)
+    rivers = [stations[i].get('river', '') for i in nearest] if n_st else [''] * len(pts)
+    results = []
+    for i, pt in enumerate(pts):
+        results.append({'latitude': pt['latitude'], 'longitude': pt['longitude'], 'nearest_location': names[i], 'nearest_river': rivers[i],
+                        'pH': cols.get('pH', none)[i], 'DO (mg/L)': cols.get('DO (mg/L)', none)[i], 'BOD (mg/L)': cols.get('BOD (mg/L)', none)[i],
+                        'FC MPN/100ml': cols.get('FC MPN/100ml', none)[i], 'TC MPN/100ml': cols.get('TC MPN/100ml', none)[i],
+                        'Water Quality': None, 'idw_stations': int(used[i])})
+    rules.classify_rows(results, standards)
+    timer.finish('response_assembly')
+    out = {'month': month, 'year': year, 'points': count, 'predictions': results}
+    if bool(body.get('debug', False)):
+        out['debug'] = [{'point_index': i, 'type': 'idw', 'metric': metric, 'nearest_name': names[i], 'stations_used': int(used[i])}
+                        for i in range(len(pts))]
+    return out
+
+
+@app.on_event('startup')
+def _start_offloader():
+    # fork the pool before request threads exist; workers inherit the loaded state
+    offloader.start()
+
+
+@app.on_event('shutdown')
+def _stop_offloader():
+    offloader.shutdown()
+
+
+@app.get('/stats')
+def stats():
+    """All metrics as JSON."""
+    return metrics.snapshot()
+
+
+@app.get('/metrics')
+def prometheus_metrics():
+    """Metrics in Prometheus text exposition format."""
+    return Response(metrics.render_prometheus(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# tiles are keyed by what predict_all_columns reads (simplified model, ML shards, geodata) and the tile settings
+TILE_VERSION = tiles.version([MODEL_PATH, MODELS_DIR, LOCATIONS_JS] + ([] if BASINS_DIR.is_relative_to(MODELS_DIR) else [BASINS_DIR])
+                             + ([MODEL_BUNDLE] if MODEL_BUNDLE else []),
+                             {'size': tiles.TILE_SIZE, 'corridor_m': tiles.CORRIDOR_M, 'k': tiles.IDW_K, 'path_levels': PATH_TOLERANCES_M})
+tile_cache = tiles.TileCache()
+
+
+def render_tile(param: str, month: int, year: int, z: int, x: int, y: int, fmt: str) -> bytes:
+    """Encoded tile of `param` (a `tiles.PARAMS` key) interpolated from all stations with coordinates,
+    using the same values as `predict_all` (and so the map markers)."""
+    columns = predict_all_columns(month, year, standards=())
+    lat = np.asarray(columns['latitude'], dtype=np.float64)
+    lon = np.asarray(columns['longitude'], dtype=np.float64)
+    has = np.isfinite(lat) & np.isfinite(lon)
+    values = np.asarray(columns[tiles.PARAMS[param]], dtype=np.float64)[has]
+    # the corridor needs no more path detail than half a pixel
+    grid = tiles.surface(_geo.level(tiles.pixel_m(z, y) / 2), lat[has], lon[has], values, z, x, y)
+    return tiles.encode(grid, param, fmt)
+
+
+@app.get('/tiles/{param}/{z}/{x}/{y}')
+async def tile(param: str, z: int, x: int, y: str, month: int, year: int):
+    """Web Mercator tile of the interpolated `param` (ph, do, bod, fc, tc) for a month.
+
+    `y` takes an optional extension: `.png` (default) or `.f32` for the raw float32
+    grid. See `backend/tiles.py`.
+    """
+    y_str, _, fmt = y.partition('.')
+    fmt = fmt or 'png'
+    param = param.lower()
+    if param not in tiles.PARAMS or fmt not in tiles.MEDIA_TYPES:
+        return FastJSONResponse({'error': f'unknown parameter or format; have {", ".join(tiles.PARAMS)} as .png or .f32'}, status_code=404)
+    try:
+        y = int(y_str)
+    except ValueError:
+        return FastJSONResponse({'error': 'y must be an integer'}, status_code=404)
+    if not (0 <= z <= tiles.MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z) or not (1 <= month <= 12 and 1900 <= year <= 2100):
+        return FastJSONResponse({'error': 'tile, month or year out of range'}, status_code=404)
+    key = tiles.cache_key(TILE_VERSION, param, month, year, z, x, y, fmt)
+    data = tile_cache.get(key)
+    if data is None:
+        data = await offloader.run('tile', render_tile, param, month, year, z, x, y, fmt)
+        tile_cache.put(key, data)
+    headers = {'Cache-Control': 'public, max-age=86400', 'X-Model-Version': TILE_VERSION}
+    if fmt == 'f32':
+        headers['X-Tile-Size'] = str(tiles.TILE_SIZE)
+    return Response(data, media_type=tiles.MEDIA_TYPES[fmt], headers=headers)
+
+
+# typed bodies, cost estimates and per-tenant budgets for /interpolate_predict (backend/admission.py)
+admission_control = AdmissionControl()
+
+
 @app.post('/interpolate_predict')
-def interpolate_predict(body: Dict[str, Any]):
+async def interpolate_predict(req: InterpolateRequest, request: Request):
+    """See `run_interpolation` for the body. Large jobs run in the process pool.
+
+    Requests over the tenant's budget are rejected (413/429), downsampled or queued
+    first; see `backend/admission.py`. Like `/predict_all`, answers with Arrow IPC or
+    msgpack columns when the Accept header asks for them.
+    """
+    fmt = negotiate(request.headers.get('accept'))
+    if fmt is None:
+        return not_acceptable()
+    network, _ = _network(req.path_tolerance_m)
+    decision = await admission_control.admit(request.headers.get(TENANT_HEADER), req.body(), len(_js_locations), len(network.seg_a))
+    if decision.error is not None:
+        return FastJSONResponse(decision.error, status_code=decision.status, headers=decision.headers)
+    body = decision.body
+    heavy = offloader.should_offload(interpolation_size(body))
+    result = await offloader.run('interpolate_predict', run_interpolation, body, offload=heavy)
+    if decision.note:
+        result['admission'] = decision.note
+    if fmt != 'json' and 'predictions' in result:
+        meta = {k: v for k, v in result.items() if k != 'predictions'}
+        return columnar_response(columns_from_rows(result['predictions']), meta, fmt)
+    return FastJSONResponse(result)
+
+
+def run_interpolation(body: Dict[str, Any]):
     """Request body expects:
     {
       "start": {"latitude": <num>, "longitude": <num>},
@@ -395,106 +956,71 @@ def interpolate_predict(body: Dict[str, Any]):
     }
     Returns predictions for each interpolated point. Uses nearest known location to infer river/location encoding.
     """
+    timer = metrics.stage_timer('interpolate_predict')
     start = body.get('start')
     end = body.get('end')
     point = body.get('point')
-    locations = body.get('locations')  # optional array of {latitude, longitude} forming a polyline
+    locations = body.get('locations')  # optional polyline: [{latitude, longitude}, ...], encoded string or packed
     count = int(body.get('points', 5))
     month = int(body.get('month', 6))
     year = int(body.get('year', 2023))
 
+    # `locations` as JSON points, an encoded polyline or packed coordinates (backend/polyline.py)
+    poly = None
+    if locations:
+        try:
+            poly = decode_locations(locations, int(body.get('polyline_precision', 5)))
+        except ValueError as e:
+            return {'error': f'invalid locations: {e}'}
+
     # require either start+end OR a provided locations polyline for interpolation
-    if not ((start and end) or (locations and isinstance(locations, list) and len(locations) >= 2)):
+    if not ((start and end) or (poly is not None and len(poly) >= 2)):
         return {'error': 'start and end coordinates OR a locations array required'}
 
+    try:
+        standards = rules.resolve(body.get('standards'))
+    except KeyError as e:
+        return {'error': f'unknown standard {e.args[0]!r}', 'available': list(rules.STANDARDS)}
+
     follow_river = bool(body.get('follow_river', False))
+    # river geometry simplified to within `path_tolerance_m` meters (full resolution without it)
+    try:
+        network, river_paths = _network(body.get('path_tolerance_m'))
+    except (TypeError, ValueError):
+        return {'error': 'path_tolerance_m must be a number'}
     blend = str(body.get('blend', 'auto')).lower()  # 'river', 'idw', or 'auto'
 
     pts = []
     input_poly = None
     # If user provided explicit polyline locations, sample along that polyline directly
-    if locations and isinstance(locations, list) and len(locations) >= 2:
-        # ensure we have dicts with float lat/lon
-        poly = []
-        for q in locations:
-            try:
-                poly.append({'latitude': float(q['latitude']), 'longitude': float(q['longitude'])})
-            except Exception:
-                continue
-        if len(poly) >= 2:
-                input_poly = poly
-                pick_from_input = bool(body.get('pick_from_input', False))
-                # If user wants to pick from the supplied points (e.g. they gave 20 points and want k of them)
-                if pick_from_input and count <= len(poly):
-                    n = len(poly)
-                    ksel = count
-                    if ksel <= 1:
-                        indices = [0]
-                    else:
-                        indices = [int(round(i * (n - 1) / (ksel - 1))) for i in range(ksel)]
-                    for idx in indices:
-                        pnt = {'latitude': poly[idx]['latitude'], 'longitude': poly[idx]['longitude'], 'source_index': idx}
-                        pts.append(pnt)
-                else:
-                    # compute geodesic segment lengths and densify/sample evenly
-                    segs = []
-                    total = 0.0
-                    for a, b in zip(poly[:-1], poly[1:]):
-                        dlen = _haversine_m(a, b)
-                        segs.append((a, b, dlen))
-                        total += dlen
-                    if total == 0:
-                        pts = [ {'latitude': poly[0]['latitude'], 'longitude': poly[0]['longitude']} ] * count
-                    else:
-                        for kidx in range(count):
-                            t = kidx / (count - 1)
-                            target = t * total
-                            acc = 0.0
-                            chosen = poly[-1]
-                            chosen_idx = len(poly) - 1
-                            seg_start_idx = 0
-                            for si, (a, b, dlen) in enumerate(segs):
-                                if acc + dlen >= target:
-                                    seg_t = (target - acc) / dlen if dlen > 0 else 0
-                                    lat = a['latitude'] + (b['latitude'] - a['latitude']) * seg_t
-                                    lon = a['longitude'] + (b['longitude'] - a['longitude']) * seg_t
-                                    chosen = {'latitude': lat, 'longitude': lon}
-                                    chosen_idx = seg_start_idx if seg_t < 0.5 else seg_start_idx + 1
-                                    break
-                                acc += dlen
-                                seg_start_idx += 1
-                            chosen['source_index'] = chosen_idx
-                            pts.append(chosen)
+    if poly is not None and len(poly) >= 2:
+        input_poly = poly
+        pick_from_input = bool(body.get('pick_from_input', False))
+        # If user wants to pick from the supplied points (e.g. they gave 20 points and want k of them)
+        if pick_from_input and count <= len(poly):
+            n = len(poly)
+            ksel = count
+            if ksel <= 1:
+                indices = [0]
+            else:
+                indices = [int(round(i * (n - 1) / (ksel - 1))) for i in range(ksel)]
+            for idx, (lat, lon) in zip(indices, poly[indices].tolist()):
+                pts.append({'latitude': lat, 'longitude': lon, 'source_index': idx})
+        else:
+            pts = _sample_polyline(poly, count)
 
     # otherwise continue with other modes (point or start/end river-follow)
     # if follow_river requested and river paths available try to interpolate along nearest river polyline
-    if follow_river and _river_paths:
+    if follow_river and river_paths and start and end:
         # use start/end to find nearest path and extract the subpath between nearest indices
-        best = None
-        best_name = None
-        best_dist = float('inf')
-        for name, path in _river_paths.items():
-            for p in path:
-                d = _squared_dist(p, start)
-                if d < best_dist:
-                    best_dist = d
-                    best = path
-                    best_name = name
+        best_pi, si = network.nearest_vertex(float(start['latitude']), float(start['longitude']))
+        best_name = network.path_names[best_pi]
+        best = river_paths[best_name]
 
         # if found a path, find nearest indices along the path for start and end, then extract subpath
         if best is not None:
-            def _nearest_index(path, point):
-                best_i = 0
-                best_d = float('inf')
-                for i, q in enumerate(path):
-                    d = _squared_dist(q, point)
-                    if d < best_d:
-                        best_d = d
-                        best_i = i
-                return best_i
-
-            si = _nearest_index(best, start)
-            ei = _nearest_index(best, end)
+            path_arr = network.path(best_pi)
+            ei = int(np.argmin((path_arr[:, 0] - float(end['latitude'])) ** 2 + (path_arr[:, 1] - float(end['longitude'])) ** 2))
             if si <= ei:
                 sub = best[si:ei+1]
             else:
@@ -535,6 +1061,7 @@ def interpolate_predict(body: Dict[str, Any]):
                         pts.append(chosen)
     if not pts:
         pts = _interpolate_points(start, end, count)
+    timer.lap('path_selection')
 
     # accept optional station names explicitly provided by the frontend
     start_station_name = body.get('start_station_name')
@@ -557,128 +1084,12 @@ def interpolate_predict(body: Dict[str, Any]):
         except Exception:
             pass
 
-    # For each point, find the two nearest known locations and compute a distance-weighted
-    # prediction combining both neighbors. This uses ML model outputs when available and
-    # falls back to the simple predictor otherwise.
-    candidates_per_point = []  # list of list of candidate dicts per point
-    proj_cums = []  # per-point projection cumulative meters along chosen path (if available)
-    for pt in pts:
-        cand = []
-        if known:
-            # Try to choose two known locations that straddle the projection of pt onto a river path
-            chosen_pair = None
-            # prefer using the input polyline if provided
-            search_paths = []
-            if input_poly:
-                search_paths = [input_poly]
-            elif _river_paths:
-                search_paths = list(_river_paths.values())
-            best_path = None
-            best_path_name = None
-            best_proj = None
-            best_proj_dist = float('inf')
-
-            # helper: project a point onto a given path (returns dict with cum_m and dist_m)
-            def project_point_on_path(path, point):
-                cum = 0.0
-                best_local = None
-                # precompute segment lengths
-                seg_lens = []
-                for a, b in zip(path[:-1], path[1:]):
-                    try:
-                        sl = _haversine_m(a, b)
-                    except Exception:
-                        sl = (((a['latitude'] - b['latitude'])**2 + (a['longitude'] - b['longitude'])**2) ** 0.5) * 111000.0
-                    seg_lens.append(sl)
-                acc = 0.0
-                for i, (a, b) in enumerate(zip(path[:-1], path[1:])):
-                    seg_len = seg_lens[i]
-                    proj_pt, t, dist2 = _project_point_on_segment(a, b, point)
-                    # compute distance in meters from point to proj_pt
-                    try:
-                        dist_m = _haversine_m(point, proj_pt)
-                    except Exception:
-                        dist_m = (_squared_dist(point, proj_pt) ** 0.5) * 111000.0
-                    # cumulative meters to projection
-                    cum_m = acc + (t * seg_len)
-                    if best_local is None or dist_m < best_local['dist_m']:
-                        best_local = {'proj': proj_pt, 'cum_m': cum_m, 'seg_index': i, 't': t, 'dist_m': dist_m}
-                    acc += seg_len
-                return best_local
-
-            # find best path and projection
-            for path in search_paths:
-                try:
-                    proj = project_point_on_path(path, pt)
-                except Exception:
-                    proj = None
-                if proj and proj['dist_m'] < best_proj_dist:
-                    best_proj_dist = proj['dist_m']
-                    best_proj = proj
-                    best_path = path
-
-                # if we found a nearby path, map known locations onto that path and pick two that straddle
-                if best_path and best_proj is not None:
-                    # project each known location onto best_path to get cum_m
-                    known_on_path = []
-                    for kidx, k in enumerate(known):
-                        try:
-                            kp = project_point_on_path(best_path, {'latitude': k.get('latitude'), 'longitude': k.get('longitude')})
-                        except Exception:
-                            kp = None
-                        if kp is not None:
-                            known_on_path.append({'name': k.get('name', ''), 'river': k.get('river', ''), 'cum_m': kp['cum_m'], 'latitude': k.get('latitude'), 'longitude': k.get('longitude'), 'idx': kidx})
-                    # sort by cum_m
-                    known_on_path.sort(key=lambda x: x['cum_m'])
-                    # find two that straddle best_proj.cum_m
-                    left = None
-                    right = None
-                    for entry in known_on_path:
-                        if entry['cum_m'] <= best_proj['cum_m']:
-                            left = entry
-                        elif entry['cum_m'] > best_proj['cum_m'] and right is None:
-                            right = entry
-                    if left and right:
-                        chosen_pair = (left, right)
-
-            if chosen_pair:
-                left, right = chosen_pair
-                # distances to point
-                try:
-                    d_left = _haversine_m(pt, {'latitude': left['latitude'], 'longitude': left['longitude']})
-                except Exception:
-                    d_left = (_squared_dist(pt, {'latitude': left['latitude'], 'longitude': left['longitude']}) ** 0.5) * 111000.0
-                try:
-                    d_right = _haversine_m(pt, {'latitude': right['latitude'], 'longitude': right['longitude']})
-                except Exception:
-                    d_right = (_squared_dist(pt, {'latitude': right['latitude'], 'longitude': right['longitude']}) ** 0.5) * 111000.0
-                # include cum_m values so we can compute river-linear t later
-                cand.append({'name': left['name'], 'river': left.get('river', ''), 'dist_m': max(1e-6, float(d_left)), 'idx': left['idx'], 'latitude': left.get('latitude'), 'longitude': left.get('longitude'), 'cum_m': left.get('cum_m')})
-                cand.append({'name': right['name'], 'river': right.get('river', ''), 'dist_m': max(1e-6, float(d_right)), 'idx': right['idx'], 'latitude': right.get('latitude'), 'longitude': right.get('longitude'), 'cum_m': right.get('cum_m')})
-                # record projection cumulative meters for this sample point
-                proj_cums.append(best_proj['cum_m'] if best_proj is not None else None)
-            else:
-                # fallback: compute haversine distances to known points and take two nearest
-                dists = []
-                for kidx, k in enumerate(known):
-                    try:
-                        d = _haversine_m(pt, k)
-                    except Exception:
-                        # fallback to squared dist in degrees if haversine fails
-                        d = (_squared_dist(pt, k) ** 0.5) * 111000.0
-                    dists.append((d, kidx, k))
-                dists.sort(key=lambda x: x[0])
-                take = dists[:2]
-                for d, kidx, k in take:
-                    cand.append({'name': k.get('name', ''), 'river': k.get('river', ''), 'dist_m': max(1e-6, float(d)), 'idx': kidx, 'latitude': k.get('latitude'), 'longitude': k.get('longitude')})
-                proj_cums.append(None)
-        # if no known points, leave candidate empty (will be handled later)
-        candidates_per_point.append(cand)
-
-    # ensure proj_cums length matches pts
-    if len(proj_cums) < len(pts):
-        # fill remaining with None
-        proj_cums.extend([None] * (len(pts) - len(proj_cums)))
+    if blend == 'idw':
+        return _idw_interpolation(pts, known, body, month, year, count, timer, standards, network)
+
+    # For each point, pick the two known stations to blend between (indices into `known`)
+    candidates_per_point = _straddle_candidates(pts, known, input_poly, timer, network) if known else [[] for _ in pts]
+    timer.lap('station_straddle')
 
     # Quick two-end linear interpolation fallback:
     # If we have known locations and at least two sample points, find nearest known station
@@ -765,6 +1176,7 @@ def interpolate_predict(body: Dict[str, Any]):
             # fall through to regular logic
             pass
         else:
+            debug_info = []
             # compute cumulative distances along pts
             cum = [0.0]
             for a, b in zip(pts[:-1], pts[1:]):
@@ -795,15 +1207,8 @@ def interpolate_predict(body: Dict[str, Any]):
                 except Exception:
                     bod = (two_left_pred.get('BOD (mg/L)'))
                 nearest_name = two_left_name if t <= 0.5 else two_right_name
-                # compute water quality
-                wq = 'Non Complying'
-                try:
-                    if pH is not None and do is not None and bod is not None:
-                        if 6.5 <= float(pH) <= 8.5 and float(do) >= 5.0 and float(bod) <= 3.0:
-                            wq = 'Complying'
-                except Exception:
-                    pass
-                out_res.append({'latitude': pt['latitude'], 'longitude': pt['longitude'], 'nearest_location': nearest_name, 'nearest_river': '', 'pH': pH, 'DO (mg/L)': do, 'BOD (mg/L)': bod, 'FC MPN/100ml': None, 'TC MPN/100ml': None, 'Water Quality': wq})
+                out_res.append({'latitude': pt['latitude'], 'longitude': pt['longitude'], 'nearest_location': nearest_name, 'nearest_river': '', 'pH': pH, 'DO (mg/L)': do, 'BOD (mg/L)': bod, 'FC MPN/100ml': None, 'TC MPN/100ml': None, 'Water Quality': None})
+            rules.classify_rows(out_res, standards)
 
             # include debug info showing t fractions
             for i, pt in enumerate(pts):
@@ -812,150 +1217,15 @@ def interpolate_predict(body: Dict[str, Any]):
                 except Exception:
                     pass
 
+            timer.finish('two_end_blend')
             return {'month': month, 'year': year, 'points': count, 'predictions': out_res, 'debug': debug_info}
 
-    # precompute cumulative distances along pts for fraction calculation
-    cum_dists = None
-    total_len = None
-    if two_end_linear:
-        cum_dists = [0.0]
-        for a, b in zip(pts[:-1], pts[1:]):
-            try:
-                d = _haversine_m(a, b)
-            except Exception:
-                d = ((_squared_dist(a, b) ** 0.5) * 111000.0)
-            cum_dists.append(cum_dists[-1] + d)
-        total_len = cum_dists[-1] if cum_dists else 0.0
-
-    # Prepare ML prediction rows for every (point, candidate) pair if ML models exist
-    pair_rows = []  # rows for model predict
-    pair_map = []
-    for pi, cand_list in enumerate(candidates_per_point):
-        if not cand_list:
-            # placeholder single row using neutral encoders (will be ignored if no known)
-            pair_rows.append({'river_enc': 0, 'loc_enc': 0, 'month_sin': np.sin(2 * np.pi * month / 12), 'month_cos': np.cos(2 * np.pi * month / 12), 'year_off': year - 2020})
-            pair_map.append((pi, None))
-        else:
-            for c in cand_list:
-                # compute encoder values if available
-                r_enc = 0
-                l_enc = 0
-                try:
-                    if ml_encoders and ml_encoders.get('le_river') and c.get('river'):
-                        r_enc = int(ml_encoders.get('le_river').transform([c.get('river')])[0])
-                except Exception:
-                    r_enc = 0
-                try:
-                    if ml_encoders and ml_encoders.get('le_loc') and c.get('name'):
-                        l_enc = int(ml_encoders.get('le_loc').transform([c.get('name')])[0])
-                except Exception:
-                    l_enc = 0
-                pair_rows.append({'river_enc': r_enc, 'loc_enc': l_enc, 'month_sin': np.sin(2 * np.pi * month / 12), 'month_cos': np.cos(2 * np.pi * month / 12), 'year_off': year - 2020})
-                pair_map.append((pi, c))
-
-    Xdf_pairs = pd.DataFrame(pair_rows)
-
-    # ml_preds_per_pair: list of dicts mapping target->value for each pair row
-    ml_preds_per_pair = [dict() for _ in range(len(pair_rows))]
-    if ml_models and len(pair_rows) > 0:
-        for target, mdl in ml_models.items():
-            try:
-                preds_all = mdl.predict(Xdf_pairs)
-            except Exception:
-                Xdf_named = Xdf_pairs.copy()
-                Xdf_named.columns = ['river_enc', 'loc_enc', 'month_sin', 'month_cos', 'year_off']
-                preds_all = mdl.predict(Xdf_named)
-            transform = transforms.get(target)
-            if transform == 'log1p':
-                inv_all = np.expm1(preds_all)
-                inv_all = np.clip(inv_all, 0, None)
-            else:
-                inv_all = preds_all
-            for ri, val in enumerate(inv_all):
-                ml_preds_per_pair[ri][target] = _round2(val)
-
-    # Now combine per-point predictions by distance-weighted averaging over candidates
-    results = []
-    debug_info = []
-    def _r4(x):
-        try:
-            if x is None:
-                return None
-            return round(float(x), 4)
-        except Exception:
-            return x
-    for pi, pt in enumerate(pts):
-        cand_list = candidates_per_point[pi]
-        # Always interpolate between two closest known points if possible
-        if len(cand_list) >= 2 and cand_list[0].get('latitude') is not None and cand_list[1].get('latitude') is not None:
-            left = cand_list[0]
-            right = cand_list[1]
-            # Compute fraction t along segment between left and right
-            a = {'latitude': left['latitude'], 'longitude': left['longitude']}
-            b = {'latitude': right['latitude'], 'longitude': right['longitude']}
-            try:
-                _, t_frac, _ = _project_point_on_segment(a, b, pt)
-                t_frac = max(0.0, min(1.0, float(t_frac)))
-            except Exception:
-                t_frac = 0.0
-
-            # Get endpoint predictions
-            left_pred = predictor.predict(left.get('river'), left.get('name'), month, year)
-            right_pred = predictor.predict(right.get('river'), right.get('name'), month, year)
-
-            def interp(key):
-                try:
-                    lv = float(left_pred.get(key, 0))
-                    rv = float(right_pred.get(key, 0))
-                    return round((1.0 - t_frac) * lv + t_frac * rv, 4)
-                except Exception:
-                    return left_pred.get(key)
-
-            pH = interp('pH')
-            do = interp('DO (mg/L)')
-            bod = interp('BOD (mg/L)')
-            fc = interp('FC MPN/100ml')
-            tc = interp('TC MPN/100ml')
-
-            nearest_name = left.get('name', '') if t_frac <= 0.5 else right.get('name', '')
-            nearest_river = left.get('river', '') if t_frac <= 0.5 else right.get('river', '')
-
-            water_quality = 'Non Complying'
-            try:
-                if pH is not None and do is not None and bod is not None:
-                    if 6.5 <= float(pH) <= 8.5 and float(do) >= 5.0 and float(bod) <= 3.0:
-                        water_quality = 'Complying'
-            except Exception:
-                pass
-
-            debug_info.append({'point_index': pi, 'point': pt, 't_frac': t_frac, 'left_name': left.get('name'), 'right_name': right.get('name')})
-            results.append({'latitude': pt['latitude'], 'longitude': pt['longitude'], 'nearest_location': nearest_name, 'nearest_river': nearest_river, 'pH': pH, 'DO (mg/L)': do, 'BOD (mg/L)': bod, 'FC MPN/100ml': fc, 'TC MPN/100ml': tc, 'Water Quality': water_quality, 't_frac': t_frac})
-        else:
-            # Fallback: use nearest known location
-            nearest = cand_list[0] if cand_list else None
-            if nearest:
-                pred = predictor.predict(nearest.get('river', ''), nearest.get('name', ''), month, year)
-                pH = pred.get('pH')
-                do = pred.get('DO (mg/L)')
-                bod = pred.get('BOD (mg/L)')
-                fc = pred.get('FC MPN/100ml')
-                tc = pred.get('TC MPN/100ml')
-                nearest_name = nearest.get('name', '')
-                nearest_river = nearest.get('river', '')
-            else:
-                pH = do = bod = fc = tc = None
-                nearest_name = ''
-                nearest_river = ''
-            water_quality = 'Non Complying'
-            try:
-                if pH is not None and do is not None and bod is not None:
-                    if 6.5 <= float(pH) <= 8.5 and float(do) >= 5.0 and float(bod) <= 3.0:
-                        water_quality = 'Complying'
-            except Exception:
-                pass
-            debug_info.append({'point_index': pi, 'point': pt, 'nearest_name': nearest_name})
-            results.append({'latitude': pt['latitude'], 'longitude': pt['longitude'], 'nearest_location': nearest_name, 'nearest_river': nearest_river, 'pH': pH, 'DO (mg/L)': do, 'BOD (mg/L)': bod, 'FC MPN/100ml': fc, 'TC MPN/100ml': tc, 'Water Quality': water_quality})
+    timer.lap('two_end_blend')
 
+    results, debug_info = _blend_candidates(pts, known, candidates_per_point, month, year)
+    timer.lap('station_blend')
+    rules.classify_rows(results, standards)
+    timer.finish('response_assembly')
     # if debug requested, include debug info. Also include debug when explicit station-name override supplied (helpful for testing)
     if bool(body.get('debug', False)) or (start_station_name and end_station_name):
         return {'month': month, 'year': year, 'points': count, 'predictions': results, 'debug': debug_info}
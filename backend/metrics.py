@@ -0,0 +1,333 @@
+"""In-process metrics with Prometheus text exposition.
+
+Counters, gauges and histograms keep plain per-label-set counts guarded by a lock; an
+observation costs a bisect and a few integer adds. `render_prometheus()` produces
+the text format served at `/metrics`, `snapshot()` the JSON served at `/stats`.
+
+Each worker process keeps its own registry, so with several workers a scrape sees
+the worker that answered it. Jobs sent to the process pool (`backend.executor`)
+run under `call`, which returns the counter and histogram increments they
+recorded; the serving process `merge`s them into its own registry, so offloaded
+requests show up like inline ones. Gauges are not carried over: they describe the
+process that sets them (e.g. its resident model bytes), not the job.
+
+Environment:
+  WQ_METRICS  set to 0 to turn every observation into a no-op (default 1)
+"""
+import bisect
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+ENABLED = os.environ.get('WQ_METRICS', '1') not in ('0', 'false', 'False', '')
+
+# seconds; spans a sub-millisecond /predict up to multi-second interpolations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384)
+
+_registry: List['_Metric'] = []
+
+
+def _escape(v: str) -> str:
+    return v.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _fmt_labels(names, key, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, key)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _fmt_value(v) -> str:
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._series.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = list(self._series.items())
+        for key, v in items:
+            lines.append(f'{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(v)}')
+        return lines
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            return [{'labels': dict(zip(self.labelnames, k)), 'value': v} for k, v in self._series.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                # per-bucket counts (last slot is +Inf), count, sum
+                s = self._series[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            s[0][i] += 1
+            s[1] += 1
+            s[2] += value
+
+    def quantile(self, q: float, **labels):
+        """Upper bucket bound containing quantile `q` (None when empty)."""
+        with self._lock:
+            s = self._series.get(self._key(labels))
+            if not s or not s[1]:
+                return None
+            counts, total = list(s[0]), s[1]
+        acc = 0
+        for bound, c in zip(self.buckets + (float('inf'),), counts):
+            acc += c
+            if acc >= q * total:
+                return bound
+        return float('inf')
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        for key, counts, count, total in items:
+            acc = 0
+            for bound, c in zip(self.buckets + (float('inf'),), counts):
+                acc += c
+                le = 'le="' + _fmt_value(float(bound)) + '"'
+                lines.append(f'{self.name}_bucket{_fmt_labels(self.labelnames, key, (le,))} {acc}')
+            lines.append(f'{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(float(total))}')
+            lines.append(f'{self.name}_count{_fmt_labels(self.labelnames, key)} {count}')
+        return lines
+
+    def snapshot(self) -> List[dict]:
+        out = []
+        with self._lock:
+            items = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        for key, counts, count, total in items:
+            labels = dict(zip(self.labelnames, key))
+            out.append({
+                'labels': labels,
+                'count': count,
+                'sum': total,
+                'mean': total / count if count else None,
+                'p50': self.quantile(0.5, **labels),
+                'p99': self.quantile(0.99, **labels),
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], counts)),
+            })
+        return out
+
+
+http_latency = Histogram('wq_http_request_duration_seconds', 'HTTP request latency by route.', labelnames=('method', 'path', 'status'))
+stage_latency = Histogram('wq_stage_duration_seconds', 'Time spent per handler stage.', labelnames=('handler', 'stage'))
+model_inferences = Counter('wq_model_inference_total', 'Model predict calls by target.', labelnames=('target',))
+model_rows = Histogram('wq_model_batch_rows', 'Rows per model predict call.', labelnames=('target',), buckets=ROW_BUCKETS)
+cache_requests = Counter('wq_cache_requests_total', 'Cache lookups by cache and result (hit/miss).', labelnames=('cache', 'result'))
+model_shard_events = Counter('wq_model_shard_events_total', 'Model shard loads, failed loads and evictions by basin.', labelnames=('basin', 'event'))
+model_shard_bytes = Gauge('wq_model_shard_resident_bytes', 'Bytes of model shards held by the registry.')
+
+
+class StageTimer:
+    """Lap timer for the stages of one request.
+
+        timer = stage_timer('interpolate_predict')
+        ...                       # sample points
+        timer.lap('path_selection')
+        ...
+        timer.finish('response_assembly')
+
+    `lap(stage)` charges the time since the previous lap to `stage`; calling it for
+    the same stage inside a loop accumulates, so each stage is observed once per
+    request when `finish()` runs.
+    """
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.totals: Dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self.totals[stage] = self.totals.get(stage, 0.0) + (now - self._last)
+        self._last = now
+
+    def finish(self, stage: str = None):
+        if stage is not None:
+            self.lap(stage)
+        for name, total in self.totals.items():
+            stage_latency.observe(total, handler=self.handler, stage=name)
+
+
+class _NullTimer:
+    def lap(self, stage):
+        pass
+
+    def finish(self, stage=None):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def stage_timer(handler: str):
+    return StageTimer(handler) if ENABLED else _NULL_TIMER
+
+
+def record_inference(target: str, rows: int):
+    model_inferences.inc(target=target)
+    model_rows.observe(rows, target=target)
+
+
+def cache_lookup(cache: str, hit: bool):
+    cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def record_shard(basin: str, event: str, resident_bytes: int):
+    model_shard_events.inc(basin=basin, event=event)
+    model_shard_bytes.set(resident_bytes)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request latency per matched route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get('route')
+            path = getattr(route, 'path', None) or 'unmatched'
+            http_latency.observe(time.perf_counter() - t0, method=scope.get('method', ''), path=path, status=status[0])
+
+
+def render_prometheus() -> str:
+    lines = []
+    for m in _registry:
+        lines.extend(m.render())
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot() -> Dict[str, List[dict]]:
+    return {m.name: m.snapshot() for m in _registry}
+
+
+def _state() -> Dict[str, Dict[Tuple[str, ...], Any]]:
+    out = {}
+    for m in _registry:
+        with m._lock:
+            out[m.name] = {k: [list(v[0]), v[1], v[2]] if isinstance(m, Histogram) else v for k, v in m._series.items()}
+    return out
+
+
+def call(fn: Callable, *args) -> Tuple[Any, Dict[str, list]]:
+    """Run `fn(*args)`; return (result, what it recorded) for `merge` in another process.
+
+    Module-level and picklable, so it can be submitted to a process pool. Pool
+    processes run one job at a time, so the difference of the registry before and
+    after is the job's own.
+    """
+    if not ENABLED:
+        return fn(*args), {}
+    before = _state()
+    result = fn(*args)
+    delta = {}
+    for m in _registry:
+        if isinstance(m, Gauge):
+            continue
+        old, changes = before.get(m.name, {}), []
+        with m._lock:
+            items = list(m._series.items())
+        for key, v in items:
+            prev = old.get(key)
+            if isinstance(m, Histogram):
+                counts = [c - p for c, p in zip(v[0], prev[0])] if prev else list(v[0])
+                if v[1] - (prev[1] if prev else 0):
+                    changes.append((key, [counts, v[1] - (prev[1] if prev else 0), v[2] - (prev[2] if prev else 0.0)]))
+            elif v != (prev or 0):
+                changes.append((key, v - (prev or 0)))
+        if changes:
+            delta[m.name] = changes
+    return result, delta
+
+
+def merge(delta: Dict[str, list]):
+    """Add what `call` recorded in another process to this process' metrics."""
+    if not ENABLED:
+        return
+    by_name = {m.name: m for m in _registry}
+    for name, changes in delta.items():
+        m = by_name.get(name)
+        if m is None or isinstance(m, Gauge):
+            continue
+        with m._lock:
+            for key, v in changes:
+                key = tuple(key)
+                if isinstance(m, Histogram):
+                    s = m._series.get(key)
+                    if s is None:
+                        s = m._series[key] = [[0] * (len(m.buckets) + 1), 0, 0.0]
+                    s[0] = [a + b for a, b in zip(s[0], v[0])]
+                    s[1] += v[1]
+                    s[2] += v[2]
+                else:
+                    m._series[key] = m._series.get(key, 0) + v
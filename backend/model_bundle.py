@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Quantized single-file bundle of the LightGBM boosters for the mobile and web apps.
+
+Usage (from repository root):
+  python -m backend.model_bundle                                  # -> WaterQualityApp/src/data/model_bundle.wqb
+  python -m backend.model_bundle --budget-kb 64 --max-rel-error 0.01
+  python -m backend.model_bundle --check WaterQualityApp/src/data/model_bundle.wqb
+
+The bundle is built from the compact export (`backend/models/compact/`, written by
+`ml/train_lgb.py`) and shrinks it without changing how trees route:
+
+  - thresholds: every distinct threshold of a feature, across all targets, is kept
+    once in a shared float64 table; nodes store the index into their feature's table.
+    Inputs are binned with the same tables, and `x <= table[k]` is exactly
+    `searchsorted(table, x) <= k`, so routing is lossless.
+  - leaves: float16 offsets from a float32 per-tree bias (`--leaf-dtype float32` keeps
+    single precision; a target whose offsets overflow float16 gets float32 leaves).
+  - indices: the smallest integer type that fits.
+  - `--budget-kb`: when the bundle is still too large, every target keeps the same
+    leading fraction of its trees (the last boosting rounds contribute least).
+
+Every build is checked against the float64 compact evaluator on all stations x 12
+months x `GRID_YEARS` and the errors are reported in output units; `--max-error` /
+`--max-rel-error` make the build fail when parity is worse.
+
+File layout (all little-endian):
+
+  bytes 0-3    b'WQB1'
+  bytes 4-7    uint32 header length H
+  bytes 8-8+H  JSON header, space-padded to a multiple of 8: features, encoders,
+               transforms, `tables` and per-target `arrays`, each array given as
+               {offset, dtype, shape} relative to the start of the data section
+  8+H-         data section, every array 8-byte aligned
+
+Per target: split_feature, threshold_bin, flags, children (leaf `i` as ~i), leaf_value,
+leaf_counts and tree_bias (leaf j of tree t is tree_bias[t] + leaf_value[j]) and
+roots. `tables` holds the shared `thresholds` array and `feature_offsets`, where the
+table of feature f is thresholds[feature_offsets[f]:feature_offsets[f + 1]].
+"""
+import argparse
+import json
+import math
+import struct
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend.compact_models import CompactBooster, CompactEncoder, load_compact_models
+
+MAGIC = b'WQB1'
+FORMAT = 'wq-quantized-trees'
+ROOT = Path(__file__).resolve().parents[1]
+COMPACT_DIR = ROOT / 'backend' / 'models' / 'compact'
+DEFAULT_OUT = ROOT / 'WaterQualityApp' / 'src' / 'data' / 'model_bundle.wqb'
+GRID_YEARS = range(2000, 2031)
+
+
+def _smallest_int(lo: int, hi: int):
+    for dt in (np.int8, np.uint8, np.int16, np.uint16, np.int32):
+        info = np.iinfo(dt)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(dt).newbyteorder('<')
+    return np.dtype('<i8')
+
+
+def tree_spans(booster: CompactBooster) -> Tuple[np.ndarray, np.ndarray]:
+    """Nodes and leaves per tree; the exporter writes both tree after tree."""
+    nodes = np.zeros(len(booster.roots), dtype=np.int64)
+    leaves = np.zeros(len(booster.roots), dtype=np.int64)
+    for t, root in enumerate(booster.roots.tolist()):
+        stack = [root]
+        while stack:
+            n = stack.pop()
+            if n < 0:
+                leaves[t] += 1
+            else:
+                nodes[t] += 1
+                stack.extend((int(booster.left[n]), int(booster.right[n])))
+    return nodes, leaves
+
+
+def quantize(compact: Dict[str, Any], leaf_dtype: str = 'float16', keep: float = 1.0) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """(header, arrays) for the boosters of a `load_compact_models` result.
+
+    `keep` is the fraction of each target's trees to retain (at least one).
+    """
+    features = compact['manifest']['features']
+    models = compact['models']
+    spans = {t: tree_spans(b) for t, b in models.items()}
+    kept = {t: max(1, math.ceil(len(b.roots) * keep)) for t, b in models.items()}
+
+    # shared per-feature threshold tables over the kept nodes of all targets
+    used = [set() for _ in features]
+    for t, b in models.items():
+        n_nodes = int(spans[t][0][:kept[t]].sum())
+        for f, thr in zip(b.split_feature[:n_nodes].tolist(), b.threshold[:n_nodes].tolist()):
+            used[f].add(thr)
+    tables = [np.array(sorted(u), dtype=np.float64) for u in used]
+    offsets = np.cumsum([0] + [len(tb) for tb in tables])
+    arrays = {'thresholds': np.concatenate(tables).astype('<f8'), 'feature_offsets': offsets.astype('<i4')}
+    header = {'format': FORMAT, 'version': 1, 'features': features, 'encoders': {k: e.classes_.tolist() for k, e in compact['encoders'].items()},
+              'transforms': compact['transforms'], 'leaf_dtype': leaf_dtype,
+              'tables': {'thresholds': 'thresholds', 'feature_offsets': 'feature_offsets'}, 'targets': {}}
+    max_bin = max([len(tb) for tb in tables] + [1])
+    for t, b in models.items():
+        n_trees = kept[t]
+        n_nodes, n_leaves = int(spans[t][0][:n_trees].sum()), int(spans[t][1][:n_trees].sum())
+        feat = b.split_feature[:n_nodes]
+        thr = b.threshold[:n_nodes]
+        bins = np.array([np.searchsorted(tables[f], x) for f, x in zip(feat.tolist(), thr.tolist())], dtype=np.int64)
+        leaf_counts = spans[t][1][:n_trees]
+        leaf = np.asarray(b.leaf_value[:n_leaves], dtype=np.float64)
+        tree_of_leaf = np.repeat(np.arange(n_trees), leaf_counts)
+        bias = (np.add.reduceat(leaf, np.cumsum(leaf_counts) - leaf_counts) / leaf_counts).astype(np.float32)
+        children = np.asarray(b.children[:n_nodes], dtype=np.int64)
+        leaf_offsets = leaf - bias[tree_of_leaf].astype(np.float64)
+        target_leaf_dtype = leaf_dtype
+        if np.abs(leaf_offsets).max(initial=0.0) > np.finfo(np.dtype(leaf_dtype)).max:
+            target_leaf_dtype = 'float32'
+        prefix = f'{t}/'
+        arrays.update({
+            prefix + 'split_feature': feat.astype(_smallest_int(0, len(features) - 1)),
+            prefix + 'threshold_bin': bins.astype(_smallest_int(0, max_bin)),
+            prefix + 'flags': np.asarray(b.flags[:n_nodes], dtype=np.uint8),
+            prefix + 'children': children.astype(_smallest_int(int(children.min(initial=0)), int(children.max(initial=0)))),
+            prefix + 'leaf_value': leaf_offsets.astype('<' + np.dtype(target_leaf_dtype).str[1:]),
+            prefix + 'leaf_counts': leaf_counts.astype(_smallest_int(0, int(leaf_counts.max(initial=0)))),
+            prefix + 'tree_bias': bias.astype('<f4'),
+            prefix + 'roots': np.asarray(b.roots[:n_trees], dtype=np.int64).astype(_smallest_int(-n_leaves, max(n_nodes, 1))),
+        })
+        header['targets'][t] = {'prefix': prefix, 'n_trees': n_trees, 'n_trees_trained': len(b.roots), 'n_nodes': n_nodes, 'n_leaves': n_leaves,
+                                'leaf_dtype': target_leaf_dtype}
+    return header, arrays
+
+
+def encode(header: Dict, arrays: Dict[str, np.ndarray]) -> bytes:
+    layout = {}
+    blobs = []
+    offset = 0
+    for name, arr in arrays.items():
+        data = np.ascontiguousarray(arr).tobytes()
+        layout[name] = {'offset': offset, 'dtype': arr.dtype.str, 'shape': list(arr.shape)}
+        pad = -len(data) % 8
+        blobs.append(data + b'\0' * pad)
+        offset += len(data) + pad
+    head = json.dumps(dict(header, arrays=layout), separators=(',', ':')).encode('utf-8')
+    head += b' ' * (-len(head) % 8)
+    return MAGIC + struct.pack('<I', len(head)) + head + b''.join(blobs)
+
+
+def decode(data: bytes) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """(header, arrays); arrays are read-only views into `data`."""
+    if data[:4] != MAGIC:
+        raise ValueError('not a model bundle')
+    (n,) = struct.unpack('<I', data[4:8])
+    header = json.loads(data[8:8 + n])
+    if header.get('format') != FORMAT:
+        raise ValueError(f'unexpected bundle format {header.get("format")!r}')
+    base = 8 + n
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dt = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'])) if spec['shape'] else 1
+        arrays[name] = np.frombuffer(data, dtype=dt, count=count, offset=base + spec['offset']).reshape(spec['shape'])
+    return header, arrays
+
+
+def read_header(path) -> Dict:
+    """Header of a bundle file without reading the arrays."""
+    with open(path, 'rb') as f:
+        head = f.read(8)
+        if head[:4] != MAGIC:
+            raise ValueError('not a model bundle')
+        (n,) = struct.unpack('<I', head[4:8])
+        return json.loads(f.read(n))
+
+
+def boosters(header: Dict, arrays: Dict[str, np.ndarray]) -> Dict[str, CompactBooster]:
+    """Expand a decoded bundle into NumPy evaluators (the reference evaluator for the apps)."""
+    thresholds = arrays['thresholds']
+    feature_offsets = arrays['feature_offsets'].astype(np.int64)
+    out = {}
+    for t, spec in header['targets'].items():
+        a = {k[len(spec['prefix']):]: v for k, v in arrays.items() if k.startswith(spec['prefix'])}
+        feat = a['split_feature'].astype(np.int64)
+        counts = a['leaf_counts'].astype(np.int64)
+        leaf = a['leaf_value'].astype(np.float64) + np.repeat(a['tree_bias'].astype(np.float64), counts)
+        out[t] = CompactBooster.from_arrays({
+            'split_feature': feat,
+            'threshold': thresholds[feature_offsets[feat] + a['threshold_bin'].astype(np.int64)],
+            'children': a['children'].astype(np.int32),
+            'flags': a['flags'],
+            'leaf_value': leaf,
+            'roots': a['roots'].astype(np.int32),
+        }, header['features'])
+    return out
+
+
+def load_bundle(path) -> Dict[str, Any]:
+    """Same shape as `load_compact_models`: {'models', 'encoders', 'transforms', 'manifest'}."""
+    header, arrays = decode(Path(path).read_bytes())
+    encoders = {name: CompactEncoder(classes) for name, classes in header.get('encoders', {}).items()}
+    return {'models': boosters(header, arrays), 'encoders': encoders, 'transforms': header.get('transforms', {}), 'manifest': header}
+
+
+def evaluation_grid(manifest: Dict) -> np.ndarray:
+    """Feature rows for every encoded (river, location) pair x 12 months x GRID_YEARS."""
+    enc = manifest.get('encoders', {})
+    rivers = range(max(1, len(enc.get('le_river', []))))
+    locs = range(max(1, len(enc.get('le_loc', []))))
+    r, l, m, y = (a.ravel() for a in np.meshgrid(list(rivers), list(locs), np.arange(1, 13), list(GRID_YEARS), indexing='ij'))
+    cols = {'river_enc': r, 'loc_enc': l, 'month_sin': np.sin(2 * np.pi * m / 12), 'month_cos': np.cos(2 * np.pi * m / 12), 'year_off': y - 2020}
+    return np.column_stack([np.asarray(cols[f], dtype=np.float64) for f in manifest['features']])
+
+
+def _output(values: np.ndarray, transform: Optional[str]) -> np.ndarray:
+    # same inverse transform as the backend applies to model outputs
+    return np.clip(np.expm1(values), 0, None) if transform == 'log1p' else values
+
+
+def parity(reference: Dict[str, Any], candidate: Dict[str, CompactBooster], X: np.ndarray) -> Dict[str, Dict[str, float]]:
+    """Max/mean absolute and max relative error of `candidate` against `reference` models, in output units."""
+    out = {}
+    for t, model in candidate.items():
+        transform = reference['transforms'].get(t)
+        ref = _output(reference['models'][t].predict(X), transform)
+        got = _output(model.predict(X), transform)
+        err = np.abs(got - ref)
+        out[t] = {'max_abs': float(err.max()), 'mean_abs': float(err.mean()), 'max_rel': float((err / np.maximum(np.abs(ref), 1e-9)).max())}
+    return out
+
+
+def build(compact: Dict[str, Any], budget_bytes: Optional[int] = None, leaf_dtype: str = 'float16') -> Tuple[bytes, Dict]:
+    """Bundle bytes within `budget_bytes` (largest kept-tree fraction that fits) and its header."""
+    header, arrays = quantize(compact, leaf_dtype)
+    data = encode(header, arrays)
+    if budget_bytes is None or len(data) <= budget_bytes:
+        return data, header
+    lo, hi = 0.0, 1.0
+    best = None
+    for _ in range(20):
+        mid = (lo + hi) / 2
+        h, a = quantize(compact, leaf_dtype, keep=mid)
+        d = encode(h, a)
+        if len(d) <= budget_bytes:
+            best, lo = (d, h), mid
+        else:
+            hi = mid
+    if best is None:
+        raise ValueError(f'no bundle fits in {budget_bytes} bytes')
+    return best
+
+
+def report(data: bytes, header: Dict, errors: Dict[str, Dict[str, float]], reference_bytes: int) -> List[str]:
+    wider = [t for t, spec in header['targets'].items() if spec.get('leaf_dtype', header['leaf_dtype']) != header['leaf_dtype']]
+    lines = [f'{len(data)} bytes ({len(data) / reference_bytes:.1%} of the {reference_bytes}-byte compact export), leaves {header["leaf_dtype"]}'
+             + (f' (float32 for {", ".join(wider)}: offsets out of range)' if wider else '')]
+    lines.append(f'{"target":<16} {"trees":>9} {"max abs err":>12} {"mean abs err":>13} {"max rel err":>12}')
+    for t, spec in header['targets'].items():
+        e = errors[t]
+        lines.append(f'{t:<16} {spec["n_trees"]:>4}/{spec["n_trees_trained"]:<4} {e["max_abs"]:>12.5f} {e["mean_abs"]:>13.6f} {e["max_rel"]:>12.5f}')
+    return lines
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--compact', default=str(COMPACT_DIR), help='compact export directory (reference models)')
+    p.add_argument('--out', default=str(DEFAULT_OUT))
+    p.add_argument('--budget-kb', type=float, help='maximum bundle size; trailing trees are dropped to fit')
+    p.add_argument('--leaf-dtype', choices=('float16', 'float32'), default='float16')
+    p.add_argument('--max-error', type=float, help='fail when any target is off by more than this (output units)')
+    p.add_argument('--max-rel-error', type=float, help='fail when any target is off by more than this fraction')
+    p.add_argument('--check', metavar='BUNDLE', help='only report parity of an existing bundle against --compact')
+    args = p.parse_args(argv)
+
+    reference = load_compact_models(Path(args.compact))
+    reference_bytes = sum(b.nbytes() for b in reference['models'].values())
+    if args.check:
+        data = Path(args.check).read_bytes()
+        header, arrays = decode(data)
+        candidate = boosters(header, arrays)
+    else:
+        budget = int(args.budget_kb * 1024) if args.budget_kb else None
+        data, header = build(reference, budget, args.leaf_dtype)
+        candidate = boosters(*decode(data))
+    errors = parity(reference, candidate, evaluation_grid(reference['manifest']))
+    print('\n'.join(report(data, header, errors, reference_bytes)))
+    bad = [t for t, e in errors.items() if (args.max_error is not None and e['max_abs'] > args.max_error)
+           or (args.max_rel_error is not None and e['max_rel'] > args.max_rel_error)]
+    if bad:
+        print(f'parity check failed for {", ".join(bad)}')
+        return 1
+    if not args.check:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_bytes(data)
+        print(f'wrote {args.out}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
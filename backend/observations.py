@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Append-only columnar store of observed water quality, read through memory maps.
+
+Usage (from repository root):
+  python -m backend.observations build                     # backend/river.csv -> backend/observations/
+  python -m backend.observations append new_samples.csv    # adds a segment
+  python -m backend.observations compact                   # merges segments, later rows win
+  python -m backend.observations show "Aundh Bridge" --start 2019-01 --end 2019-12
+
+Layout of the store directory:
+
+  manifest.json    params, stations [[river, location], ...], quality labels and
+                   the segment directories in append order
+  seg-NNNNN/       one batch of rows sorted by (station, month):
+    station.npy    int32 index into the manifest stations
+    month.npy      int32 months since year 0 (year * 12 + month - 1)
+    <param>.npy    float64 per parameter, NaN when not reported
+    censored.npy   uint8 bit j set when param j was reported as a bound
+                   ('1800+', '<1.8', 'BDL'); the value is the bound, NaN for BDL
+    quality.npy    int16 index into the manifest labels, -1 when blank
+    offsets.npy    int64 rows of station s are offsets[s]:offsets[s + 1]
+
+Segments are written under a temporary name and renamed into place before the
+manifest is replaced, so a reader sees either the old or the new set. There is a
+single writer; readers pick up appends with `refresh()`.
+
+A station range of one segment is located with the offsets and a binary search on
+`month` and returned as views into the memory maps, so reading a station history
+copies nothing. With several segments the pieces are concatenated and ordered by
+month; `compact()` folds them back into one.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+FORMAT = 'wq-observations'
+ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_DIR = Path(os.environ.get('WQ_OBSERVATIONS_DIR') or ROOT / 'backend' / 'observations')
+DEFAULT_CSV = ROOT / 'backend' / 'river.csv'
+PARAMS = ['pH', 'DO (mg/L)', 'BOD (mg/L)', 'FC MPN/100ml', 'TC MPN/100ml']
+QUALITY = 'Water Quality'
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+          'September', 'October', 'November', 'December']
+_MONTH_NUM = {m.lower(): i for i, m in enumerate(MONTHS, start=1)}
+_MONTH_NUM.update({m[:3].lower(): i for m, i in list(_MONTH_NUM.items())})
+_BLANK = ('', 'nil', 'na', 'n/a', '-', 'nan')
+
+
+def param_stem(param: str) -> str:
+    return re.sub(r'[^0-9A-Za-z]+', '_', param).strip('_')
+
+
+def month_index(year: int, month: int) -> int:
+    return int(year) * 12 + int(month) - 1
+
+
+def parse_month(text: str) -> int:
+    """'2019-06' -> month index."""
+    year, _, month = str(text).partition('-')
+    if not month or not 1 <= int(month) <= 12:
+        raise ValueError(f'expected YYYY-MM, got {text!r}')
+    return month_index(int(year), int(month))
+
+
+def parse_value(raw) -> Tuple[float, bool]:
+    """(value, censored) for a river.csv cell; '1800+' and '<1.8' are bounds, 'BDL' is NaN."""
+    if raw is None or (isinstance(raw, float) and np.isnan(raw)):
+        return np.nan, False
+    s = str(raw).strip()
+    if s.lower() in _BLANK:
+        return np.nan, False
+    if s.lower() == 'bdl':
+        return np.nan, True
+    censored = s.endswith('+') or s.startswith(('<', '>'))
+    try:
+        return float(re.sub(r'[^0-9.\-]', '', s)), censored
+    except ValueError:
+        return np.nan, False
+
+
+class Segment:
+    """Memory-mapped columns of one segment directory."""
+
+    def __init__(self, path: Path, params: Sequence[str]):
+        self.path = path
+        load = lambda name: np.load(path / f'{name}.npy', mmap_mode='r').view(np.ndarray)
+        self.station = load('station')
+        self.month = load('month')
+        self.values = {p: load(param_stem(p)) for p in params}
+        self.censored = load('censored')
+        self.quality = load('quality')
+        self.offsets = load('offsets')
+
+    def __len__(self):
+        return len(self.station)
+
+    def station_range(self, station: int, start: int, end: int) -> slice:
+        """Rows of `station` with start <= month <= end."""
+        if station + 1 >= len(self.offsets):
+            return slice(0, 0)
+        lo, hi = int(self.offsets[station]), int(self.offsets[station + 1])
+        months = self.month[lo:hi]
+        return slice(lo + int(np.searchsorted(months, start, 'left')), lo + int(np.searchsorted(months, end, 'right')))
+
+
+class ObservationStore:
+    """Reader and single appender of a store directory (see the module docstring)."""
+
+    def __init__(self, path=DEFAULT_DIR):
+        self.path = Path(path)
+        self._mtime = None
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Re-read the manifest when it changed on disk; True when it did."""
+        try:
+            mtime = (self.path / 'manifest.json').stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime and self._mtime is not None:
+            return False
+        self._mtime = mtime
+        if mtime is None:
+            self.manifest = {'format': FORMAT, 'version': 1, 'params': list(PARAMS), 'stations': [], 'labels': [], 'segments': []}
+        else:
+            with open(self.path / 'manifest.json', 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+            if self.manifest.get('format') != FORMAT:
+                raise ValueError(f'unexpected observation store format in {self.path}')
+        self.params = list(self.manifest['params'])
+        self.stations = [tuple(s) for s in self.manifest['stations']]
+        self.labels = list(self.manifest['labels'])
+        self._station_ids = {key: i for i, key in enumerate(self.stations)}
+        self._by_location = {}
+        for i, (_, location) in enumerate(self.stations):
+            self._by_location.setdefault(location.lower(), []).append(i)
+        self.segments = [Segment(self.path / name, self.params) for name in self.manifest['segments']]
+        return True
+
+    def __len__(self):
+        return sum(len(s) for s in self.segments)
+
+    def find_station(self, location: str, river: Optional[str] = None) -> Optional[int]:
+        """Station index by location name (case-insensitive), narrowed by river when ambiguous."""
+        ids = self._by_location.get(location.strip().lower(), [])
+        if river:
+            ids = [i for i in ids if self.stations[i][0].lower() == river.strip().lower()]
+        return ids[0] if len(ids) == 1 or (ids and river) else None
+
+    def history(self, station: int, start: int = 0, end: int = 2 ** 31 - 1, params: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+        """Columns `month`, each param, `censored` and `quality` for one station, ordered by month.
+
+        With a single segment the arrays are read-only views into the memory maps.
+        """
+        params = self.params if params is None else list(params)
+        names = ['month'] + params + ['censored', 'quality']
+        pieces = []
+        for seg in self.segments:
+            rows = seg.station_range(station, start, end)
+            if rows.stop > rows.start:
+                cols = {'month': seg.month, 'censored': seg.censored, 'quality': seg.quality, **seg.values}
+                pieces.append({n: cols[n][rows] for n in names})
+        if len(pieces) == 1:
+            return pieces[0]
+        if not pieces:
+            empty = {'month': np.int32, 'censored': np.uint8, 'quality': np.int16}
+            return {n: np.zeros(0, dtype=empty.get(n, np.float64)) for n in names}
+        out = {n: np.concatenate([p[n] for p in pieces]) for n in names}
+        order = np.argsort(out['month'], kind='stable')
+        return {n: col[order] for n, col in out.items()}
+
+    # writing
+
+    def append(self, df: pd.DataFrame) -> int:
+        """Add the rows of a river.csv-shaped frame as a new segment; returns the row count."""
+        df = df.dropna(how='all')
+        month = df['Month'].map(lambda m: _MONTH_NUM.get(str(m).strip().lower()))
+        year = pd.to_numeric(df['Year'], errors='coerce')
+        df = df[month.notna() & year.notna()]
+        if df.empty:
+            return 0
+        stations = list(self.stations)
+        station_ids = dict(self._station_ids)
+        labels = list(self.labels)
+        station = np.empty(len(df), dtype=np.int32)
+        for i, key in enumerate(zip(df['River'].astype(str).str.strip(), df['Location'].astype(str).str.strip())):
+            if key not in station_ids:
+                station_ids[key] = len(stations)
+                stations.append(key)
+            station[i] = station_ids[key]
+        months = np.array([month_index(y, m) for y, m in zip(year[df.index], month[df.index])], dtype=np.int32)
+        values = {}
+        censored = np.zeros(len(df), dtype=np.uint8)
+        for j, p in enumerate(self.params):
+            parsed = [parse_value(v) for v in df[p]] if p in df.columns else [(np.nan, False)] * len(df)
+            values[p] = np.array([v for v, _ in parsed], dtype=np.float64)
+            censored |= np.array([c for _, c in parsed], dtype=np.uint8) << j
+        quality = np.full(len(df), -1, dtype=np.int16)
+        if QUALITY in df.columns:
+            for i, lab in enumerate(df[QUALITY].tolist()):
+                if isinstance(lab, str) and lab.strip():
+                    if lab.strip() not in labels:
+                        labels.append(lab.strip())
+                    quality[i] = labels.index(lab.strip())
+        order = np.lexsort((months, station))
+        columns = {'station': station, 'month': months, 'censored': censored, 'quality': quality, **values}
+        name = f'seg-{len(self.manifest["segments"]):05d}'
+        while (self.path / name).exists():
+            name += '_'
+        self._write_segment(name, {n: c[order] for n, c in columns.items()}, len(stations))
+        self._write_manifest(stations, labels, self.manifest['segments'] + [name])
+        return len(df)
+
+    def compact(self) -> int:
+        """Merge all segments into one; for repeated (station, month) rows the last appended wins."""
+        if len(self.segments) < 2:
+            return len(self)
+        names = ['station', 'month', 'censored', 'quality'] + self.params
+        cols = {n: np.concatenate([seg.values[n] if n in seg.values else getattr(seg, n) for seg in self.segments]) for n in names}
+        # stable sort keeps append order within a key; take the last row of each key
+        order = np.lexsort((cols['month'], cols['station']))
+        key = cols['station'][order].astype(np.int64) * 2 ** 32 + cols['month'][order]
+        last = np.r_[key[1:] != key[:-1], True]
+        rows = order[last]
+        old = list(self.manifest['segments'])
+        name = f'seg-{len(old):05d}'
+        while (self.path / name).exists():
+            name += '_'
+        self._write_segment(name, {n: c[rows] for n, c in cols.items()}, len(self.stations))
+        self._write_manifest(self.stations, self.labels, [name])
+        for seg in old:
+            shutil.rmtree(self.path / seg, ignore_errors=True)
+        return len(rows)
+
+    def _write_segment(self, name: str, columns: Dict[str, np.ndarray], n_stations: int):
+        tmp = self.path / f'.{name}.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for n, col in columns.items():
+            np.save(tmp / f'{n if n not in self.params else param_stem(n)}.npy', np.ascontiguousarray(col))
+        offsets = np.searchsorted(columns['station'], np.arange(n_stations + 1)).astype(np.int64)
+        np.save(tmp / 'offsets.npy', offsets)
+        os.replace(tmp, self.path / name)
+
+    def _write_manifest(self, stations, labels, segments: List[str]):
+        manifest = {'format': FORMAT, 'version': 1, 'params': self.params,
+                    'stations': [list(s) for s in stations], 'labels': labels, 'segments': segments}
+        tmp = self.path / 'manifest.json.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, self.path / 'manifest.json')
+        self.refresh()
+
+
+def build(csv_path=DEFAULT_CSV, out_dir=DEFAULT_DIR) -> ObservationStore:
+    """A fresh store at `out_dir` holding `csv_path` as its first segment."""
+    out_dir = Path(out_dir)
+    if (out_dir / 'manifest.json').exists():
+        shutil.rmtree(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    store = ObservationStore(out_dir)
+    store.append(pd.read_csv(csv_path))
+    return store
+
+
+def history_columns(store: ObservationStore, cols: Dict[str, np.ndarray], params: Sequence[str]) -> Dict[str, Any]:
+    """Columns for clients: year, month, params, their censored flags (0/1) and the quality label."""
+    out = {'year': cols['month'] // 12, 'month': cols['month'] % 12 + 1}
+    for p in params:
+        out[p] = cols[p]
+    for p in params:
+        bit = store.params.index(p)
+        out[f'{p} censored'] = (cols['censored'] >> bit) & 1
+    labels = np.array(store.labels + [None], dtype=object)
+    out[QUALITY] = labels[cols['quality']].tolist()
+    return out
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--dir', default=str(DEFAULT_DIR), help='store directory')
+    sub = p.add_subparsers(dest='cmd', required=True)
+    b = sub.add_parser('build', help='(re)create the store from a river.csv file')
+    b.add_argument('csv', nargs='?', default=str(DEFAULT_CSV))
+    a = sub.add_parser('append', help='add the rows of river.csv-shaped files as new segments')
+    a.add_argument('csv', nargs='+')
+    sub.add_parser('compact', help='merge all segments into one')
+    s = sub.add_parser('show', help='print the history of a station')
+    s.add_argument('location')
+    s.add_argument('--river')
+    s.add_argument('--start', default='0-01')
+    s.add_argument('--end', default='9999-12')
+    args = p.parse_args(argv)
+
+    if args.cmd == 'build':
+        store = build(args.csv, args.dir)
+    else:
+        store = ObservationStore(args.dir)
+    if args.cmd == 'append':
+        for path in args.csv:
+            print(f'{path}: {store.append(pd.read_csv(path))} rows')
+    elif args.cmd == 'compact':
+        print(f'{store.compact()} rows in one segment')
+    elif args.cmd == 'show':
+        station = store.find_station(args.location, args.river)
+        if station is None:
+            print(f'unknown or ambiguous station {args.location!r}')
+            return 1
+        cols = history_columns(store, store.history(station, parse_month(args.start), parse_month(args.end)), store.params)
+        print(pd.DataFrame(cols).to_string(index=False))
+        return 0
+    print(f'{len(store)} rows, {len(store.stations)} stations, {len(store.segments)} segments in {store.path}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Compact polyline inputs decoded straight into (n, 2) [lat, lon] float64 arrays.
+
+`/interpolate_predict` takes its `locations` route in any of these forms:
+
+  [{"latitude": .., "longitude": ..}, ...]    JSON objects, as before
+  "_p~iF~ps|U_ulLnnqC_mqNvxq`@"               Google encoded polyline (precision 5,
+                                              `polyline_precision: 6` for polyline6)
+  {"data": "<base64>", "dtype": "f8"}         packed little-endian lat, lon, lat, lon, ...
+                                              dtype f8, f4 or i4 (i4 values are multiples
+                                              of `scale` degrees, default 1e-7); with
+                                              "delta": true every pair after the first is
+                                              the difference to the previous one
+
+The encoded forms are decoded with array operations only, so a long route costs a
+few array passes instead of one dict per vertex.
+"""
+import base64
+import binascii
+from typing import Any
+
+import numpy as np
+
+PACKED_DTYPES = {'f8': '<f8', 'f4': '<f4', 'i4': '<i4'}
+DEFAULT_SCALE = 1e-7
+
+
+def decode_polyline(text: str, precision: int = 5) -> np.ndarray:
+    """Decode a Google encoded polyline into an (n, 2) array."""
+    try:
+        raw = np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+    except UnicodeEncodeError:
+        raise ValueError('encoded polyline must be ASCII')
+    if raw.size == 0:
+        return np.empty((0, 2))
+    b = raw.astype(np.int64) - 63
+    if b.min() < 0 or b.max() > 63:
+        raise ValueError('invalid character in encoded polyline')
+    # each value is a run of 5-bit chunks, least significant first; bit 0x20 marks a continuation
+    end = (b & 0x20) == 0
+    if not end[-1]:
+        raise ValueError('truncated encoded polyline')
+    starts = np.flatnonzero(np.r_[True, end[:-1]])
+    pos = np.arange(len(b)) - np.repeat(starts, np.diff(np.r_[starts, len(b)]))
+    if pos.max() > 11:
+        raise ValueError('value too long in encoded polyline')
+    v = np.add.reduceat((b & 0x1f) << (5 * pos), starts)
+    v = np.where(v & 1, ~(v >> 1), v >> 1)
+    if len(v) % 2:
+        raise ValueError('encoded polyline has an odd number of values')
+    return np.cumsum(v.reshape(-1, 2), axis=0) / 10.0 ** precision
+
+
+def encode_polyline(coords, precision: int = 5) -> str:
+    """Inverse of `decode_polyline` (for clients and tests)."""
+    q = np.round(np.asarray(coords, dtype=np.float64).reshape(-1, 2) * 10.0 ** precision).astype(np.int64)
+    deltas = np.diff(np.vstack([np.zeros((1, 2), dtype=np.int64), q]), axis=0).ravel()
+    out = []
+    for v in (deltas << 1 ^ (deltas >> 63)).tolist():
+        while v >= 0x20:
+            out.append(chr((0x20 | (v & 0x1f)) + 63))
+            v >>= 5
+        out.append(chr(v + 63))
+    return ''.join(out)
+
+
+def decode_packed(data: str, dtype: str = 'f8', scale: float = None, delta: bool = False) -> np.ndarray:
+    """Decode base64 packed coordinates into an (n, 2) array."""
+    if dtype not in PACKED_DTYPES:
+        raise ValueError(f'packed dtype must be one of {", ".join(PACKED_DTYPES)}')
+    try:
+        buf = base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError('packed coordinates are not valid base64')
+    dt = np.dtype(PACKED_DTYPES[dtype])
+    if len(buf) % (2 * dt.itemsize):
+        raise ValueError(f'packed coordinates must hold whole {dtype} lat/lon pairs')
+    values = np.frombuffer(buf, dtype=dt).reshape(-1, 2)
+    if delta:
+        # integer deltas accumulate exactly; float ones in float64
+        values = np.cumsum(values, axis=0, dtype=np.int64 if dt.kind == 'i' else np.float64)
+    coords = values.astype(np.float64)
+    if dt.kind == 'i':
+        coords *= DEFAULT_SCALE if scale is None else scale
+    return coords
+
+
+def decode_locations(locations: Any, precision: int = 5) -> np.ndarray:
+    """(n, 2) array for any supported `locations` form; entries of a JSON list that are not
+    coordinates are skipped, malformed encodings raise ValueError."""
+    if isinstance(locations, str):
+        return decode_polyline(locations, precision)
+    if isinstance(locations, dict):
+        return decode_packed(locations.get('data', ''), locations.get('dtype', 'f8'), locations.get('scale'), bool(locations.get('delta', False)))
+    rows = []
+    for q in locations or ():
+        try:
+            rows.append((float(q['latitude']), float(q['longitude'])))
+        except Exception:
+            continue
+    return np.array(rows, dtype=np.float64).reshape(-1, 2)
+
+
+def vertex_count(locations: Any) -> int:
+    """Number of vertices in `locations` without decoding it (upper bound for broken input)."""
+    if isinstance(locations, str):
+        # one terminating character per value, two values per vertex
+        raw = np.frombuffer(locations.encode('ascii', 'replace'), dtype=np.uint8)
+        return int(((raw.astype(np.int64) - 63) & 0x20 == 0).sum()) // 2
+    if isinstance(locations, dict):
+        itemsize = np.dtype(PACKED_DTYPES.get(locations.get('dtype', 'f8'), '<f8')).itemsize
+        return len(locations.get('data', '')) * 3 // 4 // (2 * itemsize)
+    return len(locations) if isinstance(locations, (list, tuple)) else 0
@@ -0,0 +1,141 @@
+"""Opt-in per-request profiling.
+
+With `WQ_PROFILE` set, a request carrying an `X-Profile` header runs its handler
+under cProfile with tracemalloc tracing. The response gets
+
+  X-Profile-Summary  wall time, peak traced memory and the top functions by cumulative time
+  X-Profile-File     JSON report (top-N functions, top allocation sites) in WQ_PROFILE_DIR
+
+and a `.prof` file next to the report that `python -m pstats` or snakeviz can open.
+Handlers opt in by running their work through `call()`; `Offloader.run` does so,
+which covers `/interpolate_predict` whether it runs inline or in the process pool.
+
+When `WQ_PROFILE` is unset the middleware is not installed and `requested()` is a
+constant `None`, so normal requests pay nothing.
+
+Environment:
+  WQ_PROFILE      1 to enable; any other non-empty value is the token the header must match
+  WQ_PROFILE_DIR  where reports are written (default: <tmp>/wq-profiles)
+  WQ_PROFILE_TOP  number of functions / allocation sites reported (default 25)
+"""
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+PROFILE_TOKEN = os.environ.get('WQ_PROFILE', '')
+ENABLED = PROFILE_TOKEN not in ('', '0', 'false', 'False')
+PROFILE_DIR = Path(os.environ.get('WQ_PROFILE_DIR', Path(tempfile.gettempdir()) / 'wq-profiles'))
+PROFILE_TOP = int(os.environ.get('WQ_PROFILE_TOP', 25))
+
+HEADER = b'x-profile'
+
+# set by the middleware for a profiled request; handlers store the report in it
+_request: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar('wq_profile', default=None)
+# tracemalloc is process-wide, so profiled calls run one at a time
+_lock = threading.Lock()
+
+
+def requested() -> Optional[Dict[str, Any]]:
+    """The report slot of the current request when it asked to be profiled, else None."""
+    return _request.get() if ENABLED else None
+
+
+def _top_functions(prof: cProfile.Profile, n: int):
+    stats = pstats.Stats(prof, stream=io.StringIO())
+    rows = []
+    for (filename, line, func), (cc, nc, tt, ct, _) in stats.stats.items():
+        rows.append({'function': f'{Path(filename).name}:{line}({func})', 'ncalls': nc, 'primitive_calls': cc,
+                     'tottime_ms': round(tt * 1e3, 3), 'cumtime_ms': round(ct * 1e3, 3)})
+    rows.sort(key=lambda r: r['cumtime_ms'], reverse=True)
+    return rows[:n]
+
+
+def _top_allocations(snapshot: tracemalloc.Snapshot, n: int):
+    out = []
+    for stat in snapshot.statistics('lineno')[:n]:
+        frame = stat.traceback[0]
+        out.append({'site': f'{Path(frame.filename).name}:{frame.lineno}', 'size_kb': round(stat.size / 1024, 1), 'count': stat.count})
+    return out
+
+
+def call(fn: Callable, *args) -> Tuple[Any, Dict[str, Any]]:
+    """Run `fn(*args)` under cProfile and tracemalloc; return (result, report).
+
+    Module-level and picklable, so it can be submitted to a process pool.
+    """
+    with _lock:
+        tracemalloc.start()
+        prof = cProfile.Profile()
+        t0 = time.perf_counter()
+        prof.enable()
+        try:
+            result = fn(*args)
+        finally:
+            prof.disable()
+            wall = time.perf_counter() - t0
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+    report = {
+        'function': getattr(fn, '__qualname__', repr(fn)),
+        'pid': os.getpid(),
+        'wall_ms': round(wall * 1e3, 3),
+        'peak_kb': round(peak / 1024, 1),
+        'retained_kb': round(current / 1024, 1),
+        'top_functions': _top_functions(prof, PROFILE_TOP),
+        'top_allocations': _top_allocations(snapshot, PROFILE_TOP),
+    }
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    stem = PROFILE_DIR / f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+    prof.dump_stats(str(stem.with_suffix('.prof')))
+    report['file'] = str(stem.with_suffix('.json'))
+    with open(report['file'], 'w') as f:
+        json.dump(report, f, indent=2)
+    return result, report
+
+
+def summary(report: Dict[str, Any], n: int = 3) -> str:
+    top = ','.join(f'{r["function"]}={r["cumtime_ms"]}ms' for r in report['top_functions'][:n])
+    return f'wall_ms={report["wall_ms"]}; peak_kb={report["peak_kb"]}; top={top}'
+
+
+class ProfileMiddleware:
+    """Pure ASGI middleware marking requests with an accepted `X-Profile` header for profiling."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        value = dict(scope.get('headers') or ()).get(HEADER)
+        if value is None or (PROFILE_TOKEN != '1' and value.decode('latin-1') != PROFILE_TOKEN):
+            await self.app(scope, receive, send)
+            return
+        slot: Dict[str, Any] = {}
+        token = _request.set(slot)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start' and slot.get('report'):
+                report = slot['report']
+                headers = list(message.get('headers', []))
+                headers.append((b'x-profile-summary', summary(report).encode('latin-1', 'replace')))
+                headers.append((b'x-profile-file', report['file'].encode('latin-1', 'replace')))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request.reset(token)
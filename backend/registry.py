@@ -0,0 +1,149 @@
+"""Model shards per river basin, loaded on first use and evicted under a memory cap.
+
+Each basin has its own encoders and boosters. Shards live under `BASINS_DIR`, one
+directory per basin holding either a compact export (`manifest.json` + `.npy`, see
+`ml/train_lgb.py`) or a single `.wqb` bundle (`backend/model_bundle.py`):
+
+  backend/models/basins/
+    krishna/manifest.json, *.npy
+    godavari/model_bundle.wqb
+
+The river names in each shard's `le_river` encoder are read up front (manifest or
+bundle header only) to route stations to basins; a river listed by several shards
+goes to the first in name order, and rivers no shard knows go to the default basin,
+which `backend.main` loads from `backend/models/` as before.
+
+Loaded shards are kept in LRU order. After a load pushes the total size past the
+cap, the least recently used shards are dropped; requests already holding one keep
+it until they finish. Sizes are the bytes of the tree arrays (memory-mapped for
+compact exports, so the resident share may be smaller). A shard that fails to load
+is not cached: `get` logs and counts the failure and raises, and the next call
+tries again.
+
+Environment:
+  WQ_BASINS_DIR        shard directory (default backend/models/basins)
+  WQ_MODEL_CACHE_MB    cap on loaded shard bytes (default 1024; 0 = no cap)
+"""
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from backend import metrics
+from backend.compact_models import load_compact_models
+from backend.model_bundle import load_bundle, read_header
+
+BASINS_DIR = Path(os.environ.get('WQ_BASINS_DIR') or Path(__file__).resolve().parent / 'models' / 'basins')
+CACHE_BYTES = int(float(os.environ.get('WQ_MODEL_CACHE_MB', '1024')) * 2 ** 20)
+
+log = logging.getLogger(__name__)
+
+
+def shard_nbytes(shard: Dict[str, Any]) -> int:
+    """Size of a loaded shard: its `nbytes` entry, else the sum over boosters that report one."""
+    if 'nbytes' in shard:
+        return int(shard['nbytes'])
+    return int(sum(m.nbytes() for m in shard.get('models', {}).values() if hasattr(m, 'nbytes')))
+
+
+def discover(root: Path = BASINS_DIR) -> Dict[str, Dict[str, Any]]:
+    """{basin: {'load': callable, 'rivers': [...]}} for the shard directories under `root`."""
+    sources = {}
+    if not Path(root).is_dir():
+        return sources
+    for d in sorted(p for p in Path(root).iterdir() if p.is_dir()):
+        bundles = sorted(d.glob('*.wqb'))
+        if (d / 'manifest.json').exists():
+            with open(d / 'manifest.json', 'r', encoding='utf-8') as f:
+                rivers = json.load(f).get('encoders', {}).get('le_river', [])
+            sources[d.name] = {'load': lambda d=d: load_compact_models(d), 'rivers': rivers}
+        elif bundles:
+            rivers = read_header(bundles[0]).get('encoders', {}).get('le_river', [])
+            sources[d.name] = {'load': lambda b=bundles[0]: load_bundle(b), 'rivers': rivers}
+    return sources
+
+
+class ModelRegistry:
+    """Basin -> shard ({'models', 'encoders', 'transforms', ...}), loaded lazily, LRU-evicted."""
+
+    def __init__(self, sources: Dict[str, Dict[str, Any]], default: str, cap_bytes: int = CACHE_BYTES):
+        self.sources = dict(sources)
+        self.default = default
+        self.cap_bytes = cap_bytes
+        self._loaded: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        # reentrant: `get` reports resident bytes while holding it
+        self._lock = threading.RLock()
+        self._river_basin = {}
+        for basin, src in self.sources.items():
+            for river in src.get('rivers', ()):
+                self._river_basin.setdefault(river, basin)
+
+    @classmethod
+    def from_directory(cls, default: str, load_default: Callable[[], Dict[str, Any]], root: Path = BASINS_DIR,
+                       cap_bytes: int = CACHE_BYTES) -> 'ModelRegistry':
+        sources = discover(root)
+        sources.setdefault(default, {'load': load_default, 'rivers': []})
+        return cls(sources, default, cap_bytes)
+
+    @property
+    def basins(self) -> List[str]:
+        return list(self.sources)
+
+    def basin_for(self, river: Optional[str]) -> str:
+        return self._river_basin.get(river or '', self.default)
+
+    def group(self, rivers: Iterable[Optional[str]]) -> Dict[str, np.ndarray]:
+        """Row indices per basin for a column of river names, in first-seen order."""
+        rows: Dict[str, List[int]] = {}
+        for i, river in enumerate(rivers):
+            rows.setdefault(self.basin_for(river), []).append(i)
+        return {basin: np.array(idx, dtype=np.int64) for basin, idx in rows.items()}
+
+    def get(self, basin: str) -> Dict[str, Any]:
+        """The shard of `basin`, loading it (and evicting others past the cap) on first use.
+
+        Raises KeyError for an unknown basin and the loader's exception when loading fails.
+        """
+        with self._lock:
+            shard = self._loaded.get(basin)
+            if shard is not None:
+                self._loaded.move_to_end(basin)
+                metrics.cache_lookup('model_shards', True)
+                return shard
+            metrics.cache_lookup('model_shards', False)
+            if basin not in self.sources:
+                raise KeyError(basin)
+            try:
+                shard = self.sources[basin]['load']()
+            except Exception:
+                log.exception('loading model shard %r failed', basin)
+                metrics.record_shard(basin, 'load_error', self.resident_bytes())
+                raise
+            shard['nbytes'] = shard_nbytes(shard)
+            self._loaded[basin] = shard
+            metrics.record_shard(basin, 'load', self.resident_bytes())
+            while self.cap_bytes and len(self._loaded) > 1 and self.resident_bytes() > self.cap_bytes:
+                old, _ = self._loaded.popitem(last=False)
+                metrics.record_shard(old, 'evict', self.resident_bytes())
+            return shard
+
+    def evict(self, basin: str) -> bool:
+        with self._lock:
+            if self._loaded.pop(basin, None) is None:
+                return False
+            metrics.record_shard(basin, 'evict', self.resident_bytes())
+            return True
+
+    def resident(self) -> Dict[str, int]:
+        """Loaded basins (least recently used first) and their bytes."""
+        with self._lock:
+            return {basin: shard['nbytes'] for basin, shard in self._loaded.items()}
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(shard['nbytes'] for shard in self._loaded.values())
@@ -0,0 +1,179 @@
+"""Fast JSON encoding for prediction payloads.
+
+FastAPI's default path runs every returned dict through `jsonable_encoder` and then
+`json.dumps`, which for large `/interpolate_predict` and `/predict_all` bodies costs
+more than computing them. Handlers that return a `FastJSONResponse` skip both: the
+content is encoded once by orjson (NumPy arrays and scalars included), falling back
+to the stdlib encoder when orjson is not installed.
+
+`round_array` rounds a whole vector at once; use it instead of calling `round()` per
+value when building payloads from model outputs.
+
+Tabular payloads can also be served as columns, chosen by the `Accept` header:
+
+  application/json                     rows, as before (default)
+  application/vnd.apache.arrow.stream  Arrow IPC stream, one typed column per field;
+                                       the non-tabular fields are JSON in the schema
+                                       metadata under `wq_meta`   (needs pyarrow)
+  application/x-msgpack                {'meta': {...}, 'length': n, 'columns': {...}}; numeric
+                                       columns are {'dtype': '<f8'|'<i8', 'data': raw bytes},
+                                       text columns are lists                (needs msgpack)
+
+Numeric columns are float64 with NaN for missing values (int64 when all values are
+integers). A client gets a DataFrame with `pyarrow.ipc.open_stream(body).read_pandas()`
+or `np.frombuffer(col['data'], col['dtype'])` per msgpack column.
+"""
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # optional: pip install orjson
+    orjson = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # optional: pip install pyarrow
+    pyarrow = None
+
+try:
+    import msgpack
+except ImportError:  # optional: pip install msgpack
+    msgpack = None
+
+JSON = 'application/json'
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+MSGPACK = 'application/x-msgpack'
+
+_MEDIA_FORMATS = {
+    JSON: 'json', 'application/*': 'json', '*/*': 'json',
+    ARROW_STREAM: 'arrow',
+    MSGPACK: 'msgpack', 'application/msgpack': 'msgpack', 'application/vnd.msgpack': 'msgpack',
+}
+
+
+def round_array(values, decimals: int) -> List[Any]:
+    """Round a sequence of numbers in one NumPy pass; returns Python floats, NaN as None."""
+    arr = np.round(np.asarray(values, dtype=np.float64), decimals)
+    out = arr.tolist()
+    if np.isnan(arr).any():
+        out = [None if v != v else v for v in out]
+    return out
+
+
+def _default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=_OPTIONS)
+else:
+    def dumps(content: Any) -> bytes:
+        return json.dumps(content, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONResponse(Response):
+    media_type = 'application/json'
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def available_formats() -> List[str]:
+    return ['json'] + (['arrow'] if pyarrow is not None else []) + (['msgpack'] if msgpack is not None else [])
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """Pick 'json', 'arrow' or 'msgpack' from an Accept header.
+
+    Headers naming none of these types get JSON, as before content negotiation; None
+    means a columnar format was asked for (and JSON was not) but its library is missing.
+    """
+    if not accept:
+        return 'json'
+    available = available_formats()
+    offers = []
+    for i, part in enumerate(accept.split(',')):
+        media, *params = [x.strip() for x in part.split(';')]
+        q = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        fmt = _MEDIA_FORMATS.get(media.lower())
+        if fmt is not None and q > 0:
+            offers.append((-q, i, fmt))
+    if not offers:
+        return 'json'
+    for _, _, fmt in sorted(offers):
+        if fmt in available:
+            return fmt
+    return None
+
+
+def typed_column(values) -> Any:
+    """A float64/int64 array for numeric values (None -> NaN), else a list of str/None."""
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'fiu':
+        return values
+    values = list(values)
+    if all(v is None or isinstance(v, str) for v in values):
+        return values
+    if all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in values):
+        return np.array(values, dtype=np.int64)
+    if all(v is None or (isinstance(v, (int, float, np.number)) and not isinstance(v, bool)) for v in values):
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    return [None if v is None else str(v) for v in values]
+
+
+def columns_from_rows(rows: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Transpose a list of flat dicts; keys missing from a row become None/NaN."""
+    keys = list(dict.fromkeys(k for row in rows for k in row))
+    return {k: typed_column([row.get(k) for row in rows]) for k in keys}
+
+
+def _arrow_bytes(columns: Dict[str, Any], meta: Dict[str, Any]) -> bytes:
+    arrays = {name: pyarrow.array(col) for name, col in columns.items()}
+    table = pyarrow.table(arrays).replace_schema_metadata({'wq_meta': dumps(meta)})
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _msgpack_bytes(columns: Dict[str, Any], meta: Dict[str, Any]) -> bytes:
+    length = len(next(iter(columns.values()))) if columns else 0
+    packed = {}
+    for name, col in columns.items():
+        if isinstance(col, np.ndarray):
+            col = np.ascontiguousarray(col, dtype='<f8' if col.dtype.kind == 'f' else '<i8')
+            packed[name] = {'dtype': col.dtype.str, 'data': col.tobytes()}
+        else:
+            packed[name] = col
+    # meta goes through JSON first so NumPy values and nested dicts are plain types
+    return msgpack.packb({'meta': json.loads(dumps(meta)), 'length': length, 'columns': packed}, use_bin_type=True)
+
+
+def columnar_response(columns: Dict[str, Any], meta: Dict[str, Any], fmt: str) -> Response:
+    """Arrow or msgpack response for `columns` (name -> list/array), `meta` holding the other fields."""
+    columns = {name: typed_column(col) for name, col in columns.items()}
+    if fmt == 'arrow':
+        return Response(_arrow_bytes(columns, meta), media_type=ARROW_STREAM, headers={'Vary': 'Accept'})
+    return Response(_msgpack_bytes(columns, meta), media_type=MSGPACK, headers={'Vary': 'Accept'})
+
+
+def not_acceptable() -> Response:
+    return FastJSONResponse({'error': 'not acceptable', 'available': [JSON] + [m for m, f in ((ARROW_STREAM, 'arrow'), (MSGPACK, 'msgpack')) if f in available_formats()]},
+                            status_code=406)
@@ -0,0 +1,137 @@
+"""Water-quality classification standards as vectorised rules.
+
+A standard is a declarative table: an output field, ordered classes with per-parameter
+bounds `[low, high]` (either may be null) and a default label. `Standard` compiles
+it into bound arrays and labels whole columns at once: rows get the first class whose
+bounds all hold, the default otherwise. Missing (None/NaN) values fail every bound.
+
+Built in:
+
+  compliance  `Water Quality`: Complying when 6.5 <= pH <= 8.5, DO >= 5 and BOD <= 3
+  cpcb        `CPCB Class`: CPCB designated-best-use classes A-E on pH, DO, BOD and
+              total coliforms. Criteria on parameters the models do not predict
+              (free ammonia, conductivity, SAR, boron) are not applied.
+
+More standards can be loaded from a JSON file of the same shape as `BUILTIN` with
+`WQ_STANDARDS_FILE`.
+"""
+import json
+import os
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+DEFAULT = 'compliance'
+
+BUILTIN = {
+    'compliance': {
+        'field': 'Water Quality',
+        'default': 'Non Complying',
+        'classes': [
+            {'label': 'Complying', 'bounds': {'pH': [6.5, 8.5], 'DO (mg/L)': [5.0, None], 'BOD (mg/L)': [None, 3.0]}},
+        ],
+    },
+    'cpcb': {
+        'field': 'CPCB Class',
+        'default': 'Below E',
+        'classes': [
+            {'label': 'A', 'bounds': {'pH': [6.5, 8.5], 'DO (mg/L)': [6.0, None], 'BOD (mg/L)': [None, 2.0], 'TC MPN/100ml': [None, 50.0]}},
+            {'label': 'B', 'bounds': {'pH': [6.5, 8.5], 'DO (mg/L)': [5.0, None], 'BOD (mg/L)': [None, 3.0], 'TC MPN/100ml': [None, 500.0]}},
+            {'label': 'C', 'bounds': {'pH': [6.0, 9.0], 'DO (mg/L)': [4.0, None], 'BOD (mg/L)': [None, 3.0], 'TC MPN/100ml': [None, 5000.0]}},
+            {'label': 'D', 'bounds': {'pH': [6.5, 8.5], 'DO (mg/L)': [4.0, None]}},
+            {'label': 'E', 'bounds': {'pH': [6.0, 8.5]}},
+        ],
+    },
+}
+
+
+class Standard:
+    """One compiled classification table."""
+
+    def __init__(self, name: str, spec: Mapping[str, Any]):
+        self.name = name
+        self.spec = spec
+        self.field = spec['field']
+        self.default = spec['default']
+        self.labels = [c['label'] for c in spec['classes']]
+        self.params = list(dict.fromkeys(p for c in spec['classes'] for p in c['bounds']))
+        # (classes x params) bound arrays; parameters a class does not test are unbounded
+        self.low = np.full((len(self.labels), len(self.params)), -np.inf)
+        self.high = np.full((len(self.labels), len(self.params)), np.inf)
+        self.tested = np.zeros((len(self.labels), len(self.params)), dtype=bool)
+        for i, c in enumerate(spec['classes']):
+            for p, (lo, hi) in c['bounds'].items():
+                j = self.params.index(p)
+                self.tested[i, j] = True
+                if lo is not None:
+                    self.low[i, j] = lo
+                if hi is not None:
+                    self.high[i, j] = hi
+        # the same bounds as plain tuples for single rows
+        self._rows = [(lab, [(p, float(self.low[i, j]), float(self.high[i, j])) for j, p in enumerate(self.params) if self.tested[i, j]])
+                      for i, lab in enumerate(self.labels)]
+
+    def classify(self, columns: Mapping[str, Any]) -> np.ndarray:
+        """Labels (object array) for parameter columns; absent columns count as missing."""
+        n = max((len(v) for v in columns.values()), default=0)
+        values = np.full((n, len(self.params)), np.nan)
+        for j, p in enumerate(self.params):
+            if p in columns:
+                values[:, j] = _floats(columns[p])
+        with np.errstate(invalid='ignore'):
+            inside = (values[:, None, :] >= self.low) & (values[:, None, :] <= self.high)
+        # (rows x classes): every tested bound holds
+        match = (inside | ~self.tested).all(axis=2)
+        first = np.where(match.any(axis=1), match.argmax(axis=1), len(self.labels))
+        return np.array(self.labels + [self.default], dtype=object)[first]
+
+    def label(self, values: Mapping[str, Any]) -> str:
+        """Label of a single row given as {param: value}, without building arrays."""
+        for lab, bounds in self._rows:
+            try:
+                if all(lo <= float(values[p]) <= hi for p, lo, hi in bounds):
+                    return lab
+            except (KeyError, TypeError, ValueError):
+                continue
+        return self.default
+
+
+def _floats(values) -> np.ndarray:
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'f':
+        return values
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def load_standards(path: Optional[str] = None) -> Dict[str, Standard]:
+    specs = dict(BUILTIN)
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            specs.update(json.load(f))
+    return {name.lower(): Standard(name.lower(), spec) for name, spec in specs.items()}
+
+
+STANDARDS = load_standards(os.environ.get('WQ_STANDARDS_FILE'))
+COMPLIANCE = STANDARDS[DEFAULT]
+
+
+def resolve(names: Optional[Iterable[str]]) -> List[Standard]:
+    """The default standard plus the named extras; unknown names raise KeyError."""
+    if isinstance(names, str):
+        names = [n for n in names.split(',') if n.strip()]
+    out = [COMPLIANCE]
+    for name in names or ():
+        std = STANDARDS[name.strip().lower()]
+        if std not in out:
+            out.append(std)
+    return out
+
+
+def classify_rows(rows: Sequence[Dict[str, Any]], standards: Sequence[Standard] = (COMPLIANCE,)):
+    """Set each standard's field on every row dict, classifying all rows in one pass."""
+    if not rows:
+        return rows
+    for std in standards:
+        labels = std.classify({p: [row.get(p) for row in rows] for p in std.params})
+        for row, lab in zip(rows, labels.tolist()):
+            row[std.field] = lab
+    return rows
@@ -0,0 +1,181 @@
+"""Live time scrubbing of station predictions over a WebSocket.
+
+Dragging the month/year slider used to cost one `/predict_all` request per step,
+each carrying every station's full row. A client of `/ws/predict_all` instead
+connects once and sends time cursors:
+
+  {"month": 6, "year": 2023, "standards": "cpcb", "seq": 17}
+
+`standards` (optional) is as for `/predict_all`; `seq` (optional) is echoed back
+and `"full": true` asks for a complete state again. The first answer carries the
+station columns and every value:
+
+  {"type": "full", "seq": 17, "month": 6, "year": 2023,
+   "stations": {"location": [...], "river": [...], "latitude": [...], "longitude": [...]},
+   "values": {"pH": [...], "DO (mg/L)": [...], ..., "Water Quality": [...]}}
+
+Later answers carry only the values that differ from what the client last got, by
+station index:
+
+  {"type": "diff", "seq": 18, "month": 7, "year": 2023, "changed_rows": 3,
+   "changed": {"pH": {"index": [4, 9], "values": [7.1, 6.9]}, ...}}
+
+Cursors that arrive while a step is being computed are coalesced: only the newest
+one is answered, so a fast drag never builds a backlog. A cursor that changes the
+set of value columns (other `standards`) gets a `full` answer; a bad cursor an
+`{"type": "error"}` message, and the connection stays open.
+
+Recent steps are kept in a small cache shared by all connections, so scrubbing
+back and forth recomputes nothing.
+
+Environment:
+  WQ_SCRUB_CACHE    predict_all steps kept in memory (default 64)
+"""
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from backend.metrics import Counter
+from backend.responses import dumps, round_array
+
+CACHE_SIZE = int(os.environ.get('WQ_SCRUB_CACHE', 64))
+STATION_COLUMNS = ('location', 'river', 'latitude', 'longitude')
+
+messages = Counter('wq_scrub_messages_total', 'Messages pushed to /ws/predict_all clients by type.', labelnames=('type',))
+message_bytes = Counter('wq_scrub_message_bytes_total', 'Bytes pushed to /ws/predict_all clients by message type.', labelnames=('type',))
+
+
+def _same(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    eq = a == b
+    if a.dtype.kind == 'f':
+        eq |= np.isnan(a) & np.isnan(b)
+    return eq
+
+
+def _json_values(arr: np.ndarray) -> list:
+    return round_array(arr, 2) if arr.dtype.kind == 'f' else arr.tolist()
+
+
+class ScrubState:
+    """The values one client last received, and the message that brings it to new columns."""
+
+    def __init__(self, value_columns: Sequence[str]):
+        self.value_columns = tuple(value_columns)
+        self.values: Optional[Dict[str, np.ndarray]] = None
+
+    def update(self, columns: Dict[str, Any], full: bool = False) -> Dict[str, Any]:
+        names = [c for c in columns if c not in STATION_COLUMNS and c not in ('month', 'year')]
+        new = {c: np.asarray(columns[c], dtype=np.float64 if c in self.value_columns else object) for c in names}
+        prev, self.values = self.values, new
+        if full or prev is None or list(prev) != names:
+            return {'type': 'full',
+                    'stations': {c: _json_values(np.asarray(columns[c], dtype=np.float64 if c in ('latitude', 'longitude') else object))
+                                 for c in STATION_COLUMNS},
+                    'values': {c: _json_values(v) for c, v in new.items()}}
+        changed, rows = {}, None
+        for c, v in new.items():
+            diff = ~_same(v, prev[c])
+            idx = np.flatnonzero(diff)
+            if len(idx):
+                changed[c] = {'index': idx.tolist(), 'values': _json_values(v[idx])}
+                rows = diff if rows is None else rows | diff
+        return {'type': 'diff', 'changed_rows': int(rows.sum()) if rows is not None else 0, 'changed': changed}
+
+
+class ColumnCache:
+    """LRU of computed steps, keyed by (month, year, standards)."""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self._items: 'OrderedDict[Tuple, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+            return item
+
+    def put(self, key: Tuple, columns: Dict[str, Any]):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._items[key] = columns
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+def parse_cursor(text: str) -> Dict[str, Any]:
+    """{'month', 'year', 'standards', 'seq', 'full'} from a client message; ValueError when invalid."""
+    try:
+        msg = json.loads(text)
+    except ValueError:
+        raise ValueError('cursor must be a JSON object')
+    if not isinstance(msg, dict):
+        raise ValueError('cursor must be a JSON object')
+    try:
+        month, year = int(msg['month']), int(msg['year'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('cursor needs integer month and year')
+    if not (1 <= month <= 12 and 1900 <= year <= 2100):
+        raise ValueError('month must be 1-12 and year 1900-2100')
+    return {'month': month, 'year': year, 'standards': msg.get('standards'), 'seq': msg.get('seq'), 'full': bool(msg.get('full'))}
+
+
+async def _send(ws: WebSocket, msg: Dict[str, Any]):
+    data = dumps(msg).decode('utf-8')
+    messages.inc(type=msg['type'])
+    message_bytes.inc(len(data), type=msg['type'])
+    await ws.send_text(data)
+
+
+async def serve(ws: WebSocket, step: Callable[[int, int, Any], Awaitable[Tuple[Dict[str, Any], Sequence[str]]]]):
+    """Run one scrubbing connection. `step(month, year, standards)` returns (columns, value column
+    names) or raises ValueError for a bad cursor."""
+    await ws.accept()
+    state: Optional[ScrubState] = None
+    latest: Optional[str] = None
+    wake = asyncio.Event()
+
+    async def receive():
+        nonlocal latest
+        while True:
+            latest = await ws.receive_text()
+            wake.set()
+
+    receiver = asyncio.create_task(receive())
+    try:
+        while True:
+            waiter = asyncio.create_task(wake.wait())
+            await asyncio.wait({receiver, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                waiter.cancel()
+                receiver.result()
+                return
+            # only the newest cursor counts; older ones were overtaken while the last step ran
+            wake.clear()
+            text, latest = latest, None
+            seq = None
+            try:
+                cursor = parse_cursor(text)
+                seq = cursor['seq']
+                columns, value_columns = await step(cursor['month'], cursor['year'], cursor['standards'])
+            except ValueError as e:
+                await _send(ws, {'type': 'error', 'seq': seq, 'error': str(e)})
+                continue
+            if state is None or state.value_columns != tuple(value_columns):
+                state = ScrubState(value_columns)
+            msg = state.update(columns, full=cursor['full'])
+            await _send(ws, dict({'type': msg.pop('type'), 'seq': seq, 'month': cursor['month'], 'year': cursor['year']}, **msg))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
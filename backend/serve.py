@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Multi-process launcher that preloads the API once and forks workers.
+
+Usage (from repository root, Linux/macOS):
+  python -m backend.serve --workers 4 --port 8000
+
+`uvicorn --workers N` spawns fresh interpreters that each import `backend.main`
+and rebuild the models, geodata and Predictor, so memory grows with N. Here the
+master imports everything, moves the loaded objects out of the cyclic GC
+(`gc.freeze()`) so collections in the children don't write to their headers, binds
+the listening socket and then forks. Workers share the preloaded pages
+copy-on-write; the memory-mapped model arrays are shared through the page cache.
+The master restarts workers that exit unexpectedly and forwards SIGINT/SIGTERM.
+
+Each worker starts its own offload pool (`backend.executor`). The master exports
+the worker count as `WQ_SERVE_WORKERS` before importing the app, and the default
+pool size is divided by it, so all workers together use about half the CPUs; with
+more workers than that allows, offloading is off and large jobs run in each
+worker's threadpool.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+
+def preload():
+    """Import the app and everything it loads at import time; return the ASGI app."""
+    from backend import main
+    # touch the lazily created parts of the app once so the children inherit them
+    main.app.openapi()
+    main.predict_all(6, 2023)
+    return main.app
+
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, log_level):
+    import uvicorn
+    config = uvicorn.Config(app, log_level=log_level)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def spawn(app, sock, log_level):
+    pid = os.fork()
+    if pid == 0:
+        # child: default signal handling, uvicorn installs its own
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        code = 0
+        try:
+            run_worker(app, sock, log_level)
+        except BaseException:
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8000)
+    p.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    p.add_argument('--log-level', default='info')
+    args = p.parse_args(argv)
+
+    if not hasattr(os, 'fork'):
+        print('backend.serve needs os.fork(); use `uvicorn backend.main:app` on this platform.')
+        return 1
+
+    # read by backend.executor at import: the offload pools share the CPUs between workers
+    os.environ['WQ_SERVE_WORKERS'] = str(args.workers)
+    app = preload()
+    sock = bind_socket(args.host, args.port)
+    # everything allocated so far is read-only serving state
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(args.workers):
+        children[spawn(app, sock, args.log_level)] = time.monotonic()
+    print(f'master {os.getpid()} serving on {args.host}:{args.port} with workers {sorted(children)}', flush=True)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        print(f'worker {pid} exited with status {status}; restarting', flush=True)
+        # avoid a hot restart loop when workers die immediately
+        if time.monotonic() - started < 1.0:
+            time.sleep(1.0)
+        children[spawn(app, sock, args.log_level)] = time.monotonic()
+    sock.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
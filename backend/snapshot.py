@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Warm-start snapshot of the derived, read-only serving state.
+
+At import `backend.main` parses `locations.js`, packs the geodata and its segment
+index, projects every station onto every river path, ranks every path vertex for
+the simplified path levels and packs the Predictor's coefficient tables. All of
+that depends only on a few input files, so it is saved once to a single file
+named after a hash of those files' contents (and `SNAPSHOT_VERSION`) and
+memory-mapped on later starts:
+
+  <WQ_SNAPSHOT_DIR>/serving-<key>.wqs
+
+A start whose inputs hash to an existing file loads it in one step; otherwise the
+state is derived as before and the file written for the next start. Arrays are
+read-only views into the mapping, so forked workers share the pages.
+
+Usage (from repository root):
+  python -m backend.snapshot build            # write the snapshot for the current inputs if missing
+  python -m backend.snapshot build --force    # rebuild it anyway
+  python -m backend.snapshot info             # key, file and how this start got its state
+
+File layout (little-endian): b'WQS1', uint32 header length H, H bytes of JSON
+(space-padded to a multiple of 8) with `format`, `version`, `key`, `created`, the
+non-array state and `arrays` {name: {offset, dtype, shape}}, then the 8-byte aligned
+array data (offsets relative to its start).
+
+Environment:
+  WQ_SNAPSHOT_DIR   where snapshots are kept (default <tmp>/wq-snapshot-<uid>; empty disables them).
+                    The directory is created with mode 0700; one the current user does not own,
+                    or that others can write to, is refused (status 'refused', nothing is read
+                    or written), since loading a snapshot trusts its contents.
+"""
+import hashlib
+import json
+import mmap
+import os
+import stat
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b'WQS1'
+FORMAT = 'wq-serving-snapshot'
+# bump when the derived state or its layout changes
+SNAPSHOT_VERSION = 2
+_UID = os.getuid() if hasattr(os, 'getuid') else None
+SNAPSHOT_DIR = os.environ.get('WQ_SNAPSHOT_DIR', str(Path(tempfile.gettempdir()) / f'wq-snapshot-{"user" if _UID is None else _UID}'))
+
+
+def input_key(paths: Iterable[Path], settings: Optional[Dict] = None) -> str:
+    """Hash of SNAPSHOT_VERSION, `settings` and the contents of `paths` (missing files count as absent)."""
+    h = hashlib.sha1(f'{FORMAT}:{SNAPSHOT_VERSION}:{sorted((settings or {}).items())!r}'.encode())
+    for p in paths:
+        p = Path(p)
+        h.update(f'{p.name};'.encode())
+        try:
+            with open(p, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+        except OSError:
+            h.update(b'<missing>')
+    return h.hexdigest()[:16]
+
+
+def snapshot_path(key: str, directory: str = SNAPSHOT_DIR) -> Path:
+    return Path(directory) / f'serving-{key}.wqs'
+
+
+def write(path: Path, header: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+    """Write atomically (temporary file + rename), so concurrent starts never read a partial file."""
+    layout, blobs, offset = {}, [], 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        arr = arr.astype(arr.dtype.newbyteorder('<'), copy=False)
+        data = arr.tobytes()
+        layout[name] = {'offset': offset, 'dtype': arr.dtype.str, 'shape': list(arr.shape)}
+        pad = -len(data) % 8
+        blobs.append(data + b'\0' * pad)
+        offset += len(data) + pad
+    head = json.dumps(dict(header, arrays=layout), separators=(',', ':')).encode('utf-8')
+    head += b' ' * (-len(head) % 8)
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC + struct.pack('<I', len(head)) + head)
+            for blob in blobs:
+                f.write(blob)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def read(path: Path) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """(header, arrays) with the arrays as read-only views into a memory map of the file."""
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:4] != MAGIC:
+        raise ValueError(f'{path} is not a serving snapshot')
+    (n,) = struct.unpack('<I', mm[4:8])
+    header = json.loads(mm[8:8 + n])
+    if header.get('format') != FORMAT or header.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f'{path} has an unsupported snapshot version')
+    base = 8 + n
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dt = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        arrays[name] = np.frombuffer(mm, dtype=dt, count=count, offset=base + spec['offset']).reshape(spec['shape'])
+    return header, arrays
+
+
+def private_dir(directory: str) -> bool:
+    """Create `directory` (mode 0700) if missing; False when it is not a directory owned by the
+    current user or is writable by group or others."""
+    path = Path(directory)
+    try:
+        path.mkdir(mode=0o700, parents=True, exist_ok=True)
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if _UID is None:
+        return path.is_dir()
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == _UID and not st.st_mode & 0o022
+
+
+def load_or_build(key: str, build: Callable[[], Tuple[Dict[str, Any], Dict[str, np.ndarray]]],
+                  directory: Optional[str] = SNAPSHOT_DIR) -> Tuple[Dict[str, Any], Dict[str, np.ndarray], str]:
+    """(header, arrays, status) for `key`: 'loaded' from an existing snapshot, else 'built' (and
+    written, when `directory` is set and writable), 'disabled' when there is no directory or
+    'refused' when it fails private_dir()."""
+    if not directory:
+        header, arrays = build()
+        return header, arrays, 'disabled'
+    if not private_dir(directory):
+        header, arrays = build()
+        return header, arrays, 'refused'
+    path = snapshot_path(key, directory)
+    if path.exists():
+        try:
+            header, arrays = read(path)
+            if header.get('key') == key:
+                return header, arrays, 'loaded'
+        except (OSError, ValueError):
+            pass
+    header, arrays = build()
+    header = dict(header, format=FORMAT, version=SNAPSHOT_VERSION, key=key, created=time.time())
+    try:
+        write(path, header, arrays)
+        # serve from the mapping like a warm start would, so both starts share the same pages
+        header, arrays = read(path)
+        return header, arrays, 'built'
+    except OSError:
+        return header, arrays, 'built'
+
+
+def main(argv=None):
+    import argparse
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('cmd', choices=('build', 'info'))
+    p.add_argument('--force', action='store_true', help='build: rebuild even when a current snapshot exists')
+    args = p.parse_args(argv)
+    # importing the app loads the snapshot for the current inputs, or derives and writes it
+    t0 = time.perf_counter()
+    from backend import main as app
+    status, elapsed = app.SNAPSHOT_STATUS, time.perf_counter() - t0
+    path = snapshot_path(app.SNAPSHOT_KEY) if SNAPSHOT_DIR else None
+    if args.cmd == 'build' and args.force and status == 'loaded':
+        path.unlink()
+        t0 = time.perf_counter()
+        status = load_or_build(app.SNAPSHOT_KEY, app.derive_serving_state)[2]
+        elapsed = time.perf_counter() - t0
+    print(f'key {app.SNAPSHOT_KEY}: {status} in {elapsed:.2f}s' + (' (app import included)' if not args.force else ''))
+    if path is not None and path.exists():
+        print(f'{path} ({path.stat().st_size} bytes)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,5 @@
 import json
-from backend.main import interpolate_predict
+from backend.main import run_interpolation
 
 body = {
     'start': {'latitude': 18.520976, 'longitude': 73.849634},
@@ -10,5 +10,5 @@ body = {
     'follow_river': True,
     'debug': True
 }
-res = interpolate_predict(body)
+res = run_interpolation(body)
 print(json.dumps(res, indent=2, default=str))
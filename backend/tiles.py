@@ -0,0 +1,368 @@
+"""Map tiles of the interpolated water-quality surface.
+
+`/tiles/{param}/{z}/{x}/{y}` covers the standard Web Mercator (slippy map) tile
+`z/x/y` with a `TILE_SIZE` x `TILE_SIZE` grid. Every pixel within `CORRIDOR_M` of a
+river path gets the inverse-distance-weighted station prediction of `param`
+(`backend.idw`, `IDW_K` nearest stations); pixels outside the corridor are empty.
+Tiles are encoded as:
+
+  png  RGBA, green (good) -> yellow -> red (poor) on the scale in `SCALES`,
+       transparent outside the corridor
+  f32  raw little-endian float32 values, row-major from the north-west corner,
+       NaN outside the corridor
+
+Rendered tiles go through a `TileCache`: an in-memory LRU of `CACHE_TILES` tiles in
+front of a directory of tile files. Keys start with a version hash of the model
+files, the station/river geodata and the settings above, so a new model or
+`locations.js` never serves stale tiles. The directory keeps only the current
+version (older version directories are deleted on the first write) and at most
+`CACHE_BYTES` of it; past that the least recently used tiles are deleted.
+
+Environment:
+  WQ_TILE_CACHE_DIR    on-disk cache (default: <tmp>/wq-tiles; empty disables it)
+  WQ_TILE_CACHE_TILES  tiles kept in memory (default 1024)
+  WQ_TILE_CACHE_MB     size cap of the on-disk cache (default 512)
+  WQ_TILE_CORRIDOR_M   river-corridor buffer in meters (default 750)
+  WQ_TILE_IDW_K        nearest stations blended per pixel (default 8)
+"""
+import hashlib
+import math
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from backend import metrics
+from backend.geodata import PackedGeo, haversine_m
+from backend.idw import idw_predict
+
+TILE_SIZE = 256
+# pixels per side of the blocks the corridor test and the blending cull segments/stations for
+BLOCK = 32
+MAX_ZOOM = 22
+CACHE_DIR = os.environ.get('WQ_TILE_CACHE_DIR', str(Path(tempfile.gettempdir()) / 'wq-tiles'))
+CACHE_TILES = int(os.environ.get('WQ_TILE_CACHE_TILES', 1024))
+CACHE_BYTES = int(float(os.environ.get('WQ_TILE_CACHE_MB', 512)) * 2 ** 20)
+# share of the cap the disk cache is trimmed to when it overflows
+_TRIM_TO = 0.9
+CORRIDOR_M = float(os.environ.get('WQ_TILE_CORRIDOR_M', 750))
+IDW_K = int(os.environ.get('WQ_TILE_IDW_K', 8))
+
+# URL name -> model parameter
+PARAMS = {'ph': 'pH', 'do': 'DO (mg/L)', 'bod': 'BOD (mg/L)', 'fc': 'FC MPN/100ml', 'tc': 'TC MPN/100ml'}
+# URL name -> (transform, good, poor): colour position is (transform(v) - good) / (poor - good)
+SCALES = {
+    'ph': ('ph', 0.0, 1.5),     # distance from 7.5; the 6.5-8.5 limits sit at 2/3
+    'do': ('linear', 8.0, 2.0),
+    'bod': ('linear', 1.0, 6.0),
+    'fc': ('log10', 2.0, 4.0),
+    'tc': ('log10', 2.0, 4.0),
+}
+MEDIA_TYPES = {'png': 'image/png', 'f32': 'application/octet-stream'}
+# green -> yellow -> red
+_RAMP = np.array([[26, 152, 80], [254, 224, 139], [215, 48, 39]], dtype=np.float64)
+_ALPHA = 200
+_DEG_M = 111320.0
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """(south, north, west, east) of tile z/x/y in degrees."""
+    n = 2 ** z
+
+    def lat(v):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * v / n))))
+    return lat(y + 1), lat(y), x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+
+
+def tile_for(lat: float, lon: float, z: int) -> Tuple[int, int]:
+    """(x, y) of the zoom-`z` tile containing a point."""
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def pixel_centers(z: int, x: int, y: int, size: int = TILE_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """Flattened latitude/longitude of the pixel centres of tile z/x/y, rows from the north."""
+    n = 2 ** z
+    f = (np.arange(size) + 0.5) / size
+    lon = (x + f) / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + f) / n))))
+    return np.repeat(lat, size), np.tile(lon, size)
+
+
+def pixel_m(z: int, y: int, size: int = TILE_SIZE) -> float:
+    """Ground size in meters of one pixel at the middle of tile row `y` (the path level to use
+    needs no more detail than half of it)."""
+    n = 2 ** z
+    lat = math.atan(math.sinh(math.pi * (1 - 2 * (y + 0.5) / n)))
+    return 2 * math.pi * 6378137.0 * math.cos(lat) / (n * size)
+
+
+def corridor_mask(geo: PackedGeo, lat: np.ndarray, lon: np.ndarray, buffer_m: float = CORRIDOR_M,
+                  size: int = TILE_SIZE) -> np.ndarray:
+    """Pixels within `buffer_m` of a river path; everything when there are no paths.
+
+    `lat`/`lon` are the `pixel_centers` of a tile. Each `BLOCK` x `BLOCK` pixel block
+    is only tested against the segments whose padded bounding box overlaps it, with
+    point-segment distances in a local equirectangular frame (exact enough at
+    corridor widths).
+    """
+    if len(geo.seg_a) == 0:
+        return np.ones(len(lat), dtype=bool)
+    kx = _DEG_M * max(math.cos(math.radians(float(np.abs(lat).max()))), 1e-6)
+    pad_lat, pad_lon = buffer_m / _DEG_M, buffer_m / kx
+    segs = geo.segments_near(lat.min() - pad_lat, lat.max() + pad_lat, lon.min() - pad_lon, lon.max() + pad_lon)
+    mask = np.zeros((size, size), dtype=bool)
+    if len(segs) == 0:
+        return mask.ravel()
+    lat0, lon0 = float(lat.min()), float(lon.min())
+    ay, ax = (geo.seg_a[segs, 0] - lat0) * _DEG_M, (geo.seg_a[segs, 1] - lon0) * kx
+    by, bx = (geo.seg_b[segs, 0] - lat0) * _DEG_M, (geo.seg_b[segs, 1] - lon0) * kx
+    lo_y, hi_y = np.minimum(ay, by) - buffer_m, np.maximum(ay, by) + buffer_m
+    lo_x, hi_x = np.minimum(ax, bx) - buffer_m, np.maximum(ax, bx) + buffer_m
+    dy, dx = by - ay, bx - ax
+    seg2 = dx * dx + dy * dy
+    py = ((lat - lat0) * _DEG_M).reshape(size, size)
+    px = ((lon - lon0) * kx).reshape(size, size)
+    for r in range(0, size, BLOCK):
+        for c in range(0, size, BLOCK):
+            by_, bx_ = py[r:r + BLOCK, c:c + BLOCK], px[r:r + BLOCK, c:c + BLOCK]
+            near = np.flatnonzero((lo_y <= by_.max()) & (hi_y >= by_.min()) & (lo_x <= bx_.max()) & (hi_x >= bx_.min()))
+            if len(near) == 0:
+                continue
+            qy, qx = by_.reshape(-1, 1) - ay[near], bx_.reshape(-1, 1) - ax[near]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                t = np.clip((qy * dy[near] + qx * dx[near]) / seg2[near], 0.0, 1.0)
+            t = np.where(seg2[near] > 0, t, 0.0)
+            d2 = (qy - t * dy[near]) ** 2 + (qx - t * dx[near]) ** 2
+            mask[r:r + BLOCK, c:c + BLOCK] = (d2.min(axis=1) <= buffer_m * buffer_m).reshape(by_.shape)
+    return mask.ravel()
+
+
+def candidate_stations(s_lat: np.ndarray, s_lon: np.ndarray, lat: np.ndarray, lon: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the stations that can be among the `k` nearest of any of the points.
+
+    With c the centre of the points' bounding box, R the largest distance from c to a
+    point and D the k-th smallest station distance from c, every point has k stations
+    within D + R, so a station farther than D + 2R from c is never used.
+    """
+    if k <= 0 or k >= len(s_lat):
+        return np.arange(len(s_lat))
+    c_lat, c_lon = (lat.min() + lat.max()) / 2, (lon.min() + lon.max()) / 2
+    reach = float(haversine_m(c_lat, c_lon, lat, lon).max())
+    d = haversine_m(c_lat, c_lon, s_lat, s_lon)
+    kth = float(np.partition(d, k - 1)[k - 1])
+    return np.flatnonzero(d <= kth + 2 * reach + 1.0)
+
+
+def surface(geo: PackedGeo, s_lat, s_lon, values, z: int, x: int, y: int, size: int = TILE_SIZE,
+            buffer_m: float = CORRIDOR_M, k: int = IDW_K) -> np.ndarray:
+    """(size, size) float32 IDW surface of per-station `values`, NaN outside the corridor."""
+    lat, lon = pixel_centers(z, x, y, size)
+    mask = corridor_mask(geo, lat, lon, buffer_m, size)
+    grid = np.full(size * size, np.nan, dtype=np.float32)
+    values = np.asarray(values, dtype=np.float64)
+    if not mask.any() or not len(values):
+        return grid.reshape(size, size)
+    s_lat, s_lon = np.asarray(s_lat, dtype=np.float64), np.asarray(s_lon, dtype=np.float64)
+    # blend block by block, each against the few stations that can reach it
+    idx = np.arange(size * size).reshape(size, size)
+    for r in range(0, size, BLOCK):
+        for c in range(0, size, BLOCK):
+            px = idx[r:r + BLOCK, c:c + BLOCK].ravel()
+            px = px[mask[px]]
+            if len(px) == 0:
+                continue
+            use = candidate_stations(s_lat, s_lon, lat[px], lon[px], k)
+            blended, _, _ = idw_predict(lat[px], lon[px], s_lat[use], s_lon[use], values[use, None], k=k)
+            grid[px] = blended[:, 0]
+    return grid.reshape(size, size)
+
+
+def colorize(grid: np.ndarray, param: str) -> np.ndarray:
+    """RGBA uint8 image of `grid` on the colour scale of `param`; NaN is transparent."""
+    transform, good, poor = SCALES[param]
+    v = grid.astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if transform == 'ph':
+            v = np.abs(v - 7.5)
+        elif transform == 'log10':
+            v = np.log10(np.maximum(v, 1.0))
+        t = np.clip((v - good) / (poor - good), 0.0, 1.0) * (len(_RAMP) - 1)
+    valid = np.isfinite(t)
+    t = np.where(valid, t, 0.0)
+    i = np.minimum(t.astype(np.int64), len(_RAMP) - 2)
+    frac = (t - i)[..., None]
+    rgb = _RAMP[i] * (1 - frac) + _RAMP[i + 1] * frac
+    rgba = np.zeros(grid.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = np.rint(rgb)
+    rgba[..., 3] = np.where(valid, _ALPHA, 0)
+    return rgba
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """8-bit RGBA PNG with the stdlib only (filter type 0 on every row)."""
+    h, w = rgba.shape[:2]
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(h, w * 4)
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 6, 0, 0, 0))
+            + _png_chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + _png_chunk(b'IEND', b''))
+
+
+def encode(grid: np.ndarray, param: str, fmt: str) -> bytes:
+    if fmt == 'f32':
+        return np.ascontiguousarray(grid, dtype='<f4').tobytes()
+    return encode_png(colorize(grid, param))
+
+
+def version(paths: Iterable[Path], settings: Optional[Dict] = None) -> str:
+    """Short hash of the given files (name, size, mtime; directories recursively) and settings."""
+    h = hashlib.sha1(repr(sorted((settings or {}).items())).encode())
+    for p in paths:
+        p = Path(p)
+        files = sorted(f for f in p.rglob('*') if f.is_file()) if p.is_dir() else [p]
+        for f in files:
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            h.update(f'{f.name}:{st.st_size}:{st.st_mtime_ns};'.encode())
+    return h.hexdigest()[:12]
+
+
+def cache_key(model_version: str, param: str, month: int, year: int, z: int, x: int, y: int, fmt: str) -> str:
+    return f'{model_version}/{param}/{year}-{month:02d}/{z}/{x}/{y}.{fmt}'
+
+
+class TileCache:
+    """Bounded in-memory LRU in front of an optional, size-capped on-disk tile directory.
+
+    Keys are `cache_key`s; their first component (the version) names a subdirectory.
+    """
+
+    def __init__(self, max_tiles: int = CACHE_TILES, directory: Optional[str] = CACHE_DIR,
+                 max_bytes: int = CACHE_BYTES):
+        self.max_tiles = max_tiles
+        self.directory = Path(directory) if directory else None
+        self.max_bytes = max_bytes
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        # bytes under the current version's directory, counted on the first write
+        self._disk_bytes: Optional[int] = None
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._mem.get(key)
+            if data is not None:
+                self._mem.move_to_end(key)
+        metrics.cache_lookup('tiles_memory', data is not None)
+        if data is not None or self.directory is None:
+            return data
+        try:
+            data = (self.directory / key).read_bytes()
+        except OSError:
+            data = None
+        metrics.cache_lookup('tiles_disk', data is not None)
+        if data is not None:
+            self._remember(key, data)
+            try:
+                # the mtime orders tiles for trimming
+                os.utime(self.directory / key)
+            except OSError:
+                pass
+        return data
+
+    def put(self, key: str, data: bytes):
+        self._remember(key, data)
+        if self.directory is None:
+            return
+        path = self.directory / key
+        if self._disk_bytes is None:
+            self._open_version(key.split('/', 1)[0])
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                old = path.stat().st_size
+            except OSError:
+                old = 0
+            # write then rename so concurrent readers never see a partial tile
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        with self._disk_lock:
+            self._disk_bytes += len(data) - old
+            over = self._disk_bytes > self.max_bytes
+        if over:
+            self._trim(key.split('/', 1)[0])
+
+    def _open_version(self, version: str):
+        """Delete other versions' directories (in the background) and count this one's bytes."""
+        with self._disk_lock:
+            if self._disk_bytes is not None:
+                return
+            try:
+                stale = [p for p in self.directory.iterdir() if p.is_dir() and p.name != version]
+            except OSError:
+                stale = []
+            if stale:
+                threading.Thread(target=lambda: [shutil.rmtree(p, ignore_errors=True) for p in stale],
+                                 name='tile-cache-prune', daemon=True).start()
+            self._disk_bytes = sum(size for _, size, _ in self._files(version))
+
+    def _files(self, version: str):
+        """(mtime, size, path) of the tile files of `version`."""
+        out = []
+        for f in (self.directory / version).rglob('*'):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            if f.is_file():
+                out.append((st.st_mtime_ns, st.st_size, f))
+        return out
+
+    def _trim(self, version: str):
+        """Delete the least recently used tile files until the directory is under `_TRIM_TO` of the cap."""
+        with self._disk_lock:
+            if self._disk_bytes <= self.max_bytes:
+                return
+            files = sorted(self._files(version), key=lambda t: t[0])
+            total = sum(size for _, size, _ in files)
+            for _, size, f in files:
+                if total <= self.max_bytes * _TRIM_TO:
+                    break
+                try:
+                    f.unlink()
+                except OSError:
+                    continue
+                total -= size
+                try:
+                    f.parent.rmdir()
+                except OSError:
+                    pass
+            self._disk_bytes = total
+
+    def _remember(self, key: str, data: bytes):
+        if self.max_tiles <= 0:
+            return
+        with self._lock:
+            self._mem[key] = data
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_tiles:
+                self._mem.popitem(last=False)
@@ -1,4 +1,4 @@
-from backend.main import _river_paths, _project_point_on_segment, interpolate_predict
+from backend.main import _river_paths, _project_point_on_segment, run_interpolation
 import json
 p={'latitude':18.53,'longitude':73.855}
 best=None
@@ -11,5 +11,5 @@ for name,path in _river_paths.items():
 print('best path, seg index:', best[0], best[1])
 print('proj_point:', best[2], 't:', best[3], 'dist2:', best[4])
 print('segment endpoints:', best[5], best[6])
-res=interpolate_predict({'point':p,'points':12,'month':6,'year':2023,'follow_river':True})
+res=run_interpolation({'point':p,'points':12,'month':6,'year':2023,'follow_river':True})
 print(json.dumps(res,indent=2))
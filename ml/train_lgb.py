@@ -13,6 +13,14 @@ import lightgbm as lgb
 
 MONTH_MAP = {m: i for i, m in enumerate(['January','February','March','April','May','June','July','August','September','October','November','December'], start=1)}
 
+MODELS_DIR = 'backend/models'
+TARGET_COLS = ['pH','DO (mg/L)','BOD (mg/L)','FC MPN/100ml','TC MPN/100ml']
+# target transforms: use log1p for heavily skewed count targets
+TRANSFORM_MAP = {
+    'FC MPN/100ml': 'log1p',
+    'TC MPN/100ml': 'log1p'
+}
+
 
 def clean_number(x):
     if pd.isna(x):
@@ -30,11 +38,13 @@ def clean_number(x):
 
 def load_and_preprocess(path):
     df = pd.read_csv(path)
+    # skip fully blank rows so row positions match data_split.py's manifests
+    df = df.dropna(how='all').reset_index(drop=True)
     # drop rows with Lockdown or other non-numeric markers in Water Quality? keep and let targets be NaN
     # map Month name to number
     df['MonthNum'] = df['Month'].map(MONTH_MAP)
     # clean numeric targets
-    for col in ['pH','DO (mg/L)','BOD (mg/L)','FC MPN/100ml','TC MPN/100ml']:
+    for col in TARGET_COLS:
         if col in df.columns:
             df[col] = df[col].apply(clean_number)
 
@@ -44,6 +54,33 @@ def load_and_preprocess(path):
     return df
 
 
+def load_manifest_split(manifest_dir, split='0'):
+    """Load a train/test split from a `data_split.py --manifest` directory.
+
+    The source file is parsed once; the memory-mapped row-index parts select the
+    train and test frames. `split` is a split name or its position in the manifest.
+    """
+    with open(os.path.join(manifest_dir, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    splits = manifest['splits']
+    if str(split).isdigit():
+        spec = splits[int(split)]
+    else:
+        matches = [s for s in splits if s['name'] == split]
+        if not matches:
+            raise SystemExit(f'Split {split!r} not in manifest (have {[s["name"] for s in splits]})')
+        spec = matches[0]
+
+    df = load_and_preprocess(os.path.join(manifest_dir, manifest['source']))
+    if len(df) != manifest['n_rows']:
+        raise SystemExit(f'Source has {len(df)} rows but manifest expects {manifest["n_rows"]}; re-run data_split.py.')
+    parts = [np.load(os.path.join(manifest_dir, p), mmap_mode='r') for p in manifest['parts']]
+    test_idx = np.concatenate([parts[k] for k in spec['test']])
+    train_idx = np.concatenate([p for k, p in enumerate(parts) if k not in spec['test']])
+    print(f'Split {spec["name"]}: train={len(train_idx)} test={len(test_idx)}')
+    return df.iloc[np.sort(train_idx)].reset_index(drop=True), df.iloc[np.sort(test_idx)].reset_index(drop=True)
+
+
 def build_features(df, le_river=None, le_loc=None, fit_encoders=False):
     X = pd.DataFrame()
     # river & location encoders
@@ -71,31 +108,126 @@ def train_per_target(X_train, y_train, X_val, y_val, target_name):
     return model
 
 
-def main(args):
-    os.makedirs('backend/models', exist_ok=True)
+def model_path(target):
+    return f'{MODELS_DIR}/{target.replace(" ","_").replace("/","_")}.joblib'
 
-    print('Loading...')
-    df_train = load_and_preprocess(args.train)
-    df_test = load_and_preprocess(args.test)
 
-    # drop rows with all targets NaN
-    target_cols = ['pH','DO (mg/L)','BOD (mg/L)','FC MPN/100ml','TC MPN/100ml']
-    # fit encoders on train
-    X_train, le_river, le_loc = build_features(df_train, fit_encoders=True)
-    X_test, _, _ = build_features(df_test, le_river=le_river, le_loc=le_loc, fit_encoders=False)
+def transform_target(y_raw, transform):
+    if transform == 'log1p':
+        # guard against negative values
+        return np.log1p(np.clip(y_raw, 0, None))
+    return y_raw
+
+
+def inverse_target(y_pred, transform):
+    if transform == 'log1p':
+        # clip small negative numerical artifacts to zero
+        return np.clip(np.expm1(y_pred), 0, None)
+    return y_pred
+
+
+def save_outputs(models, metrics, le_river, le_loc):
+    joblib.dump({'le_river': le_river, 'le_loc': le_loc}, f'{MODELS_DIR}/encoders.joblib')
+    for t, m in models.items():
+        joblib.dump(m, model_path(t))
+    # save transform metadata so backend can inverse-transform if needed
+    with open(f'{MODELS_DIR}/transforms.json', 'w') as tf:
+        json.dump(TRANSFORM_MAP, tf, indent=2)
+    with open(f'{MODELS_DIR}/metrics.json', 'w') as f:
+        json.dump(metrics, f, indent=2)
+    export_compact(models, le_river, le_loc)
+
+
+def _flatten_tree(node, feats, thrs, children, flags, leaves):
+    """Append one dumped LightGBM tree to the flat arrays; return its encoded root.
+
+    Internal nodes are referenced by their global index (>= 0) and leaves by the
+    bitwise complement of their global leaf index (< 0).
+    """
+    if 'leaf_value' in node:
+        leaves.append(float(node['leaf_value']))
+        return ~(len(leaves) - 1)
+    if node.get('decision_type', '<=') != '<=':
+        raise ValueError(f'unsupported decision_type {node.get("decision_type")!r} in split {node.get("split_index")}')
+    idx = len(feats)
+    feats.append(int(node['split_feature']))
+    thrs.append(float(node['threshold']))
+    children.append([0, 0])
+    missing = node.get('missing_type', 'None')
+    flags.append((1 if node.get('default_left') else 0) | (2 if missing == 'NaN' else 0) | (4 if missing == 'Zero' else 0))
+    children[idx][0] = _flatten_tree(node['left_child'], feats, thrs, children, flags, leaves)
+    children[idx][1] = _flatten_tree(node['right_child'], feats, thrs, children, flags, leaves)
+    return idx
+
+
+def export_compact(models, le_river, le_loc, out_dir=None):
+    """Write boosters as flat typed arrays plus `manifest.json` for the backend loader.
+
+    Each target gets `<stem>.<field>.npy` files (split_feature, threshold, children,
+    flags, leaf_value, roots) that `backend/compact_models.py` memory-maps, so serving
+    needs neither LightGBM nor sklearn and worker processes share the pages.
+    """
+    out_dir = out_dir or f'{MODELS_DIR}/compact'
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {
+        'format': 'wq-compact-trees',
+        'version': 1,
+        'features': None,
+        'encoders': {'le_river': [str(c) for c in le_river.classes_], 'le_loc': [str(c) for c in le_loc.classes_]},
+        'transforms': {t: TRANSFORM_MAP[t] for t in models if t in TRANSFORM_MAP},
+        'targets': {},
+    }
+    for target, model in models.items():
+        dump = model.booster_.dump_model()
+        if manifest['features'] is None:
+            manifest['features'] = dump['feature_names']
+        feats, thrs, children, flags, leaves, roots = [], [], [], [], [], []
+        for tree in dump['tree_info']:
+            roots.append(_flatten_tree(tree['tree_structure'], feats, thrs, children, flags, leaves))
+        stem = os.path.basename(model_path(target))[:-len('.joblib')]
+        arrays = {
+            'split_feature': np.asarray(feats, dtype=np.int32),
+            'threshold': np.asarray(thrs, dtype=np.float64),
+            'children': np.asarray(children, dtype=np.int32).reshape(-1, 2),
+            'flags': np.asarray(flags, dtype=np.uint8),
+            'leaf_value': np.asarray(leaves, dtype=np.float64),
+            'roots': np.asarray(roots, dtype=np.int32),
+        }
+        for field, arr in arrays.items():
+            np.save(f'{out_dir}/{stem}.{field}.npy', arr)
+        manifest['targets'][target] = {'stem': stem, 'n_trees': len(roots), 'n_nodes': len(feats), 'n_leaves': len(leaves)}
+    with open(f'{out_dir}/manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f'Exported {len(models)} compact models to {out_dir}/')
+    return manifest
 
-    # Save encoders
-    joblib.dump({'le_river': le_river, 'le_loc': le_loc}, 'backend/models/encoders.joblib')
+
+def load_saved():
+    """Load encoders, boosters and metrics previously written to backend/models/."""
+    enc = joblib.load(f'{MODELS_DIR}/encoders.joblib')
+    models = {}
+    for target in TARGET_COLS:
+        if os.path.exists(model_path(target)):
+            models[target] = joblib.load(model_path(target))
+    metrics = {}
+    if os.path.exists(f'{MODELS_DIR}/metrics.json'):
+        with open(f'{MODELS_DIR}/metrics.json') as f:
+            metrics = json.load(f)
+    return models, enc['le_river'], enc['le_loc'], metrics
+
+
+def train_full(df_train, df_test):
+    # fit encoders on the categories of both frames so station-grouped splits,
+    # whose test stations never occur in train, can still be encoded
+    le_river = LabelEncoder().fit(pd.concat([df_train['River'], df_test['River']]).astype(str))
+    le_loc = LabelEncoder().fit(pd.concat([df_train['Location'], df_test['Location']]).astype(str))
+    X_train, _, _ = build_features(df_train, le_river=le_river, le_loc=le_loc, fit_encoders=False)
+    X_test, _, _ = build_features(df_test, le_river=le_river, le_loc=le_loc, fit_encoders=False)
 
     models = {}
     metrics = {}
-    # target transforms: use log1p for heavily skewed count targets
-    transform_map = {
-        'FC MPN/100ml': 'log1p',
-        'TC MPN/100ml': 'log1p'
-    }
 
-    for target in target_cols:
+    for target in TARGET_COLS:
         print(f'Training for {target}...')
         # remove NaNs for this target
         mask = df_train[target].notna()
@@ -103,14 +235,8 @@ def main(args):
             print(f'  Not enough data for {target}, skipping.')
             continue
         X_t = X_train[mask]
-        y_t_raw = df_train.loc[mask, target].values
-        # apply transform if configured
-        transform = transform_map.get(target)
-        if transform == 'log1p':
-            # guard against negative values
-            y_t = np.log1p(np.clip(y_t_raw, 0, None))
-        else:
-            y_t = y_t_raw
+        transform = TRANSFORM_MAP.get(target)
+        y_t = transform_target(df_train.loc[mask, target].values, transform)
         X_tr, X_val, y_tr, y_val = train_test_split(X_t, y_t, test_size=0.12, random_state=42)
         model = train_per_target(X_tr, y_tr, X_val, y_val, target)
         models[target] = model
@@ -118,14 +244,7 @@ def main(args):
         mask_test = df_test[target].notna()
         if mask_test.sum() > 0:
             y_true = df_test.loc[mask_test, target].values
-            y_pred_trans = model.predict(X_test.loc[mask_test])
-            # inverse transform if needed
-            if transform == 'log1p':
-                y_pred = np.expm1(y_pred_trans)
-                # clip small negative numerical artifacts to zero
-                y_pred = np.clip(y_pred, 0, None)
-            else:
-                y_pred = y_pred_trans
+            y_pred = inverse_target(model.predict(X_test.loc[mask_test]), transform)
             mae = mean_absolute_error(y_true, y_pred)
             # compute RMSE in a backward-compatible way
             mse = mean_squared_error(y_true, y_pred)
@@ -135,24 +254,136 @@ def main(args):
         else:
             metrics[target] = {'mae': None, 'rmse': None, 'n_test': 0}
 
-    # save models and metrics
-    for t, m in models.items():
-        fname = f'backend/models/{t.replace(" ","_").replace("/","_")}.joblib'
-        joblib.dump(m, fname)
-    # save transform metadata so backend can inverse-transform if needed
-    with open('backend/models/transforms.json', 'w') as tf:
-        json.dump(transform_map, tf, indent=2)
-    with open('backend/models/metrics.json', 'w') as f:
-        json.dump(metrics, f, indent=2)
+    save_outputs(models, metrics, le_river, le_loc)
 
     print('\nTraining complete. Models and encoders saved to backend/models/.')
     print('Metrics:')
     print(json.dumps(metrics, indent=2))
+    return models, metrics
+
+
+def extend_encoder(le, values):
+    """Append unseen classes to a fitted LabelEncoder without re-sorting.
+
+    Existing classes keep their integer codes; new ones get the next free codes in
+    order of first appearance. Returns the list of appended classes.
+    """
+    known = set(le.classes_.tolist())
+    added = []
+    for v in pd.unique(values.astype(str)):
+        if v not in known:
+            known.add(v)
+            added.append(v)
+    if added:
+        le.classes_ = np.concatenate([le.classes_.astype(object), np.array(added, dtype=object)])
+    return added
+
+
+def drift_report(models, metrics, df_new, X_new, unseen_mask):
+    """Score the current boosters on the new rows and compare with the stored test MAE.
+
+    A target's drift ratio is MAE(new rows) / MAE(test set at last full training).
+    """
+    report = {'unseen_fraction': float(unseen_mask.mean()) if len(unseen_mask) else 0.0, 'targets': {}}
+    for target, model in models.items():
+        mask = df_new[target].notna().values & ~unseen_mask
+        ref = (metrics.get(target) or {}).get('mae')
+        entry = {'n': int(mask.sum()), 'mae': None, 'ref_mae': ref, 'ratio': None}
+        if mask.sum() > 0:
+            y_pred = inverse_target(model.predict(X_new[mask]), TRANSFORM_MAP.get(target))
+            mae = float(mean_absolute_error(df_new.loc[mask, target].values, y_pred))
+            entry['mae'] = mae
+            if ref:
+                entry['ratio'] = mae / ref
+        report['targets'][target] = entry
+    return report
+
+
+def update(args):
+    """Continue training the saved boosters on new rows only (LightGBM `init_model`).
+
+    Falls back to a full retrain on `--train` + new rows when the drift report crosses
+    `--drift-threshold` or too many new rows belong to categories the trees never saw.
+    """
+    print('Loading existing models...')
+    models, le_river, le_loc, metrics = load_saved()
+    if not models:
+        raise SystemExit(f'No boosters found under {MODELS_DIR}/; run a full training first.')
+
+    df_new = load_and_preprocess(args.update).reset_index(drop=True)
+    known_rivers = set(le_river.classes_.tolist())
+    known_locs = set(le_loc.classes_.tolist())
+    unseen_mask = (~df_new['River'].astype(str).isin(known_rivers) | ~df_new['Location'].astype(str).isin(known_locs)).values
+    added_rivers = extend_encoder(le_river, df_new['River'])
+    added_locs = extend_encoder(le_loc, df_new['Location'])
+    X_new, _, _ = build_features(df_new, le_river=le_river, le_loc=le_loc, fit_encoders=False)
+    if added_rivers or added_locs:
+        print(f'  New rivers: {added_rivers}  new locations: {added_locs}')
+
+    report = drift_report(models, metrics, df_new, X_new, unseen_mask)
+    drifted = [t for t, e in report['targets'].items() if e['ratio'] is not None and e['ratio'] > args.drift_threshold]
+    print('Drift report:')
+    print(json.dumps(report, indent=2))
+
+    if drifted or report['unseen_fraction'] > args.max_unseen:
+        reason = f'drift in {drifted}' if drifted else f'unseen fraction {report["unseen_fraction"]:.2f}'
+        print(f'\nFalling back to full retrain ({reason}).')
+        if not (args.train and args.test):
+            raise SystemExit('Full retrain needs --train and --test.')
+        df_train = pd.concat([load_and_preprocess(args.train), df_new], ignore_index=True)
+        return train_full(df_train, load_and_preprocess(args.test))
+
+    for target, old in models.items():
+        mask = df_new[target].notna().values
+        if mask.sum() == 0:
+            print(f'No new rows for {target}, keeping booster.')
+            continue
+        print(f'Updating {target} on {int(mask.sum())} rows...')
+        y_t = transform_target(df_new.loc[mask, target].values, TRANSFORM_MAP.get(target))
+        # small monthly batches cannot satisfy LightGBM's default min_child_samples=20
+        model = lgb.LGBMRegressor(n_estimators=args.update_rounds, learning_rate=0.05, num_leaves=31,
+                                  min_child_samples=max(1, min(20, int(mask.sum()) // 4)))
+        model.fit(X_new[mask], y_t, init_model=old.booster_)
+        models[target] = model
+        entry = metrics.setdefault(target, {'mae': None, 'rmse': None, 'n_test': 0})
+        entry['last_update'] = {'rows': int(mask.sum()), 'rounds': args.update_rounds, 'drift_ratio': report['targets'][target]['ratio']}
+
+    save_outputs(models, metrics, le_river, le_loc)
+    print('\nUpdate complete. Boosters and encoders saved to backend/models/.')
+    return models, metrics
+
+
+def main(args):
+    os.makedirs(MODELS_DIR, exist_ok=True)
+
+    if args.export_only:
+        models, le_river, le_loc, _ = load_saved()
+        return export_compact(models, le_river, le_loc)
+    if args.update:
+        return update(args)
+    print('Loading...')
+    if args.manifest:
+        df_train, df_test = load_manifest_split(args.manifest, args.split)
+    elif args.train and args.test:
+        df_train = load_and_preprocess(args.train)
+        df_test = load_and_preprocess(args.test)
+    else:
+        raise SystemExit('--train and --test (or --manifest) are required unless --update is given.')
+    return train_full(df_train, df_test)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--train', required=True)
-    parser.add_argument('--test', required=True)
+    parser.add_argument('--train')
+    parser.add_argument('--test')
+    parser.add_argument('--manifest', help='split manifest directory written by data_split.py --manifest')
+    parser.add_argument('--split', default='0', help='split name or position within --manifest')
+    parser.add_argument('--export-only', action='store_true', help='re-export the saved boosters to backend/models/compact/ without training')
+    parser.add_argument('--update', help='CSV of new observations; continue training the saved boosters on these rows only')
+    parser.add_argument('--update-rounds', type=int, default=50, help='boosting rounds to add per target in update mode')
+    parser.add_argument('--drift-threshold', type=float, default=2.0,
+                        help='retrain fully when MAE on new rows exceeds this multiple of the stored test MAE')
+    parser.add_argument('--max-unseen', type=float, default=0.25,
+                        help='retrain fully when more than this fraction of new rows has unseen river/location')
     args = parser.parse_args()
     main(args)
@@ -1,4 +1,4 @@
-import React, { useEffect, useState, useCallback } from 'react';
+import React, { useEffect, useState, useCallback, useRef } from 'react';
 import { MapContainer, TileLayer, Marker, Popup, CircleMarker, Polyline, useMapEvents } from 'react-leaflet';
 import L from 'leaflet';
 import 'leaflet/dist/leaflet.css';
@@ -437,32 +437,111 @@ export default function App() {
   const clearStart = () => { setStartPoint(null); setInterpPoints([]); };
   const clearEnd = () => { setEndPoint(null); setInterpPoints([]); };
 
-  // Fetch predictions for all stations when app loads or selectedDate changes
+  const toPredictions = (rows) => {
+    // Map predictions to station id
+    const preds = {};
+    rows.forEach((pred) => {
+      // Find location by name
+      const loc = puneLocations.find(l => l.name === pred.location);
+      if (loc && loc.id) preds[loc.id] = pred;
+    });
+    return preds;
+  };
+
+  // Live predictions while the date changes: one WebSocket that only receives the values
+  // that changed since the last step (backend/scrub.py); /predict_all while it is closed
+  // or when it cannot answer a cursor
+  const scrub = useRef({ ws: null, open: false, cursor: null, state: null, seq: 0 });
+
+  // /predict_all for `cursor`; the answer is dropped if the date moved on meanwhile
+  const fetchAll = useCallback(async (cursor) => {
+    try {
+      const res = await fetch(`${API_BASE}/predict_all?month=${cursor.month}&year=${cursor.year}`);
+      const jb = await res.json();
+      if (scrub.current.cursor === cursor && jb && jb.predictions) {
+        setPredictions(toPredictions(jb.predictions));
+      }
+    } catch (err) {
+      // Optionally handle error
+    }
+  }, []);
+
   useEffect(() => {
-    async function fetchPredictions() {
-      if (!selectedDate) return;
-      try {
-        const d = new Date(selectedDate);
-        const month = d.getMonth() + 1;
-        const year = d.getFullYear();
-        const res = await fetch(`${API_BASE}/predict_all?month=${month}&year=${year}`);
-        const jb = await res.json();
-        if (jb && jb.predictions) {
-          // Map predictions to station id
-          const preds = {};
-          jb.predictions.forEach((pred) => {
-            // Find location by name
-            const loc = puneLocations.find(l => l.name === pred.location);
-            if (loc && loc.id) preds[loc.id] = pred;
+    if (typeof WebSocket === 'undefined') return undefined;
+    let ws = null;
+    let retry = null;
+    let delay = 1000;
+    let disposed = false;
+
+    const connect = () => {
+      ws = new WebSocket(`${API_BASE.replace(/^http/, 'ws')}/ws/predict_all`);
+      scrub.current.ws = ws;
+      ws.onopen = () => {
+        scrub.current.open = true;
+        delay = 1000;
+        if (scrub.current.cursor) ws.send(JSON.stringify({ ...scrub.current.cursor, full: true }));
+      };
+      ws.onclose = () => {
+        const wasOpen = scrub.current.open;
+        scrub.current.open = false;
+        scrub.current.state = null;
+        if (disposed) return;
+        // a cursor sent on the socket may never be answered now
+        if (wasOpen && scrub.current.cursor) fetchAll(scrub.current.cursor);
+        // reconnect with exponential backoff, up to 30 s between attempts
+        retry = setTimeout(connect, delay);
+        delay = Math.min(delay * 2, 30000);
+      };
+      ws.onmessage = (ev) => {
+        const msg = JSON.parse(ev.data);
+        if (msg.type === 'error') {
+          // the server could not answer this cursor: ask /predict_all instead
+          const cursor = scrub.current.cursor;
+          console.warn('scrub:', msg.error);
+          if (cursor && msg.seq === cursor.seq) fetchAll(cursor);
+          return;
+        }
+        if (msg.type === 'full') {
+          scrub.current.state = { stations: msg.stations, values: msg.values };
+        } else if (msg.type === 'diff' && scrub.current.state) {
+          Object.entries(msg.changed).forEach(([col, ch]) => {
+            const vals = scrub.current.state.values[col];
+            ch.index.forEach((i, k) => { vals[i] = ch.values[k]; });
           });
-          setPredictions(preds);
+        } else {
+          return;
         }
-      } catch (err) {
-        // Optionally handle error
-      }
+        const { stations, values } = scrub.current.state;
+        const rows = stations.location.map((name, i) => {
+          const row = { location: name, river: stations.river[i], month: msg.month, year: msg.year };
+          Object.keys(values).forEach((col) => { row[col] = values[col][i]; });
+          return row;
+        });
+        setPredictions(toPredictions(rows));
+      };
+    };
+
+    connect();
+    return () => {
+      disposed = true;
+      clearTimeout(retry);
+      if (ws) ws.close();
+    };
+  }, [fetchAll]);
+
+  // Fetch predictions for all stations when app loads or selectedDate changes
+  useEffect(() => {
+    if (!selectedDate) return;
+    const d = new Date(selectedDate);
+    scrub.current.seq += 1;
+    const cursor = { month: d.getMonth() + 1, year: d.getFullYear(), seq: scrub.current.seq };
+    scrub.current.cursor = cursor;
+    if (scrub.current.open) {
+      scrub.current.ws.send(JSON.stringify(cursor));
+      return;
     }
-    fetchPredictions();
-  }, [selectedDate]);
+    fetchAll(cursor);
+  }, [selectedDate, fetchAll]);
 
   return (
     <div className="page">